@@ -1,5 +1,7 @@
+import queue
 import pyaudio
 import wave
+from audio_utils import WHISPER_SAMPLE_RATE, AudioRingBuffer, StreamResampler, pcm16_to_float_mono
 
 class AudioRecorder:
     def __init__(self, chunk=1024, format=pyaudio.paInt16, channels=2, rate=44100, output_filename="recordings/output.wav"):
@@ -13,10 +15,22 @@ class AudioRecorder:
         self.output_filename = output_filename
         self.p = pyaudio.PyAudio()
 
-    def record(self, record_seconds=5):
+    def record(self, record_seconds=5, save_to_disk=True, max_buffer_seconds=None):
         """
         Record audio for a specified number of seconds.
+
+        Frames are written into a preallocated ring buffer rather than a growing list. The
+        recording is returned as a 16 kHz mono float32 array that can be passed straight to
+        the transcriber; writing the WAV file is optional.
+
+        Args:
+            record_seconds (float): How long to record.
+            save_to_disk (bool): Also write the recording to output_filename.
+            max_buffer_seconds (float): Keep at most this much of the most recent audio.
         """
+        if self.format != pyaudio.paInt16:
+            raise ValueError("In-memory recording only supports paInt16 audio")
+
         stream = self.p.open(format=self.format,
                              channels=self.channels,
                              rate=self.rate,
@@ -25,11 +39,12 @@ class AudioRecorder:
 
         print("* recording")
 
-        frames = []
+        num_chunks = int(self.rate / self.chunk * record_seconds)
+        buffer_seconds = min(record_seconds, max_buffer_seconds or record_seconds)
+        ring = AudioRingBuffer(max(self.chunk, int(self.rate * buffer_seconds)), self.channels)
 
-        for _ in range(0, int(self.rate / self.chunk * record_seconds)):
-            data = stream.read(self.chunk)
-            frames.append(data)
+        for _ in range(0, num_chunks):
+            ring.write(stream.read(self.chunk))
 
         print("* done recording")
 
@@ -37,17 +52,75 @@ class AudioRecorder:
         stream.close()
         self.p.terminate()
 
-        self.save(frames)
+        if save_to_disk:
+            self.save(ring.frames())
+        return ring.to_whisper_array(self.rate)
+
+    def stream(self, stop_event=None, max_queued_chunks=64):
+        """
+        Capture audio with a callback and yield 16 kHz mono float32 chunks until stop_event is set.
+
+        PortAudio pushes raw chunks into a bounded queue from its own thread, so capture keeps
+        running while the consumer processes earlier chunks. If the consumer falls behind by
+        more than max_queued_chunks, the newest chunks are dropped instead of growing memory.
+
+        The device is opened at 16 kHz when it supports it; otherwise chunks are low-pass
+        filtered and resampled by one StreamResampler, which carries its state across chunks.
+        """
+        if self.format != pyaudio.paInt16:
+            raise ValueError("Streaming capture only supports paInt16 audio")
+
+        chunks = queue.Queue(maxsize=max_queued_chunks)
+
+        def on_audio(in_data, frame_count, time_info, status):
+            try:
+                chunks.put_nowait(in_data)
+            except queue.Full:
+                print("* dropped audio chunk, consumer is falling behind")
+            return (None, pyaudio.paContinue)
+
+        rate = WHISPER_SAMPLE_RATE if self._supports_rate(WHISPER_SAMPLE_RATE) else self.rate
+        resampler = StreamResampler(rate)
+        stream = self.p.open(format=self.format,
+                             channels=self.channels,
+                             rate=rate,
+                             input=True,
+                             frames_per_buffer=self.chunk,
+                             stream_callback=on_audio)
+        stream.start_stream()
+        print("* streaming")
+
+        try:
+            while stop_event is None or not stop_event.is_set():
+                try:
+                    data = chunks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                yield resampler.process(pcm16_to_float_mono(data, self.channels))
+        finally:
+            print("* done streaming")
+            stream.stop_stream()
+            stream.close()
+
+    def _supports_rate(self, rate):
+        """Whether the default input device can capture at rate with this format and channel count."""
+        try:
+            return self.p.is_format_supported(rate,
+                                              input_device=self.p.get_default_input_device_info()["index"],
+                                              input_channels=self.channels,
+                                              input_format=self.format)
+        except (IOError, ValueError):
+            return False
 
     def save(self, frames):
         """
-        Save the recorded frames to a WAV file.
+        Save the recorded frames (a list of byte chunks or an int16 array) to a WAV file.
         """
         wf = wave.open(self.output_filename, 'wb')
         wf.setnchannels(self.channels)
         wf.setsampwidth(self.p.get_sample_size(self.format))
         wf.setframerate(self.rate)
-        wf.writeframes(b''.join(frames))
+        wf.writeframes(b''.join(frames) if isinstance(frames, list) else frames.tobytes())
         wf.close()
 
 
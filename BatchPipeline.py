@@ -0,0 +1,398 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from audio_utils import decode_audio_file
+from Metrics import metrics, observe_stage
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg", ".opus", ".webm", ".mp4")
+
+# Manifest statuses; decoded audio only lives in memory, so the first persisted step is the transcript
+PENDING = "pending"
+TRANSCRIBED = "transcribed"
+FORMATTED = "formatted"
+FAILED = "failed"
+
+PIPELINE_FILES = metrics.counter(
+    "batch_pipeline_files_total", "Files finished by the batch pipeline, by outcome.", ("outcome",)
+)
+
+# End-of-stream marker passed down the stage queues
+_DONE = object()
+
+
+def find_audio_files(source):
+    """
+    Audio files to process.
+
+    Args:
+        source (str): A directory (searched recursively for AUDIO_EXTENSIONS) or a text file
+            listing one audio path per line; relative paths are relative to the list file.
+
+    Returns:
+        list: Absolute paths, sorted for directories and in listed order otherwise.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for directory, _, names in os.walk(source):
+            paths.extend(
+                os.path.join(directory, name) for name in names if name.lower().endswith(AUDIO_EXTENSIONS)
+            )
+        return sorted(os.path.abspath(path) for path in paths)
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r") as list_file:
+        lines = [line.strip() for line in list_file]
+    return [os.path.abspath(os.path.join(base, line)) for line in lines if line and not line.startswith("#")]
+
+
+def fingerprint(path):
+    """Size and modification time, so a re-recorded file is processed again."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_atomic(path, text):
+    """Writes text through a temporary file so a crash never leaves a half-written output."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as output_file:
+        output_file.write(text)
+    os.replace(tmp_path, path)
+
+
+def _decode(path):
+    """Process-pool task: decodes one file and reports how long it took."""
+    started = time.perf_counter()
+    audio = decode_audio_file(path)
+    return audio, time.perf_counter() - started
+
+
+class Manifest:
+    """
+    Per-file progress of a batch run, kept as an append-only JSON-lines log.
+
+    Every update appends the file's full entry and is flushed to disk, so a crash loses at
+    most the step in progress. On load the last entry of each file wins; compact() rewrites
+    the log with one line per file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash mid-write leaves a truncated last line
+                        logger.warning(f"Skipping unreadable manifest line in {path}")
+                        continue
+                    self.entries[entry["path"]] = entry
+        self._file = None
+
+    def get(self, path):
+        return self.entries.get(path)
+
+    def update(self, path, **fields):
+        """Merges fields into a file's entry and appends it to the log."""
+        with self._lock:
+            entry = {**self.entries.get(path, {}), "path": path, **fields, "updated_at": round(time.time(), 3)}
+            self.entries[path] = entry
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            return entry
+
+    def compact(self):
+        """Rewrites the log with only the latest entry of each file."""
+        with self._lock:
+            self.close()
+            write_atomic(self.path, "".join(json.dumps(entry, ensure_ascii=False) + "\n"
+                                            for entry in self.entries.values()))
+
+    def counts(self):
+        """Number of files per status."""
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+@dataclass
+class PipelineItem:
+    """One audio file moving through the stages."""
+    path: str
+    transcript_path: str
+    script_path: str
+    audio: object = None
+    transcript: str = None
+
+
+class BatchPipeline:
+    """
+    Turns a batch of recordings into transcripts and formatted scripts.
+
+    Three stages run at the same time, connected by bounded queues so a fast stage can only
+    run a few files ahead of a slow one (which also caps how much decoded audio is held):
+
+      1. decoding and resampling in a process pool,
+      2. transcription on one dedicated thread (the Whisper model is loaded once),
+      3. formatting on another thread, in batches of whatever transcripts are ready.
+
+    Each finished step is recorded in the Manifest, so an interrupted run picks up where it
+    stopped: formatted files are skipped and transcribed ones go straight to formatting.
+    """
+
+    def __init__(self, manifest, output_dir, transcribe, format_batch=None, root=None, decode_workers=None,
+                 queue_size=4, format_batch_size=8, format_wait=1.0, max_attempts=3):
+        """
+        Args:
+            manifest (Manifest): Progress log of the run.
+            output_dir (str): Directory for `<file>.txt` transcripts and `<file>.script.txt` scripts, named
+                after each recording including its extension (`take1.wav.txt`).
+            transcribe (callable): `(16 kHz mono float32 array) -> str`.
+            format_batch (callable): `(list of transcripts) -> list of scripts or None`; None skips formatting.
+            root (str): Input directory that output names are relative to (default: common parent of the inputs).
+            decode_workers (int): Decoding processes (default: CPU count - 1).
+            queue_size (int): Capacity of each queue between stages.
+            format_batch_size (int): Most transcripts formatted together.
+            format_wait (float): Seconds to wait for more transcripts before formatting a partial batch.
+            max_attempts (int): Failed files are retried on later runs until they've failed this often.
+        """
+        self.manifest = manifest
+        self.output_dir = output_dir
+        self.transcribe = transcribe
+        self.format_batch = format_batch
+        self.root = root
+        self.decode_workers = decode_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.queue_size = queue_size
+        self.format_batch_size = format_batch_size
+        self.format_wait = format_wait
+        self.max_attempts = max_attempts
+        self._abort = threading.Event()
+        self._errors = []
+
+    def _item(self, path):
+        # The audio extension is kept so take1.wav and take1.mp3 don't write to the same files
+        base = os.path.join(self.output_dir, os.path.relpath(path, self.root))
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        return PipelineItem(path, base + ".txt", base + ".script.txt")
+
+    def plan(self, paths):
+        """
+        Splits the files by what is left to do, based on the manifest.
+
+        Returns:
+            tuple: (items to decode, items with a transcript to format, number skipped).
+        """
+        if self.root is None:
+            self.root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else "."
+        to_decode, to_format, skipped = [], [], 0
+        for path in paths:
+            entry = self.manifest.get(path) or {}
+            item = self._item(path)
+            try:
+                current = fingerprint(path)
+            except OSError as e:
+                self.manifest.update(path, status=FAILED, error=str(e), attempts=entry.get("attempts", 0) + 1)
+                skipped += 1
+                continue
+            if entry.get("fingerprint") != current:
+                # New or changed since the last run
+                self.manifest.update(path, status=PENDING, fingerprint=current, attempts=0, error=None,
+                                     transcript=None, script=None)
+                to_decode.append(item)
+            elif entry["status"] == FORMATTED or (entry["status"] == TRANSCRIBED and self.format_batch is None):
+                skipped += 1
+            elif entry["status"] == FAILED and entry.get("attempts", 0) >= self.max_attempts:
+                skipped += 1
+            elif entry.get("transcript") and os.path.exists(item.transcript_path) and self.format_batch is not None:
+                # Transcribed earlier (formatting may have failed); only formatting is left
+                with open(item.transcript_path, "r", encoding="utf-8") as transcript_file:
+                    item.transcript = transcript_file.read()
+                to_format.append(item)
+            else:
+                to_decode.append(item)
+        return to_decode, to_format, skipped
+
+    def run(self, paths):
+        """
+        Processes the files and returns a summary of the run.
+
+        Args:
+            paths (list): Absolute audio paths, e.g. from find_audio_files().
+
+        Returns:
+            dict: Files per status in the manifest, files handled this run and wall time.
+        """
+        started = time.perf_counter()
+        to_decode, to_format, skipped = self.plan(paths)
+        logger.info(f"{len(to_decode)} files to transcribe, {len(to_format)} to format, {skipped} skipped")
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        transcribed = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(target=self._stage, args=(self._decode_stage, to_decode, decoded),
+                             name="batch-decode", daemon=True),
+            threading.Thread(target=self._stage, args=(self._transcribe_stage, decoded, transcribed),
+                             name="batch-transcribe", daemon=True),
+            threading.Thread(target=self._stage, args=(self._format_stage, (to_format, transcribed), None),
+                             name="batch-format", daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        self.manifest.close()
+        if self._errors:
+            raise self._errors[0]
+        return {
+            "files": len(paths),
+            "processed": len(to_decode) + len(to_format),
+            "skipped": skipped,
+            "statuses": self.manifest.counts(),
+            "wall_seconds": round(time.perf_counter() - started, 2),
+        }
+
+    def _stage(self, body, source, sink):
+        """Runs a stage; an unexpected error stops the others and end-of-stream is always passed on."""
+        try:
+            body(source, sink)
+        except Exception as e:
+            logger.exception(f"Batch pipeline stage '{threading.current_thread().name}' failed")
+            self._errors.append(e)
+            self._abort.set()
+        finally:
+            if sink is not None:
+                self._put(sink, _DONE, force=True)
+
+    def _put(self, sink, item, force=False):
+        """Blocks while the next stage is busy; gives up if the run was aborted (unless force)."""
+        while True:
+            try:
+                sink.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if self._abort.is_set():
+                    if not force:
+                        return False
+                    # The consumer is gone; make room so end-of-stream still gets through
+                    try:
+                        sink.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _fail(self, item, stage, error):
+        entry = self.manifest.get(item.path) or {}
+        self.manifest.update(item.path, status=FAILED, stage=stage, error=str(error) or type(error).__name__,
+                             attempts=entry.get("attempts", 0) + 1)
+        PIPELINE_FILES.inc(outcome="failed")
+        logger.error(f"{stage} failed for {item.path}: {error}")
+
+    def _decode_stage(self, items, sink):
+        # spawn, not fork: the parent already runs threads and may hold loaded models
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.decode_workers, mp_context=context) as pool:
+            in_flight = deque()
+            for item in items:
+                in_flight.append((item, pool.submit(_decode, item.path)))
+                # Keep every worker busy, but don't decode further ahead than that
+                if len(in_flight) >= self.decode_workers and not self._forward_decoded(in_flight.popleft(), sink):
+                    break
+            while in_flight and not self._abort.is_set():
+                self._forward_decoded(in_flight.popleft(), sink)
+            for _, future in in_flight:
+                future.cancel()
+
+    def _forward_decoded(self, pending, sink):
+        item, future = pending
+        try:
+            item.audio, seconds = future.result()
+            observe_stage("audio_decode", seconds)
+        except Exception as e:
+            self._fail(item, "decode", e)
+            return not self._abort.is_set()
+        return self._put(sink, item)
+
+    def _transcribe_stage(self, source, sink):
+        while True:
+            item = source.get()
+            if item is _DONE or self._abort.is_set():
+                return
+            try:
+                item.transcript = self.transcribe(item.audio)
+                write_atomic(item.transcript_path, item.transcript)
+            except Exception as e:
+                self._fail(item, "transcribe", e)
+                continue
+            finally:
+                item.audio = None
+            self.manifest.update(item.path, status=TRANSCRIBED, transcript=item.transcript_path, stage=None, error=None)
+            if self.format_batch is None:
+                PIPELINE_FILES.inc(outcome="transcribed")
+                continue
+            if not self._put(sink, item):
+                return
+
+    def _format_stage(self, sources, _):
+        resumed, source = sources
+        for start in range(0, len(resumed), self.format_batch_size):
+            self._format(resumed[start:start + self.format_batch_size])
+
+        finished = False
+        while not finished and not self._abort.is_set():
+            item = source.get()
+            if item is _DONE:
+                return
+            batch = [item]
+            # Take whatever else is ready, waiting briefly for stragglers to fill the batch
+            deadline = time.monotonic() + self.format_wait
+            while len(batch) < self.format_batch_size:
+                try:
+                    item = source.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+            self._format(batch)
+
+    def _format(self, batch):
+        if not batch or self.format_batch is None:
+            return
+        try:
+            scripts = self.format_batch([item.transcript for item in batch])
+        except Exception as e:
+            for item in batch:
+                self._fail(item, "format", e)
+            return
+        for item, script in zip(batch, scripts):
+            if script is None:
+                self._fail(item, "format", "formatter returned no output")
+                continue
+            try:
+                write_atomic(item.script_path, script)
+            except OSError as e:
+                self._fail(item, "format", e)
+                continue
+            self.manifest.update(item.path, status=FORMATTED, script=item.script_path, stage=None, error=None)
+            PIPELINE_FILES.inc(outcome="formatted")
+            logger.info(f"Formatted {item.path}")
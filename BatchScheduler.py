@@ -0,0 +1,310 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from Metrics import BATCH_SIZE, metrics, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first: editor requests go ahead of bulk reformatting jobs
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+DROPPED_REQUESTS = metrics.counter(
+    "scheduler_dropped_requests_total",
+    "Requests rejected at admission or dropped before finishing, by priority and reason.",
+    ("priority", "reason"),
+)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a request is rejected because the inference queue is full."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        # Seconds after which a retry is likely to be admitted
+        self.retry_after = retry_after
+
+
+@dataclass
+class PendingRequest:
+    """A single queued generation request waiting to be batched."""
+    prompt: str
+    # None lets HuggingFaceAI size the budget to each prompt
+    max_new_tokens: Optional[int]
+    return_full_text: bool
+    task: str
+    future: asyncio.Future
+    priority: str = INTERACTIVE
+    # time.monotonic() after which the caller no longer wants the result
+    deadline: Optional[float] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Set for streaming requests: called on the inference thread with each decoded piece of text
+    on_text: Optional[Callable[[str], None]] = None
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def abandoned(self):
+        """The caller was cancelled (e.g. the client disconnected) or its deadline passed."""
+        return self.future.done() or self.expired()
+
+
+def check_priority(priority):
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}'. Expected one of {PRIORITIES}")
+
+
+async def stream_chunks(future, chunks, priority, deadline=None):
+    """
+    Yields text from chunks until future, the stream's request, finishes.
+
+    Text pushed before the request finished is always yielded first: both arrive through the
+    event loop in the order they were sent. Closing the iterator early cancels the request.
+    """
+    end = object()
+    future.add_done_callback(lambda _: chunks.put_nowait(end))
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                text = await asyncio.wait_for(chunks.get(), timeout)
+            except asyncio.TimeoutError:
+                DROPPED_REQUESTS.inc(priority=priority, reason="deadline")
+                raise
+            if text is end:
+                break
+            yield text
+        future.result()
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+class BatchScheduler:
+    """
+    Sits between the FastAPI handlers and HuggingFaceAI.
+
+    Requests are queued and coalesced into padded batches. A batch is dispatched
+    as soon as it holds max_batch_size requests or max_wait_ms has passed since
+    its first request arrived. Generation runs on a dedicated worker thread so the
+    event loop stays free to serve other endpoints.
+
+    Streaming requests wait in the same queue and run one at a time on the same thread,
+    pushing text to the caller as it is decoded.
+
+    Interactive requests are always dispatched before batch ones. The queue is bounded:
+    once max_queue_size requests wait (or max_batch_queue_size for the batch class, so
+    bulk jobs leave room for the editor) submit raises QueueFullError. Requests whose
+    caller was cancelled or whose deadline passed are dropped before they run, and rows
+    already generating stop at the next decode step.
+    """
+
+    def __init__(self, ai, max_batch_size=8, max_wait_ms=20, max_queue_size=64, max_batch_queue_size=None):
+        """
+        Args:
+            ai (HuggingFaceAI): Instance with an initialized pipeline.
+            max_batch_size (int): Upper bound on prompts per forward pass.
+            max_wait_ms (float): How long to hold a batch open for more requests.
+            max_queue_size (int): Requests allowed to wait before new ones are rejected.
+            max_batch_queue_size (int): Waiting requests above which batch-class requests are
+                rejected (default: half of max_queue_size).
+        """
+        self.ai = ai
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.max_batch_queue_size = (
+            max_batch_queue_size if max_batch_queue_size is not None else max(1, self.max_queue_size // 2)
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-inference")
+        self._queue = None
+        self._worker = None
+        # Tie-breaker so requests of the same priority stay first in, first out
+        self._sequence = itertools.count()
+        # Moving average of batch run time, for Retry-After estimates
+        self._batch_seconds = 1.0
+
+    def start(self):
+        """Starts the background batching loop on the running event loop."""
+        if self._worker is None:
+            self._queue = asyncio.PriorityQueue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the batching loop and fails any requests still waiting."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        while not self._queue.empty():
+            _, _, request = self._queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Scheduler stopped"))
+        self._executor.shutdown(wait=False)
+
+    def retry_after(self):
+        """Rough seconds until the current queue has drained."""
+        batches = math.ceil(self._queue.qsize() / self.max_batch_size) if self._queue is not None else 1
+        return max(1, min(60, math.ceil(batches * self._batch_seconds)))
+
+    async def submit(self, prompt, max_new_tokens=None, return_full_text=False, task="generate",
+                     priority=INTERACTIVE, deadline=None):
+        """
+        Queues a request and waits for its generated text.
+
+        With task="generate" the prompt is sent to the model as is; with task="format" it is
+        a script that HuggingFaceAI.format_batch wraps in the formatting template.
+
+        Args:
+            priority (str): INTERACTIVE or BATCH.
+            deadline (float): time.monotonic() by which the result is needed; asyncio.TimeoutError after it.
+
+        Raises:
+            QueueFullError: When the queue for this priority is full.
+        """
+        request = self._enqueue(PendingRequest(
+            prompt, max_new_tokens, return_full_text, task, asyncio.get_running_loop().create_future(), priority,
+            deadline,
+        ))
+        future = request.future
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            # Cancelling this wait (client disconnect, timeout) cancels the future, which the
+            # dispatcher and the abort criterion both check
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            DROPPED_REQUESTS.inc(priority=priority, reason="deadline")
+            raise
+        except asyncio.CancelledError:
+            DROPPED_REQUESTS.inc(priority=priority, reason="cancelled")
+            raise
+
+    def stream(self, prompt, task="generate", priority=INTERACTIVE, deadline=None):
+        """
+        Queues a streaming request and returns an async iterator over its decoded text.
+
+        Admission happens here, so a full queue raises QueueFullError before any response
+        is sent. Closing the iterator early cancels the request; its generation stops at the
+        next decode step. Past deadline the iterator raises asyncio.TimeoutError.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        request = self._enqueue(PendingRequest(
+            prompt, None, False, task, loop.create_future(), priority, deadline,
+            on_text=lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text),
+        ))
+        return stream_chunks(request.future, chunks, priority, deadline)
+
+    def _enqueue(self, request):
+        """Admits a request into the priority queue, or raises QueueFullError."""
+        check_priority(request.priority)
+        if self._worker is None:
+            self.start()
+        limit = self.max_queue_size if request.priority == INTERACTIVE else self.max_batch_queue_size
+        if self._queue.qsize() >= limit:
+            DROPPED_REQUESTS.inc(priority=request.priority, reason="queue_full")
+            raise QueueFullError(f"Inference queue is full for {request.priority} requests", self.retry_after())
+        self._queue.put_nowait((PRIORITIES.index(request.priority), next(self._sequence), request))
+        return request
+
+    async def _collect_batch(self):
+        """Waits for one request, then gathers more until the batch is full or the window closes."""
+        loop = asyncio.get_running_loop()
+        batch = [(await self._queue.get())[2]]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # Still take anything already waiting without blocking.
+                if self._queue.empty():
+                    break
+                batch.append(self._queue.get_nowait()[2])
+                continue
+            try:
+                batch.append((await asyncio.wait_for(self._queue.get(), remaining))[2])
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            # Callers that gave up while queued don't need a slot in the batch.
+            batch = [request for request in batch if not request.abandoned()]
+            dispatched_at = time.monotonic()
+            for request in batch:
+                observe_stage("queue_wait", dispatched_at - request.enqueued_at)
+
+            # Streams run one at a time; requests with different generation settings run as separate batches.
+            groups = {}
+            for request in batch:
+                if request.on_text is not None:
+                    await self._run_stream(loop, request)
+                    continue
+                key = (request.task, request.max_new_tokens, request.return_full_text)
+                groups.setdefault(key, []).append(request)
+
+            for (task, max_new_tokens, return_full_text), requests in groups.items():
+                # The group may have waited behind another one
+                requests = [request for request in requests if not request.abandoned()]
+                if not requests:
+                    continue
+                prompts = [request.prompt for request in requests]
+                run_batch = self.ai.format_batch if task == "format" else self.ai.generate_batch
+                BATCH_SIZE.observe(len(prompts))
+                logger.debug("Dispatching %s batch of %d (max_new_tokens=%s)", task, len(prompts), max_new_tokens)
+                # Imported here so the server can start before torch is loaded
+                from GenerationControl import AbortCriteria
+                abort = AbortCriteria([request.abandoned for request in requests])
+                started = time.monotonic()
+                try:
+                    results = await loop.run_in_executor(
+                        self._executor,
+                        lambda: run_batch(prompts, max_new_tokens, return_full_text, stopping_criteria=[abort]),
+                    )
+                except Exception as e:
+                    logger.error(f"Batch generation failed: {e}")
+                    results = [e] * len(requests)
+                self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * (time.monotonic() - started)
+
+                for request, result in zip(requests, results):
+                    if request.future.done():
+                        continue
+                    if request.expired():
+                        # Cut short by the abort criterion; the waiting caller has already timed out
+                        request.future.set_exception(asyncio.TimeoutError())
+                    elif isinstance(result, Exception):
+                        request.future.set_exception(result)
+                    else:
+                        request.future.set_result(result)
+
+    async def _run_stream(self, loop, request):
+        if request.abandoned():
+            return
+        # Imported here so the server can start before torch is loaded
+        from GenerationControl import AbortCriteria
+        abort = AbortCriteria([request.abandoned])
+        try:
+            await loop.run_in_executor(
+                self._executor,
+                lambda: self.ai.stream_generate(request.prompt, request.on_text, request.task, stopping_criteria=[abort]),
+            )
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {e}")
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+        if not request.future.done():
+            request.future.set_result(None)
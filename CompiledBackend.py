@@ -0,0 +1,118 @@
+import logging
+import os
+import shutil
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# How the registry runs a model: eager PyTorch, torch.compile'd graphs, or an ONNX export run by ONNX Runtime
+BACKENDS = ("eager", "compile", "onnx")
+
+ORT_MODEL_CLASSES = {
+    "causal": "ORTModelForCausalLM",
+    "seq2seq": "ORTModelForSeq2SeqLM",
+}
+
+
+def trial_generate(model, tokenizer, device):
+    """
+    Generates a few tokens for a batch of two prompts of different lengths.
+
+    torch.compile only compiles on the first call, so this is where an unsupported model
+    fails; the padded batch also exercises the dynamic sequence and batch dimensions.
+    """
+    inputs = tokenizer(["Hello", "INT. HOUSE - NIGHT"], return_tensors="pt", padding=True).to(device)
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=2, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+
+
+def compile_model(model, cache_dir, mode=None):
+    """
+    Compile a model's forward pass with torch.compile, caching generated kernels on disk.
+
+    Shapes are marked dynamic so the growing sequence length during decoding doesn't trigger
+    a recompile per token. With the inductor FX graph cache in cache_dir, later processes
+    (restarts, inference workers) reuse the compiled kernels instead of compiling again.
+
+    Args:
+        model: Model in eval mode. Its forward is replaced in place.
+        cache_dir (str): Directory for the inductor cache (TORCHINDUCTOR_CACHE_DIR wins if set).
+        mode (str): torch.compile mode, e.g. "max-autotune-no-cudagraphs".
+
+    Returns:
+        model: The same model.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # Read by inductor whenever it looks up its cache, so it has to be set before the first compile
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    import torch._inductor.config as inductor_config
+
+    inductor_config.fx_graph_cache = True
+    model.forward = torch.compile(model.forward, dynamic=True, mode=mode)
+    return model
+
+
+def uncompile_model(model):
+    """Restores the eager forward replaced by compile_model."""
+    if "forward" in vars(model):
+        del model.forward
+    return model
+
+
+def _ort_model_class(model_type):
+    # Optional dependency: pip install optimum[onnxruntime]
+    import optimum.onnxruntime
+
+    return getattr(optimum.onnxruntime, ORT_MODEL_CLASSES[model_type])
+
+
+def export_onnx(model_type, source, export_dir, revision="main"):
+    """Exports a model to ONNX (with its key/value cache inputs) unless export_dir already holds one."""
+    if os.path.exists(os.path.join(export_dir, "config.json")):
+        return export_dir
+    logger.info(f"Exporting '{source}' to ONNX in '{export_dir}'...")
+    temporary_dir = export_dir + ".tmp"
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    model = _ort_model_class(model_type).from_pretrained(source, export=True, revision=revision, use_cache=True)
+    model.save_pretrained(temporary_dir)
+    os.makedirs(os.path.dirname(export_dir), exist_ok=True)
+    os.replace(temporary_dir, export_dir)
+    return export_dir
+
+
+def quantize_onnx_int8(fp32_dir, int8_dir):
+    """Writes a dynamically int8-quantized copy of an exported single-file ONNX model unless it exists."""
+    if os.path.exists(os.path.join(int8_dir, "config.json")):
+        return int8_dir
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    logger.info(f"Quantizing ONNX model in '{fp32_dir}' to int8...")
+    temporary_dir = int8_dir + ".tmp"
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    quantizer = ORTQuantizer.from_pretrained(fp32_dir, file_name="model.onnx")
+    # AVX2 kernels run on every x86 machine in the fleet; AVX512-VNNI ones would not
+    quantizer.quantize(save_dir=temporary_dir, quantization_config=AutoQuantizationConfig.avx2(is_static=False))
+    for name in os.listdir(fp32_dir):
+        if name.endswith(".json") and not os.path.exists(os.path.join(temporary_dir, name)):
+            shutil.copy(os.path.join(fp32_dir, name), temporary_dir)
+    os.replace(temporary_dir, int8_dir)
+    return int8_dir
+
+
+def load_onnx_model(model_type, model_dir, file_name=None):
+    """Loads an exported model into an ONNX Runtime CPU session; it has the usual generate() API."""
+    kwargs = {"file_name": file_name} if file_name else {}
+    return _ort_model_class(model_type).from_pretrained(
+        model_dir, provider="CPUExecutionProvider", use_cache=True, **kwargs
+    )
+
+
+def onnx_nbytes(model_dir):
+    """Size of the ONNX graphs and external weight files in an export directory."""
+    return sum(
+        os.path.getsize(os.path.join(model_dir, name))
+        for name in os.listdir(model_dir)
+        if name.endswith((".onnx", ".onnx_data"))
+    )
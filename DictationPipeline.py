@@ -0,0 +1,234 @@
+import logging
+import queue
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+from audio_utils import WHISPER_SAMPLE_RATE, decode_audio_file
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Utterance:
+    """A stretch of speech found by the segmenter, with times relative to the start of the stream."""
+    audio: np.ndarray
+    start: float
+    end: float
+
+
+@dataclass
+class DictationResult:
+    """The transcription of one utterance."""
+    start: float
+    end: float
+    text: str
+
+
+# ########## Audio Sources ##########
+class ArrayAudioSource:
+    """Yields fixed-size chunks from an in-memory 16 kHz mono array, e.g. for tests without a microphone."""
+
+    def __init__(self, audio, chunk_ms=30):
+        self.audio = np.asarray(audio, dtype=np.float32)
+        self.chunk_size = int(WHISPER_SAMPLE_RATE * chunk_ms / 1000)
+
+    @classmethod
+    def from_file(cls, path, chunk_ms=30):
+        """Load an audio file as a source (see audio_utils.decode_audio_file)."""
+        return cls(decode_audio_file(path), chunk_ms)
+
+    def __iter__(self):
+        for offset in range(0, len(self.audio), self.chunk_size):
+            yield self.audio[offset:offset + self.chunk_size]
+
+
+class MicrophoneSource:
+    """Yields chunks from the microphone through AudioRecorder's callback-based capture."""
+
+    def __init__(self, recorder=None, stop_event=None, max_queued_chunks=64):
+        if recorder is None:
+            from AudioRecorder import AudioRecorder
+            recorder = AudioRecorder()
+        self.recorder = recorder
+        self.stop_event = stop_event or threading.Event()
+        self.max_queued_chunks = max_queued_chunks
+
+    def stop(self):
+        self.stop_event.set()
+
+    def __iter__(self):
+        return self.recorder.stream(self.stop_event, self.max_queued_chunks)
+
+
+# ########## Voice Activity Detection ##########
+class VoiceActivitySegmenter:
+    """
+    Energy-based voice activity detector that cuts a chunk stream into utterances.
+
+    Audio is split into fixed frames; a frame is voiced when its RMS is above the threshold.
+    An utterance ends after min_silence_ms of unvoiced frames or when it reaches
+    max_utterance_s, and is only emitted if it contains at least min_speech_ms of speech.
+    """
+
+    def __init__(self, threshold=0.01, frame_ms=30, min_silence_ms=600, min_speech_ms=250,
+                 max_utterance_s=30, padding_ms=200):
+        self.frame_size = int(WHISPER_SAMPLE_RATE * frame_ms / 1000)
+        self.threshold = threshold
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_frames = int(max_utterance_s * 1000 // frame_ms)
+        self._preroll = deque(maxlen=max(0, padding_ms // frame_ms))
+        self._remainder = np.zeros(0, dtype=np.float32)
+        self._frame_index = 0
+        self._reset_utterance()
+
+    def _reset_utterance(self):
+        self._frames = []
+        self._start_frame = None
+        self._voiced_frames = 0
+        self._silent_run = 0
+
+    def feed(self, chunk):
+        """Adds audio and returns any utterances that finished within it."""
+        audio = np.concatenate([self._remainder, np.asarray(chunk, dtype=np.float32)])
+        frame_count = len(audio) // self.frame_size
+        self._remainder = audio[frame_count * self.frame_size:]
+        if frame_count == 0:
+            return []
+
+        frames = audio[:frame_count * self.frame_size].reshape(frame_count, self.frame_size)
+        voiced = np.sqrt(np.mean(frames ** 2, axis=1)) >= self.threshold
+
+        finished = []
+        for frame, is_voiced in zip(frames, voiced):
+            if self._start_frame is None:
+                if is_voiced:
+                    self._start_frame = self._frame_index - len(self._preroll)
+                    self._frames = list(self._preroll)
+                    self._preroll.clear()
+                else:
+                    self._preroll.append(frame)
+                    self._frame_index += 1
+                    continue
+
+            self._frames.append(frame)
+            if is_voiced:
+                self._voiced_frames += 1
+                self._silent_run = 0
+            else:
+                self._silent_run += 1
+            self._frame_index += 1
+
+            if self._silent_run >= self.min_silence_frames or len(self._frames) >= self.max_frames:
+                utterance = self._finish()
+                if utterance is not None:
+                    finished.append(utterance)
+        return finished
+
+    def flush(self):
+        """Returns the utterance in progress at the end of the stream, if any."""
+        return self._finish()
+
+    def _finish(self):
+        utterance = None
+        if self._start_frame is not None and self._voiced_frames >= self.min_speech_frames:
+            frame_seconds = self.frame_size / WHISPER_SAMPLE_RATE
+            utterance = Utterance(
+                audio=np.concatenate(self._frames),
+                start=self._start_frame * frame_seconds,
+                end=(self._start_frame + len(self._frames)) * frame_seconds,
+            )
+        self._reset_utterance()
+        return utterance
+
+
+# ########## Streaming Transcription ##########
+class StreamingDictation:
+    """
+    Transcribes utterances while capture continues.
+
+    A capture thread reads the source and runs the segmenter; finished utterances go
+    through a bounded queue to the consumer, which transcribes them one by one and
+    yields results. Latency from speech to text is therefore about one utterance.
+    """
+
+    def __init__(self, transcriber=None, segmenter=None, max_pending_utterances=8):
+        if transcriber is None:
+            from TranscriptionService import get_transcription_service
+            transcriber = get_transcription_service()
+        self.transcriber = transcriber
+        self.segmenter = segmenter or VoiceActivitySegmenter()
+        self.max_pending_utterances = max_pending_utterances
+
+    def run(self, source):
+        """
+        Stream transcriptions for an audio source.
+
+        Args:
+            source: Iterable of 16 kHz mono float32 chunks (ArrayAudioSource, MicrophoneSource, ...).
+
+        Yields:
+            DictationResult: One result per finished utterance, in order.
+        """
+        utterances = queue.Queue(maxsize=self.max_pending_utterances)
+        done = object()
+        errors = []
+        # Set when the consumer stops iterating, so the capture thread doesn't block on a full queue forever
+        stopped = threading.Event()
+
+        def put(item):
+            """Queues an item for the consumer; returns False if the consumer has stopped."""
+            while not stopped.is_set():
+                try:
+                    utterances.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def capture():
+            chunks = iter(source)
+            try:
+                for chunk in chunks:
+                    if stopped.is_set():
+                        return
+                    for utterance in self.segmenter.feed(chunk):
+                        if not put(utterance):
+                            return
+                last = self.segmenter.flush()
+                if last is not None:
+                    put(last)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # Ends microphone capture right away rather than when the generator is collected
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+                put(done)
+
+        capture_thread = threading.Thread(target=capture, name="dictation-capture", daemon=True)
+        capture_thread.start()
+
+        previous_text = None
+        try:
+            while True:
+                utterance = utterances.get()
+                if utterance is done:
+                    break
+                segments, _ = self.transcriber.transcribe(
+                    utterance.audio, initial_prompt=previous_text, vad_filter=False
+                )
+                text = " ".join(segment.text.strip() for segment in segments).strip()
+                if text:
+                    previous_text = text
+                    yield DictationResult(utterance.start, utterance.end, text)
+        finally:
+            stopped.set()
+
+        capture_thread.join()
+        if errors:
+            raise errors[0]
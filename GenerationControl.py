@@ -0,0 +1,227 @@
+import logging
+import math
+import os
+
+import torch
+from transformers import StoppingCriteria
+
+from Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+EARLY_STOPS = metrics.counter(
+    "generation_early_stops_total", "Sequences stopped before max_new_tokens, by reason.", ("reason",)
+)
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Stops each sequence once its generated text contains one of the stop sequences."""
+
+    def __init__(self, tokenizer, stop_sequences, prompt_length):
+        self.tokenizer = tokenizer
+        self.stop_sequences = [sequence for sequence in stop_sequences if sequence]
+        self.prompt_length = prompt_length
+        # Only the tail is decoded each step: enough tokens to hold the longest stop sequence
+        self.window = max(len(sequence) for sequence in self.stop_sequences) + 4 if self.stop_sequences else 0
+        self.stopped = set()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if not self.stop_sequences:
+            return done
+        start = max(self.prompt_length, input_ids.shape[1] - self.window)
+        tails = self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=True)
+        for row, tail in enumerate(tails):
+            if any(sequence in tail for sequence in self.stop_sequences):
+                done[row] = True
+                if row not in self.stopped:
+                    self.stopped.add(row)
+                    EARLY_STOPS.inc(reason="stop_sequence")
+        return done
+
+
+class RepetitionAbortCriteria(StoppingCriteria):
+    """
+    Stops sequences that have degenerated into a loop.
+
+    A sequence is cut off when its generated tail is the same block of 1..max_period tokens
+    repeated at least `repeats` times in a row, and over at least min_span tokens so runs of
+    short tokens (e.g. indentation spaces) aren't mistaken for loops. The position where the
+    loop started is kept so the repeated copies can be dropped from the output.
+    """
+
+    def __init__(self, prompt_length, max_period=16, repeats=4, min_span=32, pad_token_id=None):
+        self.prompt_length = prompt_length
+        self.max_period = max_period
+        self.repeats = repeats
+        self.min_span = min_span
+        self.pad_token_id = pad_token_id
+        # Row index to the generated length to keep (the loop's first copy included)
+        self.cut_at = {}
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        generated = input_ids.shape[1] - self.prompt_length
+        # Finished rows are padded with the same token over and over; that isn't a loop
+        active = input_ids[:, -1] != self.pad_token_id if self.pad_token_id is not None else ~done
+        for period in range(1, self.max_period + 1):
+            copies = max(self.repeats, math.ceil(self.min_span / period))
+            span = period * copies
+            if span > generated:
+                continue
+            blocks = input_ids[:, -span:].reshape(input_ids.shape[0], copies, period)
+            looping = (blocks == blocks[:, -1:, :]).all(dim=2).all(dim=1) & active
+            for row in looping.nonzero().flatten().tolist():
+                if row not in self.cut_at:
+                    self.cut_at[row] = generated - period * (copies - 1)
+                    EARLY_STOPS.inc(reason="repetition")
+            done |= looping
+        return done
+
+
+class RowBudgetCriteria(StoppingCriteria):
+    """Gives each row of a batch its own max_new_tokens, so requests with different budgets can share a batch."""
+
+    def __init__(self, prompt_length, budgets):
+        self.prompt_length = prompt_length
+        self.budgets = torch.tensor(budgets)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        return (self.budgets.to(input_ids.device) <= generated)
+
+
+class AbortCriteria(StoppingCriteria):
+    """Stops rows whose caller is gone, e.g. cancelled on client disconnect or past its deadline."""
+
+    def __init__(self, should_stop):
+        """
+        Args:
+            should_stop (list): One `() -> bool` per row, checked between decode steps.
+        """
+        self.should_stop = should_stop
+        self.aborted = set()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        for row, check in enumerate(self.should_stop):
+            if check():
+                done[row] = True
+                if row not in self.aborted:
+                    self.aborted.add(row)
+                    EARLY_STOPS.inc(reason="aborted")
+        return done
+
+
+class GenerationController:
+    """
+    Decides how long a generation may run and cleans up what it produced.
+
+    The token budget follows the input: formatted text is about as long as the text it
+    formats, so a short prompt doesn't get 512 decode steps. Generation also stops early on
+    stop sequences, end-of-script markers and degenerate repetition, and only the new text
+    is returned, trimmed at the first stop sequence.
+    """
+
+    def __init__(self, stop_sequences=(), end_markers=("THE END",), output_ratio=1.5, min_new_tokens=32,
+                 max_new_tokens=512, repetition_period=16, repetition_repeats=4):
+        """
+        Args:
+            stop_sequences (tuple): Strings that end generation and are cut from the output.
+            end_markers (tuple): End-of-script markers that end generation and are kept in the output.
+            output_ratio (float): Budget in new tokens per input token.
+            min_new_tokens (int): Smallest budget, for very short inputs.
+            max_new_tokens (int): Largest budget.
+            repetition_period (int): Longest repeated block of tokens detected as a loop (0 disables).
+            repetition_repeats (int): Consecutive copies of a block that count as a loop.
+        """
+        self.stop_sequences = tuple(stop_sequences)
+        self.end_markers = tuple(end_markers)
+        self.output_ratio = output_ratio
+        self.min_new_tokens = min_new_tokens
+        self.max_new_tokens = max_new_tokens
+        self.repetition_period = repetition_period
+        self.repetition_repeats = repetition_repeats
+
+    @classmethod
+    def from_env(cls):
+        """Controller configured by the GENERATION_* environment variables."""
+        def split(value):
+            return tuple(part.encode().decode("unicode_escape") for part in value.split("||") if part)
+
+        return cls(
+            stop_sequences=split(os.getenv("GENERATION_STOP_SEQUENCES", "")),
+            end_markers=split(os.getenv("GENERATION_END_MARKERS", "THE END")),
+            output_ratio=float(os.getenv("GENERATION_OUTPUT_RATIO", "1.5")),
+            min_new_tokens=int(os.getenv("GENERATION_MIN_NEW_TOKENS", "32")),
+            max_new_tokens=int(os.getenv("GENERATION_MAX_NEW_TOKENS", "512")),
+            repetition_period=int(os.getenv("GENERATION_REPETITION_PERIOD", "16")),
+            repetition_repeats=int(os.getenv("GENERATION_REPETITION_REPEATS", "4")),
+        )
+
+    def describe(self):
+        """Settings that change generated text, e.g. for response cache keys."""
+        return {
+            "stop_sequences": list(self.stop_sequences),
+            "end_markers": list(self.end_markers),
+            "output_ratio": self.output_ratio,
+            "min_new_tokens": self.min_new_tokens,
+            "max_new_tokens": self.max_new_tokens,
+            "repetition": [self.repetition_period, self.repetition_repeats],
+        }
+
+    def budget(self, input_tokens, context_remaining=None):
+        """New-token budget for an input of input_tokens tokens, within the remaining context."""
+        budget = max(self.min_new_tokens, math.ceil(input_tokens * self.output_ratio))
+        budget = min(budget, self.max_new_tokens)
+        if context_remaining is not None:
+            budget = min(budget, context_remaining)
+        return max(1, budget)
+
+    def stopping_criteria(self, tokenizer, prompt_length, budgets=None):
+        """Criteria for one generate call; pass them back to finalize() afterwards."""
+        criteria = []
+        if self.stop_sequences or self.end_markers:
+            criteria.append(StopSequenceCriteria(tokenizer, self.stop_sequences + self.end_markers, prompt_length))
+        if self.repetition_period:
+            criteria.append(RepetitionAbortCriteria(
+                prompt_length, self.repetition_period, self.repetition_repeats, pad_token_id=tokenizer.pad_token_id
+            ))
+        if budgets is not None and len(set(budgets)) > 1:
+            criteria.append(RowBudgetCriteria(prompt_length, budgets))
+        return criteria
+
+    def finalize(self, tokenizer, new_ids, criteria, budgets=None):
+        """
+        Decodes the generated ids of each row, dropping looped repeats and anything past a stop.
+
+        Args:
+            tokenizer: Tokenizer of the model.
+            new_ids: Tensor of generated ids only (prompt already sliced off).
+            criteria (list): The criteria returned by stopping_criteria().
+            budgets (list): Per-row budgets, if rows had different ones.
+
+        Returns:
+            list: New text of each row.
+        """
+        rows = [row for row in new_ids]
+        for criterion in criteria:
+            if isinstance(criterion, RepetitionAbortCriteria):
+                for row, keep in criterion.cut_at.items():
+                    rows[row] = rows[row][:keep]
+        if budgets is not None:
+            rows = [row[:budget] for row, budget in zip(rows, budgets)]
+        return [self.trim(text) for text in tokenizer.batch_decode(rows, skip_special_tokens=True)]
+
+    def trim(self, text):
+        """Cuts text at the first stop sequence (removed) or end marker (kept)."""
+        cut = len(text)
+        for sequence in self.stop_sequences:
+            index = text.find(sequence)
+            if index != -1:
+                cut = min(cut, index)
+        for marker in self.end_markers:
+            index = text.find(marker)
+            if index != -1:
+                cut = min(cut, index + len(marker))
+        return text[:cut]
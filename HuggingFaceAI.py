@@ -1,63 +1,562 @@
+import copy
 import logging
-from transformers import pipeline, GPT2Tokenizer
+import os
+import queue
+import time
+from threading import Event, Lock, Thread
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextStreamer
+from ModelRegistry import model_registry
+from ScriptChunker import split_script, stitch_chunks
+from ResponseCache import is_deterministic, make_cache_key
+from PromptTemplate import PromptTemplate
+import ScreenplayFormatter
+from Metrics import DECODE_TOKENS_PER_SECOND, GENERATED_TOKENS, PROMPT_TOKENS, observe_stage, span
+from GenerationControl import AbortCriteria, GenerationController
+
+PROMPT_TEMPLATE_PATH = "script_formatting_prompt.txt"
+
+# off: plain decoding; draft: a small assistant model proposes tokens; prompt_lookup: n-grams copied from the prompt
+SPECULATIVE_MODES = ("off", "draft", "prompt_lookup")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+class GenerationTimer(StoppingCriteria):
+    """Stopping criterion that never stops; it timestamps each step to split prefill from decode time."""
+
+    def __init__(self, prompt_length=None):
+        """
+        Args:
+            prompt_length (int): Length of the input ids; when omitted the first step is assumed to add one token.
+        """
+        self.prompt_length = prompt_length
+        self.started = time.perf_counter()
+        self.first_step = None
+        self.last_step = None
+        self.first_length = None
+        self.last_length = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.perf_counter()
+        if self.first_step is None:
+            self.first_step = now
+            self.first_length = input_ids.shape[-1]
+        self.last_step = now
+        # Tokens are counted from the sequence length because assisted decoding can accept several per step
+        self.last_length = input_ids.shape[-1]
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    def record(self, batch_size):
+        """Records prefill time, decode time and throughput of the finished generate call."""
+        if self.first_step is None:
+            return
+        # The first step covers the forward pass over the prompt plus the first sampled token
+        observe_stage("prefill", self.first_step - self.started)
+        first_tokens = self.first_length - self.prompt_length if self.prompt_length is not None else 1
+        decode_tokens = self.last_length - self.first_length
+        GENERATED_TOKENS.inc((first_tokens + decode_tokens) * batch_size)
+        decode_seconds = self.last_step - self.first_step
+        if decode_tokens > 0 and decode_seconds > 0:
+            observe_stage("decode", decode_seconds)
+            DECODE_TOKENS_PER_SECOND.observe(decode_tokens / decode_seconds)
+
+class CallbackStreamer(TextStreamer):
+    """Streamer that hands each decoded piece of text to a callback instead of printing it."""
+
+    def __init__(self, tokenizer, on_text):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.on_text = on_text
+
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.on_text(text)
+
 class HuggingFaceAI:
-    def __init__(self):
-        self.text_generation_pipeline = None
+    def __init__(self, model_name=None, registry=None, response_cache=None, speculative_mode=None):
+        self.model_name = model_name or os.getenv("FORMATTER_MODEL", "gpt2")
+        self.registry = registry or model_registry
+        self.response_cache = response_cache
+        self.speculative_mode = speculative_mode or os.getenv("SPECULATIVE_MODE", "off")
+        if self.speculative_mode not in SPECULATIVE_MODES:
+            raise ValueError(f"Unsupported speculative mode '{self.speculative_mode}'. Expected one of {SPECULATIVE_MODES}")
+        self.draft_model_name = os.getenv("SPECULATIVE_DRAFT_MODEL", "distilgpt2")
+        self.prompt_lookup_tokens = int(os.getenv("PROMPT_LOOKUP_TOKENS", "10"))
+        self.generation_controller = GenerationController.from_env()
         self.tokenizer = None
         self.script_formatting_prompt = None
+        self.prompt_template = PromptTemplate(PROMPT_TEMPLATE_PATH)
+        self._pipeline_ready = False
+        self.setup_error = None
+        self._prefix_lock = Lock()
+        self._prefix_key = None
+        self._prefix_cache = None
+
+    @property
+    def text_generation_pipeline(self):
+        """The registry's pipeline for this model, reloaded transparently if it was evicted."""
+        if not self._pipeline_ready:
+            return None
+        return self.registry.get(self.model_name).pipeline
 
-    def setup_pipeline(self):
-        """Sets up the HuggingFace pipeline for text generation."""
+    def setup_pipeline(self, warmup=True):
+        """Sets up the HuggingFace pipeline for text generation. Returns whether it succeeded."""
         try:
-            logging.info("Initializing HuggingFace pipeline...")
-            model_name = "gpt2"
-            self.tokenizer = GPT2Tokenizer.from_pretrained(model_name)
-            self.text_generation_pipeline = pipeline("text-generation", model=model_name)
+            logging.info(f"Initializing HuggingFace pipeline for '{self.model_name}'...")
+            loaded = self.registry.get(self.model_name, model_type="causal", warmup=warmup)
+            self.tokenizer = loaded.tokenizer
+            if self.speculative_mode == "draft":
+                self._setup_draft_model(loaded, warmup)
+            self._pipeline_ready = loaded.pipeline is not None
+            self.setup_error = None
             logging.info("Pipeline initialized successfully.")
         except Exception as e:
+            self.setup_error = str(e)
             logging.error(f"Failed to initialize pipeline: {e}")
+        return self._pipeline_ready
+
+    def warmup(self):
+        """Runs a dummy generation on the loaded models and precomputes the template prefix cache."""
+        loaded = self.registry.get(self.model_name)
+        self.registry.warmup(loaded)
+        if self.speculative_mode == "draft":
+            self.registry.warmup(self.registry.get(self.draft_model_name))
+        if loaded.backend == "onnx":
+            return
+        try:
+            self._prefix_past(loaded)
+        except Exception as e:
+            logging.warning(f"Could not precompute the prompt prefix cache: {e}")
+
+    def _setup_draft_model(self, loaded, warmup):
+        """Loads the draft model for assisted generation, turning speculation off if it can't share the vocabulary."""
+        try:
+            draft = self.registry.get(self.draft_model_name, model_type="causal", warmup=warmup)
+        except Exception as e:
+            logging.warning(f"Could not load draft model '{self.draft_model_name}', speculative decoding is off: {e}")
+            self.speculative_mode = "off"
+            return
+        # The draft's proposals are verified token by token, so both models must use the same vocabulary
+        if draft.tokenizer.get_vocab() != loaded.tokenizer.get_vocab():
+            logging.warning(f"Draft model '{self.draft_model_name}' has a different vocabulary, speculative decoding is off")
+            self.speculative_mode = "off"
+            return
+        logging.info(f"Speculative decoding with draft model '{self.draft_model_name}'")
+
+    def speculative_kwargs(self, batch_size):
+        """generate() arguments for assisted decoding, which transformers only supports for one sequence at a time."""
+        if self.speculative_mode == "off" or batch_size != 1:
+            return {}
+        # Assisted generation drives the model's key/value cache directly, which ONNX Runtime sessions don't expose
+        if self.registry.get(self.model_name).backend == "onnx":
+            return {}
+        if self.speculative_mode == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": self.prompt_lookup_tokens}
+        return {"assistant_model": self.registry.get(self.draft_model_name).model}
 
     def load_prompt(self, script):
         """Loads the script formatting prompt and replaces {script} with the inputted script."""
         try:
-            with open("script_formatting_prompt.txt", "r") as prompt_file:
-                prompt_template = prompt_file.read()
-                self.script_formatting_prompt = prompt_template.replace("{script}", script)
+            # The template is only re-read from disk when the file changes
+            with span("template_load"):
+                self.script_formatting_prompt = self.prompt_template.render(script)
+            return self.script_formatting_prompt
         except Exception as e:
             logging.error(f"Error loading prompt: {e}")
+            return None
 
-    def generate_text(self, prompt, max_new_tokens=512):
-        """Generates text based on the provided prompt."""
+    def template_version(self):
+        """Short hash of the formatting prompt template, so cached formats are invalidated when it changes."""
+        try:
+            return self.prompt_template.version
+        except OSError as e:
+            logging.error(f"Error reading prompt template: {e}")
+            return None
+
+    def cache_key(self, text, template_version=None, **params):
+        """Returns the response cache key for a request, or None if caching is off or decoding is sampled."""
+        if self.response_cache is None or not self._pipeline_ready:
+            return None
+        loaded = self.registry.get(self.model_name)
+        params.setdefault("do_sample", bool(loaded.model.generation_config.do_sample))
+        # Outputs differ between fp32, bf16 and int8 weights, and slightly between eager, compiled and ONNX kernels
+        params.setdefault("precision", loaded.precision)
+        params.setdefault("backend", loaded.backend)
+        params.setdefault("generation", self.generation_controller.describe())
+        if not is_deterministic(params):
+            return None
+        return make_cache_key(self.model_name, template_version, text, params)
+
+    def format_cache_key(self, script, return_full_text=False, **params):
+        """Cache key for formatting a script with the current prompt template (params, e.g. rule_based, join the key)."""
+        return self.cache_key(
+            script, template_version=self.template_version(), task="format_script", return_full_text=return_full_text,
+            **params,
+        )
+
+    def cached_response(self, key):
+        """Looks up a cached response; None on a miss or when key is None."""
+        if key is None:
+            return None
+        return self.response_cache.get(key)
+
+    def store_response(self, key, response):
+        """Caches a response unless key is None or generation failed."""
+        if key is not None and response is not None:
+            self.response_cache.put(key, response)
+
+    def generate_text(self, prompt, max_new_tokens=None, return_full_text=False):
+        """Generates text based on the provided prompt; max_new_tokens=None sizes the budget from the prompt."""
         if not self.text_generation_pipeline:
             logging.error("Pipeline not initialized. Please call setup_pipeline() first.")
             return None
 
+        key = self.cache_key(prompt, max_new_tokens=max_new_tokens, return_full_text=return_full_text)
+        cached = self.cached_response(key)
+        if cached is not None:
+            return cached
+
+        response = self.generate_batch([prompt], max_new_tokens, return_full_text)[0]
+        self.store_response(key, response)
+        return response
+
+    def generate_batch(self, prompts, max_new_tokens=None, return_full_text=False, batch_size=None, input_lengths=None,
+                       stopping_criteria=None):
+        """Generates text for several prompts in padded batches (one batch unless batch_size is given).
+
+        With max_new_tokens=None each prompt gets a budget sized to its length in tokens, or to
+        input_lengths when only part of the prompt (e.g. the script inside a template) is the input.
+        stopping_criteria are extra criteria, e.g. an AbortCriteria with one check per prompt (which
+        needs the prompts to run as a single batch).
+        """
+        if not self.text_generation_pipeline:
+            logging.error("Pipeline not initialized. Please call setup_pipeline() first.")
+            return [None] * len(prompts)
+
         try:
-            return self.text_generation_pipeline(prompt, max_new_tokens=max_new_tokens, num_return_sequences=1)[0]["generated_text"]
+            loaded = self.registry.get(self.model_name)
+            batch_size = batch_size or len(prompts)
+            texts = []
+            for start in range(0, len(prompts), batch_size):
+                batch = prompts[start:start + batch_size]
+                with span("tokenize"):
+                    inputs = loaded.tokenizer(batch, return_tensors="pt", padding=True).to(loaded.device)
+                lengths = (
+                    input_lengths[start:start + batch_size] if input_lengths
+                    else inputs["attention_mask"].sum(dim=1).tolist()
+                )
+                new_texts = self._generate_texts(
+                    loaded, inputs["input_ids"], inputs["attention_mask"], max_new_tokens, lengths,
+                    stopping_criteria=stopping_criteria,
+                )
+                texts.extend(prompt + text if return_full_text else text for prompt, text in zip(batch, new_texts))
+            return texts
         except Exception as e:
-            logging.error(f"Error generating text: {e}")
-            return None
+            logging.error(f"Error generating batch: {e}")
+            return [None] * len(prompts)
 
-    def format_script(self, script):
+    def _context_length(self, loaded):
+        """Maximum sequence length of the model (prompt plus generated tokens)."""
+        return getattr(loaded.model.config, "n_positions", None) or loaded.tokenizer.model_max_length
+
+    def _generate_texts(self, loaded, input_ids, attention_mask, max_new_tokens, input_lengths, **generate_kwargs):
+        """Generates and decodes only the new text of each row, stopping early where the controller says so."""
+        controller = self.generation_controller
+        prompt_length = input_ids.shape[1]
+        budgets = None
+        if max_new_tokens is None:
+            remaining = self._context_length(loaded) - prompt_length
+            budgets = [controller.budget(length, remaining) for length in input_lengths]
+            max_new_tokens = max(budgets)
+        criteria = controller.stopping_criteria(loaded.tokenizer, prompt_length, budgets)
+        extra = list(generate_kwargs.pop("stopping_criteria", None) or [])
+        outputs = self._generate_ids(
+            loaded, input_ids, attention_mask, max_new_tokens, stopping_criteria=criteria + extra, **generate_kwargs
+        )
+        with span("detokenize"):
+            return controller.finalize(loaded.tokenizer, outputs[:, prompt_length:], criteria, budgets)
+
+    def _generate_ids(self, loaded, input_ids, attention_mask, max_new_tokens, **generate_kwargs):
+        """Runs model.generate, recording prompt/generated token counts and prefill/decode timings."""
+        if "past_key_values" not in generate_kwargs:
+            generate_kwargs = {**self.speculative_kwargs(input_ids.shape[0]), **generate_kwargs}
+        timer = GenerationTimer(input_ids.shape[1])
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [timer] + list(generate_kwargs.get("stopping_criteria") or [])
+        )
+        PROMPT_TOKENS.inc(int(attention_mask.sum()))
+        with torch.no_grad():
+            outputs = loaded.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=loaded.tokenizer.pad_token_id,
+                **generate_kwargs,
+            )
+        timer.record(input_ids.shape[0])
+        return outputs
+
+    def format_batch(self, scripts, max_new_tokens=None, return_full_text=False, stopping_criteria=None):
+        """Formats several scripts in one batch, reusing the cached key/values of the fixed instruction prefix."""
+        if not self.text_generation_pipeline:
+            logging.error("Pipeline not initialized. Please call setup_pipeline() first.")
+            return [None] * len(scripts)
+
+        # A lone script is faster with speculative decoding, which builds its own caches from the full prompt.
+        # ONNX Runtime sessions can't be fed a shared prefix cache, so they always take the full prompt.
+        uses_prefix_cache = self.registry.get(self.model_name).backend != "onnx"
+        if uses_prefix_cache and not self.speculative_kwargs(len(scripts)):
+            try:
+                return self._generate_with_prefix_cache(scripts, max_new_tokens, return_full_text, stopping_criteria)
+            except Exception as e:
+                logging.warning(f"Prefix cache unavailable, formatting with the full prompt: {e}")
+
+        prompts = [self.load_prompt(script) for script in scripts]
+        if None in prompts:
+            return [None] * len(scripts)
+        tokenizer = self.registry.get(self.model_name).tokenizer
+        script_lengths = [len(tokenizer.encode(script)) for script in scripts]
+        return self.generate_batch(
+            prompts, max_new_tokens, return_full_text, input_lengths=script_lengths, stopping_criteria=stopping_criteria
+        )
+
+    def _prefix_past(self, loaded):
+        """Key/value cache of the template's instruction prefix, computed once per template version and model."""
+        key = (self.prompt_template.version, id(loaded.model))
+        with self._prefix_lock:
+            if self._prefix_key != key:
+                prefix_ids = torch.tensor([self.prompt_template.prefix_ids(loaded.tokenizer)], device=loaded.device)
+                with torch.no_grad():
+                    self._prefix_cache = loaded.model(prefix_ids, use_cache=True).past_key_values
+                self._prefix_key = key
+            return self._prefix_cache
+
+    def _generate_with_prefix_cache(self, scripts, max_new_tokens, return_full_text, stopping_criteria=None):
+        """Runs the model only over each script and the template tail, on top of the shared prefix cache."""
+        loaded = self.registry.get(self.model_name)
+        tokenizer = loaded.tokenizer
+        with span("template_load"):
+            prefix_ids = self.prompt_template.prefix_ids(tokenizer)
+            suffixes = [self.prompt_template.render_suffix(script) for script in scripts]
+        with span("tokenize"):
+            bodies = [tokenizer.encode(suffix) for suffix in suffixes]
+            # Budgets follow the script alone, as on the full-prompt path, not the template tail around it
+            script_lengths = [len(tokenizer.encode(script)) for script in scripts]
+
+        # Every row starts with the same prefix so the cache can be shared; padding goes between
+        # prefix and body and is masked out (positions are derived from the attention mask).
+        longest = max(len(body) for body in bodies)
+        rows, masks = [], []
+        for body in bodies:
+            padding = longest - len(body)
+            rows.append(prefix_ids + [tokenizer.pad_token_id] * padding + body)
+            masks.append([1] * len(prefix_ids) + [0] * padding + [1] * len(body))
+        input_ids = torch.tensor(rows, device=loaded.device)
+        attention_mask = torch.tensor(masks, device=loaded.device)
+
+        past = self._prefix_past(loaded)
+        if isinstance(past, tuple):
+            past = tuple(tuple(tensor.repeat(len(scripts), 1, 1, 1) for tensor in layer) for layer in past)
+        else:
+            # generate() extends the cache in place, so each call works on its own copy
+            past = copy.deepcopy(past)
+            if len(scripts) > 1:
+                past.batch_repeat_interleave(len(scripts))
+
+        texts = self._generate_texts(
+            loaded, input_ids, attention_mask, max_new_tokens, script_lengths, past_key_values=past,
+            stopping_criteria=stopping_criteria,
+        )
+        if return_full_text:
+            texts = [self.prompt_template.render(script) + text for script, text in zip(scripts, texts)]
+        return texts
+
+    def format_script(self, script, return_full_text=False):
         """Formats a script by appending it to a predefined prompt."""
         if not self.text_generation_pipeline:
             logging.error("Pipeline not initialized. Please call setup_pipeline() first.")
             return None
 
-        # Load the prompt with the inputted script
-        self.load_prompt(script)
+        key = self.format_cache_key(script, return_full_text)
+        cached = self.cached_response(key)
+        if cached is not None:
+            return cached
 
         try:
-            # Generate the formatted script
-            return self.text_generation_pipeline(self.script_formatting_prompt, max_new_tokens=512, num_return_sequences=1)[0]["generated_text"]
+            # Scripts that overflow the context window are formatted chunk by chunk
+            chunks, max_new_tokens = self.plan_script_chunks(script)
+            if len(chunks) > 1:
+                formatted_script = self._format_chunks(chunks, max_new_tokens)
+            else:
+                # The budget is sized to the script and capped by the remaining context
+                formatted_script = self.format_batch([script], None, return_full_text)[0]
+            self.store_response(key, formatted_script)
+            return formatted_script
         except Exception as e:
             logging.error(f"Error formatting script: {e}")
             return None
 
+    def format_screenplay(self, script):
+        """Formats a script with the rule-based formatter, using the model only for spans the rules can't classify."""
+        return ScreenplayFormatter.format_script(
+            script, fallback=lambda span: self.format_script(span, return_full_text=False)
+        )
+
+    def format_scripts(self, scripts, batch_size=8):
+        """Formats many scripts, batching those that fit the context window and chunking the rest."""
+        if not self.text_generation_pipeline:
+            logging.error("Pipeline not initialized. Please call setup_pipeline() first.")
+            return [None] * len(scripts)
+
+        outputs = [None] * len(scripts)
+        fitting = []
+        for index, script in enumerate(scripts):
+            try:
+                chunks, max_new_tokens = self.plan_script_chunks(script)
+            except Exception as e:
+                logging.error(f"Error splitting script: {e}")
+                continue
+            if len(chunks) > 1:
+                outputs[index] = self._format_chunks(chunks, max_new_tokens, batch_size)
+            else:
+                fitting.append(index)
+        for start in range(0, len(fitting), batch_size):
+            indexes = fitting[start:start + batch_size]
+            for index, output in zip(indexes, self.format_batch([scripts[index] for index in indexes])):
+                outputs[index] = output
+        return outputs
+
+    def format_screenplays(self, scripts, batch_size=8):
+        """Like format_screenplay for many scripts, sending the ambiguous spans of all of them to the model in batches."""
+        parsed = [ScreenplayFormatter.parse(script) for script in scripts]
+        spans = []
+        for script_index, elements in enumerate(parsed):
+            ScreenplayFormatter.record_spans(elements)
+            spans.extend((script_index, index, text) for index, text in ScreenplayFormatter.ambiguous_spans(elements))
+        resolved = [{} for _ in scripts]
+        if spans:
+            formatted = self.format_scripts([text for _, _, text in spans], batch_size)
+            for (script_index, index, _), text in zip(spans, formatted):
+                resolved[script_index][index] = text
+        return [ScreenplayFormatter.render(elements, resolution) for elements, resolution in zip(parsed, resolved)]
+
+    def plan_script_chunks(self, script, max_chunk_tokens=None, overlap_tokens=40):
+        """Splits a script into chunks that each fit the model's context window with the prompt, and a shared token budget."""
+        loaded = self.registry.get(self.model_name)
+        context = self._context_length(loaded)
+        template_tokens = len(loaded.tokenizer.encode(self.prompt_template.render("")))
+        # Formatted output is about as long as its input, so split the remaining context between them
+        # (with a small margin because re-joined units can tokenize slightly differently).
+        budget = max(32, (context - template_tokens) // 2 - 8)
+        if max_chunk_tokens:
+            budget = min(budget, max_chunk_tokens)
+
+        def count_tokens(text):
+            return len(loaded.tokenizer.encode(text))
+
+        chunks = split_script(script, count_tokens, budget, min(overlap_tokens, budget // 4))
+        max_new_tokens = max(1, context - template_tokens - budget - 8)
+        return [chunk.text for chunk in chunks], max_new_tokens
+
+    def format_script_chunked(self, script, max_chunk_tokens=None, batch_size=8):
+        """Formats a long script in overlapping chunks, batched through the model, and stitches them back together."""
+        if not self.text_generation_pipeline:
+            logging.error("Pipeline not initialized. Please call setup_pipeline() first.")
+            return None
+
+        try:
+            chunks, max_new_tokens = self.plan_script_chunks(script, max_chunk_tokens)
+        except Exception as e:
+            logging.error(f"Error splitting script: {e}")
+            return None
+
+        return self._format_chunks(chunks, max_new_tokens, batch_size)
+
+    def _format_chunks(self, chunks, max_new_tokens, batch_size=8):
+        """Formats chunks in batches and stitches the new text in order."""
+        logging.info(f"Formatting script in {len(chunks)} chunks")
+        outputs = []
+        for start in range(0, len(chunks), batch_size):
+            outputs.extend(self.format_batch(chunks[start:start + batch_size], max_new_tokens, return_full_text=False))
+        if any(output is None for output in outputs):
+            logging.error("Error formatting script: one or more chunks failed")
+            return None
+        return stitch_chunks(outputs)
+
+    def stream_generate(self, prompt, on_text, task="generate", max_new_tokens=None, stopping_criteria=None):
+        """
+        Generates for one prompt on the calling thread, passing each decoded piece of text to on_text.
+
+        The schedulers call this on their inference thread or in a worker process, so streams
+        take turns with batches instead of running beside them. With task="format" the prompt
+        is a script that is wrapped in the formatting template; its budget follows the script.
+        Text already passed on can't be trimmed, but generation still stops at stop sequences and loops.
+        """
+        loaded = self.registry.get(self.model_name)
+        input_length = None
+        if task == "format":
+            input_length = len(loaded.tokenizer.encode(prompt))
+            prompt = self.load_prompt(prompt)
+            if prompt is None:
+                raise RuntimeError("Could not load the script formatting prompt")
+        with span("tokenize"):
+            inputs = loaded.tokenizer(prompt, return_tensors="pt").to(loaded.device)
+        prompt_length = inputs["input_ids"].shape[1]
+        if max_new_tokens is None:
+            max_new_tokens = self.generation_controller.budget(
+                input_length or prompt_length, self._context_length(loaded) - prompt_length
+            )
+        criteria = self.generation_controller.stopping_criteria(loaded.tokenizer, prompt_length)
+        self._generate_ids(
+            loaded, inputs["input_ids"], inputs["attention_mask"], max_new_tokens,
+            streamer=CallbackStreamer(loaded.tokenizer, on_text),
+            stopping_criteria=criteria + list(stopping_criteria or []),
+        )
+
+    def stream_text(self, prompt, max_new_tokens=None, deadline=None, task="generate"):
+        """
+        Yields generated text chunks as they are decoded, without the echoed prompt.
+
+        Generation runs on its own thread; the server streams through its scheduler instead. It
+        stops at the next decode step once the stream is closed or, if given, at deadline (a
+        time.monotonic() value).
+        """
+        if not self.text_generation_pipeline:
+            logging.error("Pipeline not initialized. Please call setup_pipeline() first.")
+            return
+
+        chunks = queue.Queue()
+        end = object()
+        cancelled = Event()
+        abort = AbortCriteria([
+            lambda: cancelled.is_set() or (deadline is not None and time.monotonic() > deadline)
+        ])
+
+        def generate():
+            try:
+                self.stream_generate(prompt, chunks.put, task, max_new_tokens, stopping_criteria=[abort])
+            except Exception as e:
+                logging.error(f"Error streaming text: {e}")
+            finally:
+                chunks.put(end)
+
+        generation_thread = Thread(target=generate, daemon=True)
+        generation_thread.start()
+        try:
+            while True:
+                text = chunks.get()
+                if text is end:
+                    break
+                yield text
+        finally:
+            # Closed early (e.g. the client disconnected): stop decoding at the next step
+            cancelled.set()
+        generation_thread.join()
+
+    def stream_format_script(self, script, deadline=None):
+        """Formats a script like format_script, yielding the screenplay as it is generated."""
+        yield from self.stream_text(script, deadline=deadline, task="format")
+
 # Example usage of the HuggingFaceAI class for testing
 if __name__ == "__main__":
     ai = HuggingFaceAI()
@@ -0,0 +1,372 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+from BatchScheduler import DROPPED_REQUESTS, INTERACTIVE, QueueFullError, check_priority, stream_chunks
+from Metrics import observe_stage, record_stages
+
+logger = logging.getLogger(__name__)
+
+# Cancellation flags shared with the workers, indexed by request id modulo this size (far more
+# than the requests that can be queued or running at once)
+CANCEL_SLOTS = 4096
+# How often the result thread checks for dead workers while no results arrive
+LIVENESS_INTERVAL_S = 1.0
+
+
+def _worker_main(model_name, requests, results, num_threads, max_batch_size, cancelled, owners):
+    """Entry point of an inference worker process."""
+    import torch
+    from GenerationControl import AbortCriteria
+    from HuggingFaceAI import HuggingFaceAI
+    from ModelRegistry import ModelRegistry
+
+    torch.set_num_threads(num_threads)
+    # Weights are memory-mapped, so every worker shares the same physical pages
+    registry = ModelRegistry(
+        save_directory=os.getenv("MODEL_SAVE_DIRECTORY", "./models/"),
+        device="cpu",
+        mmap_weights=True,
+        precision=os.getenv("MODEL_PRECISION", "fp32"),
+        backend=os.getenv("INFERENCE_BACKEND", "eager"),
+    )
+    ai = HuggingFaceAI(model_name, registry=registry)
+    ai.setup_pipeline()
+    results.put(("ready", os.getpid(), None, None))
+
+    while True:
+        batch = [requests.get()]
+        if batch[0] is None:
+            break
+        # Take whatever else is already waiting, up to the batch size
+        while len(batch) < max_batch_size:
+            try:
+                item = requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                requests.put(None)
+                break
+            batch.append(item)
+        # Recorded so the server can fail these requests if this process dies while running them
+        for item in batch:
+            owners[item[0] % CANCEL_SLOTS] = os.getpid()
+
+        # Wall-clock time, since the enqueue timestamp comes from another process
+        dispatched_at = time.time()
+        def abandoned(request_id, deadline):
+            return bool(cancelled[request_id % CANCEL_SLOTS]) or (deadline is not None and time.time() > deadline)
+
+        groups = {}
+        for request_id, prompt, max_new_tokens, return_full_text, task, enqueued_at, deadline, stream in batch:
+            if stream:
+                # Streams run one at a time, sending their text back as it is decoded
+                queue_wait = time.time() - enqueued_at
+                if abandoned(request_id, deadline):
+                    results.put((request_id, None, "cancelled", {"queue_wait": queue_wait}))
+                    continue
+                abort = AbortCriteria([lambda: abandoned(request_id, deadline)])
+                with record_stages() as stages:
+                    try:
+                        ai.stream_generate(
+                            prompt, lambda text: results.put(("chunk", request_id, text, None)), task,
+                            stopping_criteria=[abort],
+                        )
+                        error = None
+                    except Exception as e:
+                        error = str(e)
+                results.put((request_id, None, error, {"queue_wait": queue_wait, "stages": stages}))
+                continue
+            groups.setdefault((task, max_new_tokens, return_full_text), []).append(
+                (request_id, prompt, dispatched_at - enqueued_at, deadline)
+            )
+        for (task, max_new_tokens, return_full_text), items in groups.items():
+            # Callers that gave up while queued don't need a slot in the batch
+            for request_id, _, queue_wait, deadline in items:
+                if abandoned(request_id, deadline):
+                    results.put((request_id, None, "cancelled", {"queue_wait": queue_wait}))
+            items = [item for item in items if not abandoned(item[0], item[3])]
+            if not items:
+                continue
+            run_batch = ai.format_batch if task == "format" else ai.generate_batch
+            abort = AbortCriteria([
+                lambda request_id=request_id, deadline=deadline: abandoned(request_id, deadline)
+                for request_id, _, _, deadline in items
+            ])
+            with record_stages() as stages:
+                try:
+                    outputs = run_batch(
+                        [prompt for _, prompt, _, _ in items], max_new_tokens, return_full_text,
+                        stopping_criteria=[abort],
+                    )
+                    errors = [None] * len(items)
+                except Exception as e:
+                    outputs, errors = [None] * len(items), [str(e)] * len(items)
+            for (request_id, _, queue_wait, _), output, error in zip(items, outputs, errors):
+                results.put((request_id, output, error, {"queue_wait": queue_wait, "stages": stages}))
+                # The batch's spans are observed once, as they are in the server process
+                stages = []
+
+
+class InferenceWorkerPool:
+    """
+    Runs generation in N worker processes instead of the server process.
+
+    Each worker loads the model with memory-mapped safetensors weights, so the weights
+    are shared between workers rather than copied N times. Requests go through a
+    bounded queue: when it is full, submit raises QueueFullError instead of queueing
+    without limit, and callers stop waiting after request_timeout seconds (or their own
+    deadline). Cancelled and timed-out requests are flagged in shared memory, so workers
+    skip them or stop their rows at the next decode step.
+
+    Exposes the same start/stop/submit/stream interface as BatchScheduler. The queue between
+    processes is first in, first out, so priority classes only affect admission: batch
+    requests are rejected once max_batch_queue_size requests are pending.
+    """
+
+    def __init__(self, model_name, num_workers=2, max_queue_size=64, request_timeout=120,
+                 threads_per_worker=None, max_batch_size=8, max_batch_queue_size=None):
+        """
+        Args:
+            model_name (str): Causal model served by the workers.
+            num_workers (int): Number of worker processes.
+            max_queue_size (int): Requests allowed to wait before new ones are rejected.
+            request_timeout (float): Seconds a caller waits for its result.
+            threads_per_worker (int): torch threads per worker; defaults to splitting the CPUs evenly.
+            max_batch_size (int): Upper bound on prompts a worker batches together.
+            max_batch_queue_size (int): Pending requests above which batch-class requests are
+                rejected (default: half of max_queue_size).
+        """
+        self.model_name = model_name
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.request_timeout = request_timeout
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.max_batch_size = max_batch_size
+        self.max_batch_queue_size = (
+            max_batch_queue_size if max_batch_queue_size is not None else max(1, max_queue_size // 2)
+        )
+        self._context = multiprocessing.get_context("spawn")
+        self._cancelled = None
+        self._owners = None
+        self._requests = None
+        self._results = None
+        self._workers = []
+        self._ready_pids = set()
+        self._dead_pids = set()
+        self._pending = {}
+        # Streaming request id -> callback that takes its text on the result thread
+        self._streams = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._dispatcher = None
+
+    @property
+    def ready_workers(self):
+        """Workers that have loaded the model and are still running."""
+        return sum(worker.pid in self._ready_pids and worker.is_alive() for worker in self._workers)
+
+    def start(self):
+        """Spawns the worker processes and the thread that routes their results back."""
+        if self._workers:
+            return
+        self._requests = self._context.Queue(maxsize=self.max_queue_size)
+        self._results = self._context.Queue()
+        self._cancelled = self._context.Array("b", CANCEL_SLOTS, lock=False)
+        # Pid of the worker that took each request, in the same slots as the cancellation flags
+        self._owners = self._context.Array("i", CANCEL_SLOTS, lock=False)
+        for _ in range(self.num_workers):
+            worker = self._context.Process(
+                target=_worker_main,
+                args=(self.model_name, self._requests, self._results, self.threads_per_worker, self.max_batch_size,
+                      self._cancelled, self._owners),
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+        self._dispatcher = threading.Thread(target=self._dispatch_results, name="worker-pool-results", daemon=True)
+        self._dispatcher.start()
+        logger.info(f"Started {self.num_workers} inference workers ({self.threads_per_worker} threads each)")
+
+    async def stop(self):
+        """Asks the workers to exit and waits for them."""
+        if not self._workers:
+            return
+        for _ in self._workers:
+            self._requests.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._join_workers)
+        self._results.put(None)
+        self._workers = []
+        with self._pending_lock:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(RuntimeError("Worker pool stopped"))
+            self._pending.clear()
+
+    def _join_workers(self):
+        for worker in self._workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+
+    def submit_nowait(self, prompt, max_new_tokens=None, return_full_text=False, task="generate",
+                      priority=INTERACTIVE, deadline=None, on_text=None):
+        """
+        Queues a request and returns a concurrent.futures.Future for its result.
+
+        Cancelling the future (or calling cancel(future.request_id)) stops the request in the workers.
+        With on_text the request is streamed: on_text is called on the result thread with each
+        decoded piece of text, and the future resolves to None when generation ends.
+        """
+        check_priority(priority)
+        if priority != INTERACTIVE and len(self._pending) >= self.max_batch_queue_size:
+            DROPPED_REQUESTS.inc(priority=priority, reason="queue_full")
+            raise QueueFullError(f"Inference queue is full for {priority} requests", self.retry_after())
+        request_id = next(self._ids)
+        future = Future()
+        future.request_id = request_id
+        with self._pending_lock:
+            self._pending[request_id] = future
+            if on_text is not None:
+                self._streams[request_id] = on_text
+        self._cancelled[request_id % CANCEL_SLOTS] = 0
+        self._owners[request_id % CANCEL_SLOTS] = 0
+        # Workers compare against wall-clock time, which is shared between processes
+        wall_deadline = None if deadline is None else time.time() + (deadline - time.monotonic())
+        try:
+            self._requests.put_nowait(
+                (request_id, prompt, max_new_tokens, return_full_text, task, time.time(), wall_deadline,
+                 on_text is not None)
+            )
+        except queue.Full:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+                self._streams.pop(request_id, None)
+            DROPPED_REQUESTS.inc(priority=priority, reason="queue_full")
+            raise QueueFullError("Inference queue is full", self.retry_after())
+        future.add_done_callback(lambda done: self._forget(request_id, cancel=done.cancelled()))
+        return future
+
+    def retry_after(self):
+        """Rough seconds until a slot frees up: the request timeout spread over the pending requests."""
+        return max(1, min(60, int(self.request_timeout * len(self._pending) / max(1, self.max_queue_size))))
+
+    def cancel(self, request_id):
+        """Flags a request so workers skip it or stop generating it."""
+        if self._cancelled is not None:
+            self._cancelled[request_id % CANCEL_SLOTS] = 1
+
+    async def submit(self, prompt, max_new_tokens=None, return_full_text=False, task="generate",
+                     priority=INTERACTIVE, deadline=None):
+        """Queues a request and waits up to request_timeout seconds (or until deadline) for the generated text."""
+        if not self._workers:
+            self.start()
+        future = self.submit_nowait(prompt, max_new_tokens, return_full_text, task, priority, deadline)
+        timeout = self.request_timeout
+        if deadline is not None:
+            timeout = min(timeout, max(0.0, deadline - time.monotonic()))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            DROPPED_REQUESTS.inc(priority=priority, reason="deadline")
+            self.cancel(future.request_id)
+            raise
+        except asyncio.CancelledError:
+            DROPPED_REQUESTS.inc(priority=priority, reason="cancelled")
+            self.cancel(future.request_id)
+            raise
+
+    def stream(self, prompt, task="generate", priority=INTERACTIVE, deadline=None):
+        """
+        Queues a streaming request and returns an async iterator over its decoded text.
+
+        Admission happens here, so a full queue raises QueueFullError before any response is
+        sent. Closing the iterator early cancels the request in the workers.
+        """
+        if not self._workers:
+            self.start()
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        future = self.submit_nowait(
+            prompt, None, False, task, priority, deadline,
+            on_text=lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text),
+        )
+        if deadline is None:
+            deadline = time.monotonic() + self.request_timeout
+        return stream_chunks(asyncio.wrap_future(future), chunks, priority, deadline)
+
+    def _forget(self, request_id, cancel=False):
+        if cancel:
+            self.cancel(request_id)
+        with self._pending_lock:
+            self._pending.pop(request_id, None)
+            self._streams.pop(request_id, None)
+
+    def _fail_dead_workers(self):
+        """Fails the in-flight requests of workers that exited unexpectedly; queued ones stay for the others."""
+        for worker in list(self._workers):
+            if worker.is_alive() or worker.pid in self._dead_pids:
+                continue
+            self._dead_pids.add(worker.pid)
+            if worker.exitcode != 0:
+                logger.error(f"Inference worker {worker.pid} exited with code {worker.exitcode}")
+            with self._pending_lock:
+                lost = [
+                    request_id for request_id in self._pending
+                    if self._owners[request_id % CANCEL_SLOTS] == worker.pid
+                ]
+                futures = [self._pending.pop(request_id) for request_id in lost]
+                for request_id in lost:
+                    self._streams.pop(request_id, None)
+            for future in futures:
+                try:
+                    future.set_exception(RuntimeError(f"Inference worker {worker.pid} died"))
+                except InvalidStateError:
+                    pass
+
+    def _dispatch_results(self):
+        checked_at = time.monotonic()
+        while True:
+            if time.monotonic() - checked_at >= LIVENESS_INTERVAL_S:
+                self._fail_dead_workers()
+                checked_at = time.monotonic()
+            try:
+                message = self._results.get(timeout=LIVENESS_INTERVAL_S)
+            except queue.Empty:
+                continue
+            if message is None:
+                break
+            request_id, result, error, timings = message
+            if request_id == "ready":
+                self._ready_pids.add(result)
+                logger.info(f"Inference worker {result} is ready")
+                continue
+            if request_id == "chunk":
+                # Text of a streaming request that is still generating
+                _, stream_id, text, _ = message
+                on_text = self._streams.get(stream_id)
+                if on_text is not None:
+                    on_text(text)
+                continue
+            # Stage spans are timed inside the workers and come back with the result
+            observe_stage("queue_wait", timings["queue_wait"])
+            for stage, seconds in timings.get("stages", ()):
+                observe_stage(stage, seconds)
+            with self._pending_lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                # The caller timed out and stopped waiting
+                continue
+            try:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(error))
+            except InvalidStateError:
+                pass
@@ -1,11 +1,57 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+
+import httpx
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, rate limits and server errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key=None, base_url=None):
+    """
+    Returns a shared genai.Client for an API key and base URL, creating it on first use.
+
+    Sharing the client shares its HTTP connection pool, for both the sync API and client.aio.
+
+    Args:
+        api_key (str): Gemini API key; defaults to GEMINI_API_KEY.
+        base_url (str): Alternative endpoint, e.g. a local stand-in server; defaults to GEMINI_BASE_URL.
+
+    Returns:
+        genai.Client: The shared client.
+    """
+    api_key = api_key or os.getenv("GEMINI_API_KEY")
+    base_url = base_url or os.getenv("GEMINI_BASE_URL")
+    key = (api_key, base_url)
+    with _clients_lock:
+        if key not in _clients:
+            http_options = types.HttpOptions(base_url=base_url) if base_url else None
+            _clients[key] = genai.Client(api_key=api_key, http_options=http_options)
+        return _clients[key]
+
+
+def is_retryable(error):
+    """True for transient failures: connection errors, timeouts, 429s and 5xx responses."""
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
 
 class LLMService:
     def __init__(self, model='default-model', provider='gemini'):
         self.model = model
         self.provider = provider
-        self.client = genai.Client(api_key="YOUR_API_KEY")
+        self.client = get_client()
 
     def connect(self):
         if self.provider == 'gemini':
@@ -80,10 +126,181 @@ class LLMService:
             print(f'role - {message.role}', end=": ")
             print(message.parts[0].text)
 
+class AsyncLLMService:
+    """
+    Async counterpart of LLMService for fanning out many prompts concurrently.
+
+    All instances share one pooled client per API key and base URL. At most
+    max_concurrency calls are in flight per service, and transient failures are
+    retried with jittered exponential backoff until the call's deadline passes.
+    Streaming methods return async generators of text chunks.
+    """
+
+    def __init__(self, model='gemini-2.0-flash', provider='gemini', api_key=None, base_url=None,
+                 max_concurrency=8, max_retries=3, timeout=60.0, backoff_base=0.5, backoff_max=8.0):
+        """
+        Args:
+            model (str): Model name.
+            provider (str): Only 'gemini' is supported.
+            api_key (str): Gemini API key; defaults to GEMINI_API_KEY.
+            base_url (str): Alternative endpoint, e.g. a local stand-in server; defaults to GEMINI_BASE_URL.
+            max_concurrency (int): Calls allowed in flight at once.
+            max_retries (int): Retries after the first attempt for transient failures.
+            timeout (float): Default deadline in seconds for a call, retries included.
+            backoff_base (float): First backoff ceiling in seconds; doubles on each retry.
+            backoff_max (float): Upper bound on a single backoff.
+        """
+        if provider != 'gemini':
+            raise ValueError(f"Provider {provider} is not supported")
+        self.model = model
+        self.provider = provider
+        self.client = get_client(api_key, base_url)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @staticmethod
+    def _config(max_output_tokens, temperature, system_instruction):
+        return types.GenerateContentConfig(
+            max_output_tokens=max_output_tokens,
+            temperature=temperature,
+            system_instruction=system_instruction
+        )
+
+    async def _with_retries(self, make_request, deadline):
+        """Awaits make_request(), retrying transient failures with jittered backoff until deadline."""
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("LLM call deadline exceeded")
+            try:
+                return await asyncio.wait_for(make_request(), remaining)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                # Full jitter: spread retries out so concurrent callers don't retry in lockstep
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if loop.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                logger.warning(f"LLM call failed ({e}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _call(self, make_request, timeout):
+        """Runs one request within the concurrency limit and the call's deadline."""
+        deadline = asyncio.get_running_loop().time() + (timeout or self.timeout)
+        async with self._semaphore:
+            return await self._with_retries(make_request, deadline)
+
+    async def _stream(self, open_stream, timeout):
+        """
+        Yields chunk texts from the async iterator returned by open_stream().
+
+        Opening the stream is retried like any call; once text has been yielded a failure is
+        raised instead, since the caller has already consumed part of the response.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        async with self._semaphore:
+            stream = await self._with_retries(open_stream, deadline)
+            iterator = stream.__aiter__()
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError("LLM stream deadline exceeded")
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                except StopAsyncIteration:
+                    return
+                if chunk.text:
+                    yield chunk.text
+
+    async def generate_content(self, contents, max_output_tokens=500, temperature=0.1, system_instruction=None,
+                               timeout=None):
+        """Generates a response and returns its text."""
+        config = self._config(max_output_tokens, temperature, system_instruction)
+        response = await self._call(
+            lambda: self.client.aio.models.generate_content(model=self.model, contents=contents, config=config),
+            timeout,
+        )
+        return response.text
+
+    async def generate_many(self, prompts, return_exceptions=False, **kwargs):
+        """
+        Generates responses for many prompts concurrently, bounded by max_concurrency.
+
+        Args:
+            prompts (list): Contents for each call.
+            return_exceptions (bool): Return failed calls' exceptions in place of their text
+                instead of raising the first one.
+            **kwargs: Options forwarded to generate_content.
+
+        Returns:
+            list: Response texts in the order of prompts.
+        """
+        return await asyncio.gather(
+            *(self.generate_content(prompt, **kwargs) for prompt in prompts), return_exceptions=return_exceptions
+        )
+
+    async def generate_content_stream(self, contents, max_output_tokens=500, temperature=0.1,
+                                      system_instruction=None, timeout=None):
+        """Async generator of response text chunks."""
+        config = self._config(max_output_tokens, temperature, system_instruction)
+        async for text in self._stream(
+            lambda: self.client.aio.models.generate_content_stream(model=self.model, contents=contents, config=config),
+            timeout,
+        ):
+            yield text
+
+    def new_chat(self, history=None):
+        """Starts a chat session that keeps its history across chat() and chat_stream() calls."""
+        return self.client.aio.chats.create(model=self.model, history=history)
+
+    async def chat(self, messages, session=None, timeout=None):
+        """
+        Sends messages one after another in a chat session.
+
+        Args:
+            messages (list): User messages.
+            session: Session from new_chat(); a new one is started when omitted.
+            timeout (float): Deadline per message.
+
+        Returns:
+            list: The reply text for each message.
+        """
+        session = session or self.new_chat()
+        replies = []
+        for message in messages:
+            response = await self._call(lambda: session.send_message(message), timeout)
+            replies.append(response.text)
+        return replies
+
+    async def chat_stream(self, messages, session=None, timeout=None):
+        """Async generator of reply text chunks for messages sent one after another in a chat session."""
+        session = session or self.new_chat()
+        for message in messages:
+            async for text in self._stream(lambda: session.send_message_stream(message), timeout):
+                yield text
+
+
 # Example usage
-llm_service = LLMService(model='gemini-2.0-flash')
-llm_service.connect()
-print(llm_service.generate_content("Explain how AI works", system_instruction="You are a cat. Your name is Neko."))
-llm_service.generate_content_stream(["Explain how AI works"])
-llm_service.chat(["I have 2 dogs in my house.", "How many paws are in my house?"])
-llm_service.chat_stream(["I have 2 dogs in my house.", "How many paws are in my house?"])
+if __name__ == "__main__":
+    llm_service = LLMService(model='gemini-2.0-flash')
+    llm_service.connect()
+    print(llm_service.generate_content("Explain how AI works", system_instruction="You are a cat. Your name is Neko."))
+    llm_service.generate_content_stream(["Explain how AI works"])
+    llm_service.chat(["I have 2 dogs in my house.", "How many paws are in my house?"])
+    llm_service.chat_stream(["I have 2 dogs in my house.", "How many paws are in my house?"])
+
+    async def async_example():
+        async_service = AsyncLLMService(model='gemini-2.0-flash')
+        scenes = ["JOHN: Hi. MARY: Hello.", "The boy looks up at the sky.", "FADE OUT"]
+        print(await async_service.generate_many(scenes, system_instruction="Format this as a screenplay."))
+        async for text in async_service.chat_stream(["I have 2 dogs in my house.", "How many paws are in my house?"]):
+            print(text, end="")
+
+    asyncio.run(async_example())
@@ -0,0 +1,242 @@
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans range from sub-millisecond tokenization to minute-long formats of whole scripts
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {value}"]
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts plus sum and count, as Prometheus histograms expose them."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0, 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "inference_stage_seconds",
+    "Time spent in each stage of the inference path (queue_wait, template_load, tokenize, prefill, "
+    "decode, detokenize, transcribe).",
+    labelnames=("stage",),
+)
+PROMPT_TOKENS = metrics.counter("inference_prompt_tokens_total", "Prompt tokens sent to the model.")
+GENERATED_TOKENS = metrics.counter("inference_generated_tokens_total", "Tokens generated by the model.")
+DECODE_TOKENS_PER_SECOND = metrics.histogram(
+    "inference_decode_tokens_per_second",
+    "Decode throughput of each generate call, in tokens per second per sequence.",
+    buckets=(1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+BATCH_SIZE = metrics.histogram(
+    "inference_batch_size", "Prompts per dispatched batch.", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+AUDIO_SECONDS = metrics.counter("transcription_audio_seconds_total", "Seconds of audio transcribed.")
+HTTP_REQUESTS = metrics.counter("http_requests_total", "HTTP requests by route and status.", ("route", "status"))
+HTTP_SECONDS = metrics.histogram("http_request_seconds", "HTTP request latency by route.", ("route",))
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block and records it under inference_stage_seconds{stage=...}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+# Per-thread list that record_stages() collects stage timings into
+_recorded_stages = threading.local()
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    recorded = getattr(_recorded_stages, "stages", None)
+    if recorded is not None:
+        recorded.append((stage, seconds))
+
+
+@contextmanager
+def record_stages():
+    """
+    Collects the stage timings observed on this thread inside the block.
+
+    Inference workers use this to send their spans back to the server process, whose
+    registry is the one exported on /metrics.
+
+    Yields:
+        list: (stage, seconds) pairs, filled in as stages are observed.
+    """
+    recorded = []
+    _recorded_stages.stages = recorded
+    try:
+        yield recorded
+    finally:
+        _recorded_stages.stages = None
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every other thread at a fixed interval.
+
+    Writes the samples in folded-stack format ("frame;frame;frame count" per line), which
+    flamegraph.pl and speedscope read directly. Sampling keeps the overhead low enough to
+    profile individual requests on a live server; requests batched together with the
+    profiled one show up in the same profile.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self.samples = _Tally()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as profile_file:
+            for stack, count in self.samples.most_common():
+                profile_file.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {sum(self.samples.values())} profile samples to '{path}'")
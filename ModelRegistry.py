@@ -0,0 +1,409 @@
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModelForSeq2SeqLM, pipeline
+from SharedWeights import load_model_with_mmap_weights
+from Quantization import load_quantized_model, quantize_dynamic_int8, save_quantized_model
+from CompiledBackend import (
+    BACKENDS, compile_model, export_onnx, load_onnx_model, onnx_nbytes, quantize_onnx_int8, trial_generate,
+    uncompile_model,
+)
+
+logger = logging.getLogger(__name__)
+
+MODEL_CLASSES = {
+    "causal": AutoModelForCausalLM,
+    "seq2seq": AutoModelForSeq2SeqLM,
+}
+
+PIPELINE_TASKS = {
+    "causal": "text-generation",
+    "seq2seq": "text2text-generation",
+}
+
+# Weight precisions a model can be loaded in; int8 is dynamic quantization of the Linear layers (CPU only)
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def resolve_device(device="auto"):
+    """Returns 'cuda' when a GPU is available and device is 'auto', otherwise the requested device."""
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def model_nbytes(model):
+    """Estimates the memory held by a model's weights, counting tied and packed int8 weights once."""
+    seen = set()
+    total = 0
+    values = list(model.state_dict().values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (tuple, list)):
+            # Dynamically quantized Linear layers store (int8 weight, bias) tuples
+            values.extend(value)
+            continue
+        if not isinstance(value, torch.Tensor):
+            continue
+        key = (value.data_ptr(), value.numel())
+        if key in seen:
+            continue
+        seen.add(key)
+        total += value.numel() * value.element_size()
+    return total
+
+
+@dataclass
+class LoadedModel:
+    """A model and tokenizer held by the registry, plus bookkeeping for eviction."""
+    name: str
+    model_type: str
+    model: object
+    tokenizer: object
+    device: str
+    precision: str
+    nbytes: int
+    load_seconds: float
+    # Backend the model actually runs on (eager when compile or export failed)
+    backend: str = "eager"
+    _pipeline: object = None
+
+    @property
+    def pipeline(self):
+        """A transformers pipeline over this model, built on first access."""
+        if self._pipeline is None:
+            if self.backend == "onnx":
+                from optimum.pipelines import pipeline as ort_pipeline
+
+                self._pipeline = ort_pipeline(
+                    PIPELINE_TASKS[self.model_type], model=self.model, tokenizer=self.tokenizer, accelerator="ort"
+                )
+            else:
+                self._pipeline = pipeline(
+                    PIPELINE_TASKS[self.model_type], model=self.model, tokenizer=self.tokenizer, device=self.device
+                )
+        return self._pipeline
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "type": self.model_type,
+            "device": self.device,
+            "precision": self.precision,
+            "backend": self.backend,
+            "memory_mb": round(self.nbytes / 2**20, 1),
+            "load_seconds": round(self.load_seconds, 2),
+        }
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+
+    Models are loaded by name and type on first use and reused afterwards. When the
+    estimated memory of all loaded models exceeds the budget, the least recently used
+    models are evicted until it fits again (the model just requested is always kept).
+    """
+
+    def __init__(self, memory_budget_mb=None, save_directory="./models/", device="auto", mmap_weights=False,
+                 precision="fp32", backend="eager"):
+        """
+        Args:
+            memory_budget_mb (float): Soft limit on total model memory. None disables eviction.
+            save_directory (str): Directory where downloaded models are saved for reuse.
+            device (str): 'auto', 'cpu' or 'cuda'.
+            mmap_weights (bool): On CPU, back parameters with memory-mapped safetensors files
+                so several processes serving the same model share one copy of the weights.
+            precision (str): Default weight precision, one of PRECISIONS. Converted weights
+                (bf16 copies, int8 quantized state dicts) are cached under save_directory.
+            backend (str): One of BACKENDS. 'compile' runs torch.compile'd graphs with kernels
+                cached under save_directory; 'onnx' exports the model to ONNX once and runs it
+                with ONNX Runtime (CPU only). Models that fail to compile or export run eagerly.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision '{precision}'. Expected one of {PRECISIONS}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unsupported backend '{backend}'. Expected one of {BACKENDS}")
+        self.memory_budget_bytes = float(memory_budget_mb) * 2**20 if memory_budget_mb else None
+        self.save_directory = save_directory
+        self.device = resolve_device(device)
+        self.mmap_weights = mmap_weights and self.device == "cpu"
+        self.precision = precision
+        self.backend = backend
+        if backend == "onnx" and self.device != "cpu":
+            logger.warning("The ONNX backend runs on CPU only; using eager PyTorch on the GPU instead")
+            self.backend = "eager"
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, name, model_type="causal", revision="main", warmup=False, precision=None, save_directory=None):
+        """
+        Returns the loaded model, loading it if this is the first request for it.
+
+        Args:
+            name (str): Hugging Face model name.
+            model_type (str): 'causal' or 'seq2seq'.
+            revision (str): Model revision to pin when downloading.
+            warmup (bool): Run a one-token generation after loading.
+            precision (str): Weight precision; defaults to the registry's.
+            save_directory (str): Where to look for and save the model and its converted weights
+                when it has to be loaded; defaults to the registry's.
+
+        Returns:
+            LoadedModel: The cached model entry.
+        """
+        key = (name, model_type, self._resolve_precision(precision))
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            loaded = self._load(name, model_type, revision, key[2], save_directory or self.save_directory)
+            self._models[key] = loaded
+            self._enforce_budget(keep=key)
+
+        if warmup:
+            self.warmup(loaded)
+        return loaded
+
+    def is_loaded(self, name, model_type="causal", precision=None):
+        with self._lock:
+            return (name, model_type, self._resolve_precision(precision)) in self._models
+
+    def evict(self, name, model_type="causal", precision=None):
+        """Drops a model from the registry and releases its memory."""
+        with self._lock:
+            loaded = self._models.pop((name, model_type, self._resolve_precision(precision)), None)
+        if loaded is not None:
+            logger.info(f"Evicting model '{name}' ({loaded.nbytes / 2**20:.0f} MB)")
+            del loaded
+            self._free_memory()
+
+    def loaded_models(self):
+        """Describes loaded models from least to most recently used."""
+        with self._lock:
+            return [loaded.describe() for loaded in self._models.values()]
+
+    def warmup(self, loaded):
+        """Runs a dummy one-token generation so the first real request doesn't pay for lazy init."""
+        try:
+            inputs = loaded.tokenizer("Hello", return_tensors="pt").to(loaded.device)
+            with torch.no_grad():
+                loaded.model.generate(**inputs, max_new_tokens=1, pad_token_id=loaded.tokenizer.pad_token_id)
+        except Exception as e:
+            logger.warning(f"Warmup of model '{loaded.name}' failed: {e}")
+
+    def _resolve_precision(self, precision):
+        precision = precision or self.precision
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision '{precision}'. Expected one of {PRECISIONS}")
+        if precision == "int8" and self.device != "cpu":
+            logger.warning("Dynamic int8 quantization only runs on CPU; loading fp32 weights instead")
+            return "fp32"
+        return precision
+
+    def artifact_path(self, name, revision, precision, save_directory=None):
+        """Directory holding converted weights of a model for one revision and precision."""
+        return os.path.join(save_directory or self.save_directory, "_artifacts", name, revision, precision)
+
+    def _load(self, name, model_type, revision, precision, save_directory):
+        if model_type not in MODEL_CLASSES:
+            raise ValueError(f"Unsupported model type '{model_type}'. Expected one of {list(MODEL_CLASSES)}")
+
+        model_path = os.path.join(save_directory, name)
+        saved_locally = os.path.exists(model_path)
+        source = model_path if saved_locally else name
+        if saved_locally:
+            logger.info(f"Loading model '{name}' ({precision}) from local path on {self.device}.")
+        else:
+            logger.info(f"Model '{name}' not found locally. Attempting to download...")
+
+        started = time.perf_counter()
+        if self.backend == "onnx":
+            loaded = self._load_onnx(
+                name, model_type, revision, precision, source, saved_locally, started, save_directory
+            )
+            if loaded is not None:
+                return loaded
+
+        if precision == "int8":
+            model = self._load_int8(name, model_type, revision, source, saved_locally, save_directory)
+        elif self.mmap_weights:
+            if precision == "bf16":
+                source = self._bf16_artifact(name, model_type, revision, source, saved_locally, save_directory)
+            model = load_model_with_mmap_weights(MODEL_CLASSES[model_type], source, revision)
+        else:
+            model = self._from_pretrained(name, model_type, revision, source, saved_locally, save_directory)
+            if precision == "bf16":
+                model = model.to(torch.bfloat16)
+            model = model.to(self.device)
+        loaded = self._finish_load(name, model_type, model, revision, precision, started)
+        if self.backend == "compile":
+            self._compile(loaded)
+        return loaded
+
+    def _compile(self, loaded):
+        """Switches a loaded model to torch.compile'd graphs, staying eager if compilation fails."""
+        started = time.perf_counter()
+        try:
+            # Inductor keys its cache on the graph, weights layout and torch build, so one directory serves every model
+            compile_model(loaded.model, os.path.join(self.save_directory, "_artifacts", "_inductor"))
+            trial_generate(loaded.model, loaded.tokenizer, loaded.device)
+        except Exception as e:
+            uncompile_model(loaded.model)
+            logger.warning(f"torch.compile failed for '{loaded.name}', running it eagerly: {e}")
+            return
+        loaded.backend = "compile"
+        loaded.load_seconds += time.perf_counter() - started
+        logger.info(f"Compiled model '{loaded.name}' in {time.perf_counter() - started:.1f}s")
+
+    def _load_onnx(self, name, model_type, revision, precision, source, saved_locally, started, save_directory):
+        """
+        Loads the ONNX Runtime export of a model, exporting it the first time. Returns None on failure.
+
+        Exports are stored per model, revision and precision under artifact_path(). int8 is the
+        fp32 export with dynamically quantized MatMuls (causal models only); bf16 has no fast
+        ONNX Runtime CPU kernels, so the fp32 export is used.
+        """
+        if precision == "bf16" or (precision == "int8" and model_type != "causal"):
+            logger.warning(f"No {precision} ONNX export for '{name}' ({model_type}); using the fp32 export")
+            precision = "fp32"
+        try:
+            if not saved_locally:
+                # Download (and keep) the weights once, so the export doesn't fetch them again
+                self._from_pretrained(name, model_type, revision, source, saved_locally, save_directory)
+                source = os.path.join(save_directory, name)
+            export_dir = os.path.join(self.artifact_path(name, revision, "fp32", save_directory), "onnx")
+            model_dir = export_onnx(model_type, source, export_dir, revision)
+            file_name = None
+            if precision == "int8":
+                int8_dir = os.path.join(self.artifact_path(name, revision, "int8", save_directory), "onnx")
+                model_dir = quantize_onnx_int8(model_dir, int8_dir)
+                file_name = "model_quantized.onnx"
+            model = load_onnx_model(model_type, model_dir, file_name)
+        except Exception as e:
+            logger.warning(f"ONNX export of '{name}' unavailable, running it eagerly: {e}")
+            return None
+        return self._finish_load(
+            name, model_type, model, revision, precision, started, backend="onnx", nbytes=onnx_nbytes(model_dir)
+        )
+
+    def _from_pretrained(self, name, model_type, revision, source, saved_locally, save_directory):
+        """Loads fp32 weights, saving a local copy the first time a model is downloaded."""
+        try:
+            model = MODEL_CLASSES[model_type].from_pretrained(
+                source,
+                trust_remote_code=True,
+                torch_dtype=torch.float32,  # Use float32 to avoid quantization issues
+                revision=revision,
+                low_cpu_mem_usage=True,
+            )
+        except ValueError as e:
+            if "Unknown quantization type" in str(e):
+                raise ValueError(
+                    f"Unsupported quantization type encountered for model '{name}'. "
+                    "Please check the model configuration or use a different model."
+                ) from e
+            raise
+        model.eval()
+        if not saved_locally:
+            model.save_pretrained(os.path.join(save_directory, name))
+        return model
+
+    def _bf16_artifact(self, name, model_type, revision, source, saved_locally, save_directory):
+        """Returns a directory with bf16 safetensors weights of a model, writing it on first use."""
+        artifact_dir = self.artifact_path(name, revision, "bf16", save_directory)
+        if not os.path.exists(os.path.join(artifact_dir, "config.json")):
+            logger.info(f"Writing bf16 weights of '{name}' to '{artifact_dir}'")
+            model = self._from_pretrained(name, model_type, revision, source, saved_locally, save_directory)
+            model.to(torch.bfloat16).save_pretrained(artifact_dir)
+            del model
+            gc.collect()
+        return artifact_dir
+
+    def _load_int8(self, name, model_type, revision, source, saved_locally, save_directory):
+        """Loads a dynamically quantized model, quantizing and caching it on disk the first time."""
+        # Packed int8 weights are tied to the torch build that wrote them
+        artifact = os.path.join(
+            self.artifact_path(name, revision, "int8", save_directory), f"model-torch{torch.__version__}.pt"
+        )
+        if os.path.exists(artifact):
+            try:
+                return load_quantized_model(MODEL_CLASSES[model_type], source, artifact, revision)
+            except Exception as e:
+                logger.warning(f"Could not load quantized weights '{artifact}', quantizing again: {e}")
+
+        if self.mmap_weights:
+            logger.info("Quantized weights are not memory-mapped; each process holds its own int8 copy")
+        model = self._from_pretrained(name, model_type, revision, source, saved_locally, save_directory)
+        logger.info(f"Quantizing '{name}' to int8...")
+        model = quantize_dynamic_int8(model)
+        save_quantized_model(model, artifact)
+        return model
+
+    def _finish_load(self, name, model_type, model, revision, precision, started, backend="eager", nbytes=None):
+        tokenizer = AutoTokenizer.from_pretrained(name, revision=revision)
+        if model_type == "causal" and tokenizer.pad_token is None:
+            # Causal models like GPT-2 have no pad token; pad on the left with EOS so prompts can be batched.
+            tokenizer.pad_token = tokenizer.eos_token
+            tokenizer.padding_side = "left"
+            model.generation_config.pad_token_id = tokenizer.eos_token_id
+
+        loaded = LoadedModel(
+            name=name,
+            model_type=model_type,
+            model=model,
+            tokenizer=tokenizer,
+            device=self.device,
+            precision=precision,
+            nbytes=model_nbytes(model) if nbytes is None else nbytes,
+            load_seconds=time.perf_counter() - started,
+            backend=backend,
+        )
+        logger.info(
+            f"Loaded model '{name}' ({precision}, {backend}) in {loaded.load_seconds:.1f}s "
+            f"({loaded.nbytes / 2**20:.0f} MB)"
+        )
+        return loaded
+
+    def _enforce_budget(self, keep):
+        if self.memory_budget_bytes is None:
+            return
+        total = sum(loaded.nbytes for loaded in self._models.values())
+        evicted = False
+        for key in list(self._models):
+            if total <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            loaded = self._models.pop(key)
+            total -= loaded.nbytes
+            logger.info(f"Memory budget exceeded, evicting least recently used model '{loaded.name}'")
+            del loaded
+            evicted = True
+        if evicted:
+            self._free_memory()
+
+    def _free_memory(self):
+        # Evicted models are only dropped from the registry, not torn down: a caller still generating
+        # with one keeps it alive, and its memory is freed once that last reference goes
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+# Shared registry used by the backend and the transcription script
+model_registry = ModelRegistry(
+    memory_budget_mb=os.getenv("MODEL_MEMORY_BUDGET_MB"),
+    save_directory=os.getenv("MODEL_SAVE_DIRECTORY", "./models/"),
+    device=os.getenv("MODEL_DEVICE", "auto"),
+    mmap_weights=os.getenv("MODEL_MMAP_WEIGHTS", "0") == "1",
+    precision=os.getenv("MODEL_PRECISION", "fp32"),
+    backend=os.getenv("INFERENCE_BACKEND", "eager"),
+)
@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTemplate:
+    """
+    A prompt template file that is read once and re-read only when it changes on disk.
+
+    The template is split at the placeholder into a fixed prefix and a suffix. Token ids
+    of the prefix are cached per tokenizer, so the instruction text is tokenized once
+    rather than on every request.
+    """
+
+    def __init__(self, path, placeholder="{script}"):
+        self.path = path
+        self.placeholder = placeholder
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._text = None
+        self._version = None
+        self._prefix = ""
+        self._suffix = ""
+        self._prefix_ids = {}
+
+    def _refresh(self):
+        """Reloads the file if its modification time or size changed since the last read."""
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            with open(self.path, "r") as prompt_file:
+                text = prompt_file.read()
+            prefix, found, suffix = text.partition(self.placeholder)
+            self._text = text
+            self._prefix, self._suffix = (prefix, suffix) if found else (text, "")
+            self._version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+            self._prefix_ids = {}
+            self._stamp = stamp
+            logger.info(f"Loaded prompt template '{self.path}' (version {self._version})")
+
+    @property
+    def version(self):
+        """Short hash of the template text; changes whenever the file does."""
+        self._refresh()
+        return self._version
+
+    @property
+    def prefix(self):
+        """Template text before the placeholder."""
+        self._refresh()
+        return self._prefix
+
+    def render(self, script):
+        """Returns the template with the placeholder replaced by script."""
+        self._refresh()
+        return self._text.replace(self.placeholder, script)
+
+    def render_suffix(self, script):
+        """Returns everything after the fixed prefix: the script followed by the rest of the template."""
+        self._refresh()
+        return script + self._suffix.replace(self.placeholder, script)
+
+    def prefix_ids(self, tokenizer):
+        """Token ids of the prefix for this tokenizer, computed once per template version."""
+        self._refresh()
+        key = tokenizer.name_or_path
+        if key not in self._prefix_ids:
+            self._prefix_ids[key] = tokenizer.encode(self._prefix)
+        return self._prefix_ids[key]
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from BatchScheduler import QueueFullError
+from Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ROUTED_REQUESTS = metrics.counter(
+    "router_requests_total", "Provider attempts by outcome (won, failed, cancelled).", ("provider", "outcome")
+)
+HEDGED_REQUESTS = metrics.counter("router_hedges_total", "Requests that fired a hedge at a second provider.")
+
+
+class NoProviderAvailable(QueueFullError):
+    """Raised when every provider is unhealthy or at its concurrency limit."""
+
+
+class Provider:
+    """
+    A generation backend the router can send requests to.
+
+    Handlers are plain async callables per task (e.g. {"format": format_locally}), so the
+    local HuggingFaceAI path, AsyncLLMService and test stubs all plug in the same way.
+    """
+
+    def __init__(self, name, handlers, max_concurrency=8, cost_weight=1.0, health_check=None,
+                 failure_threshold=3, cooldown_seconds=30.0, latency_window=200):
+        """
+        Args:
+            name (str): Name used in logs, metrics and results.
+            handlers (dict): Task name to `async def handler(payload) -> str`.
+            max_concurrency (int): Requests the router sends this provider at once.
+            cost_weight (float): Relative cost of a request; cheaper providers are tried first.
+            health_check (callable): Optional `() -> bool`; False takes the provider out of rotation.
+            failure_threshold (int): Consecutive failures after which the provider is benched.
+            cooldown_seconds (float): How long a benched provider sits out.
+            latency_window (int): Number of recent successful latencies kept for percentiles.
+        """
+        self.name = name
+        self.handlers = handlers
+        self.max_concurrency = max_concurrency
+        self.cost_weight = cost_weight
+        self.health_check = health_check
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.benched_until = 0.0
+        self._latencies = deque(maxlen=latency_window)
+
+    def is_healthy(self):
+        if time.monotonic() < self.benched_until:
+            return False
+        try:
+            return self.health_check is None or bool(self.health_check())
+        except Exception:
+            return False
+
+    def has_capacity(self):
+        return self.in_flight < self.max_concurrency
+
+    def latency_percentile(self, percentile):
+        """Latency in seconds at the given percentile (0-100), or None without samples."""
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def record_success(self, seconds):
+        self._latencies.append(seconds)
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.benched_until = time.monotonic() + self.cooldown_seconds
+            logger.warning(f"Provider '{self.name}' failed {self.consecutive_failures} times, "
+                           f"benched for {self.cooldown_seconds:.0f}s")
+
+    def describe(self):
+        p50, p95 = self.latency_percentile(50), self.latency_percentile(95)
+        return {
+            "name": self.name,
+            "healthy": self.is_healthy(),
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "cost_weight": self.cost_weight,
+            "consecutive_failures": self.consecutive_failures,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class ProviderRouter:
+    """
+    Sends each request to the cheapest available provider and hedges slow ones.
+
+    If the primary hasn't answered within its own hedge_percentile latency, the same
+    request is also sent to the next provider; the first good answer wins and the other
+    attempt is cancelled. A failed primary fails over to the next provider right away.
+    Providers that are unhealthy, benched after repeated failures, or at their
+    concurrency limit are skipped.
+    """
+
+    def __init__(self, providers, hedge_percentile=95, min_samples=20, default_hedge_delay=10.0):
+        """
+        Args:
+            providers (list): Provider instances.
+            hedge_percentile (float): Percentile of the primary's recent latency after which to hedge.
+            min_samples (int): Latencies needed before the percentile is trusted.
+            default_hedge_delay (float): Hedge delay in seconds until then.
+        """
+        self.providers = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.default_hedge_delay = default_hedge_delay
+
+    def candidates(self, task):
+        """Available providers for a task, cheapest first and faster first among equal cost."""
+        available = [
+            provider for provider in self.providers
+            if task in provider.handlers and provider.is_healthy() and provider.has_capacity()
+        ]
+        return sorted(available, key=lambda provider: (provider.cost_weight, provider.latency_percentile(50) or 0))
+
+    def hedge_delay(self, provider):
+        if len(provider._latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return provider.latency_percentile(self.hedge_percentile)
+
+    async def _attempt(self, provider, task, payload):
+        provider.in_flight += 1
+        started = time.monotonic()
+        try:
+            result = await provider.handlers[task](payload)
+            if result is None:
+                raise RuntimeError(f"Provider '{provider.name}' returned no result")
+            provider.record_success(time.monotonic() - started)
+            return result
+        except asyncio.CancelledError:
+            ROUTED_REQUESTS.inc(provider=provider.name, outcome="cancelled")
+            raise
+        except Exception:
+            provider.record_failure()
+            ROUTED_REQUESTS.inc(provider=provider.name, outcome="failed")
+            raise
+        finally:
+            provider.in_flight -= 1
+
+    async def run(self, task, payload):
+        """
+        Runs a request on the providers.
+
+        Args:
+            task (str): Handler name, e.g. 'format'.
+            payload: Argument passed to the handler.
+
+        Returns:
+            tuple: (provider name, result) of the first provider that succeeded.
+        """
+        queue = self.candidates(task)
+        if not queue:
+            raise NoProviderAvailable(f"No provider available for '{task}'")
+
+        running = {}
+        last_error = None
+
+        def launch():
+            while queue:
+                provider = queue.pop(0)
+                # Re-check: capacity may have been taken since candidates() was computed
+                if provider.has_capacity() and provider.is_healthy():
+                    running[asyncio.ensure_future(self._attempt(provider, task, payload))] = provider
+                    return provider
+            return None
+
+        primary = launch()
+        if primary is None:
+            raise NoProviderAvailable(f"No provider available for '{task}'")
+        try:
+            hedge_at = asyncio.get_running_loop().time() + self.hedge_delay(primary)
+            while running:
+                # Until the hedge fires, wake up at the hedge time; afterwards just wait for results
+                timeout = None
+                if queue and len(running) == 1 and hedge_at is not None:
+                    timeout = max(0.0, hedge_at - asyncio.get_running_loop().time())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    if launch() is not None:
+                        HEDGED_REQUESTS.inc()
+                        logger.info(f"Hedging slow '{task}' request from '{primary.name}'")
+                    continue
+                for future in done:
+                    provider = running.pop(future)
+                    if future.exception() is None:
+                        ROUTED_REQUESTS.inc(provider=provider.name, outcome="won")
+                        return provider.name, future.result()
+                    last_error = future.exception()
+                    logger.warning(f"Provider '{provider.name}' failed on '{task}': {last_error}")
+                # Fail over if nothing else is still running
+                if not running:
+                    launch()
+        finally:
+            for future in running:
+                future.cancel()
+        raise last_error or NoProviderAvailable(f"No provider available for '{task}'")
+
+    def describe(self):
+        return [provider.describe() for provider in self.providers]
@@ -0,0 +1,102 @@
+import logging
+import os
+
+import torch
+from transformers import AutoConfig
+
+logger = logging.getLogger(__name__)
+
+
+def conv1d_to_linear(model):
+    """
+    Replace GPT-2 style Conv1D layers with equivalent nn.Linear layers.
+
+    Conv1D is a Linear with a transposed weight, but dynamic quantization only knows
+    about nn.Linear, so without this step GPT-2's attention and MLP weights stay fp32.
+
+    Args:
+        model: Model to convert in place.
+
+    Returns:
+        model: The same model.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if not isinstance(child, Conv1D):
+                continue
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(
+                in_features, out_features, bias=child.bias is not None,
+                device=child.weight.device, dtype=child.weight.dtype,
+            )
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                if child.bias is not None:
+                    linear.bias.copy_(child.bias)
+            setattr(module, child_name, linear)
+    return model
+
+
+def quantize_dynamic_int8(model, skip=("lm_head",)):
+    """
+    Quantize a model's Linear layers to int8 with dynamic activation quantization.
+
+    The output head is left in full precision by default: it is tied to the input
+    embeddings, so quantizing it would add a copy rather than save memory, and it has
+    the largest effect on which token is picked.
+
+    Args:
+        model: Model on CPU, in eval mode. Converted in place.
+        skip (tuple): Names of Linear modules to leave unquantized.
+
+    Returns:
+        model: The quantized model.
+    """
+    conv1d_to_linear(model)
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    spec = {
+        name: qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.rsplit(".", 1)[-1] not in skip
+    }
+    return torch.ao.quantization.quantize_dynamic(model, spec, dtype=torch.qint8, inplace=True)
+
+
+def save_quantized_model(model, path):
+    """Writes the state dict of a quantized model, so later loads skip the conversion."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = path + ".tmp"
+    torch.save(model.state_dict(), temporary_path)
+    os.replace(temporary_path, path)
+    logger.info(f"Saved quantized weights to '{path}'")
+
+
+def load_quantized_model(model_class, source, path, revision="main"):
+    """
+    Rebuild a quantized model from its config and a state dict written by save_quantized_model.
+
+    Args:
+        model_class: transformers Auto model class (e.g. AutoModelForCausalLM).
+        source (str): Local model directory or Hugging Face model name, for the config.
+        path (str): Quantized state dict file.
+        revision (str): Revision of the config when source is a model name.
+
+    Returns:
+        model: Quantized model in eval mode, on CPU.
+    """
+    config = AutoConfig.from_pretrained(source, revision=revision)
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        model = model_class.from_config(config)
+    else:
+        # The random init is replaced by the saved weights right away
+        with no_init_weights():
+            model = model_class.from_config(config)
+    model = quantize_dynamic_int8(model.eval())
+    # The file is our own artifact; packed int8 weights need full unpickling
+    model.load_state_dict(torch.load(path, map_location="cpu", weights_only=False))
+    model.tie_weights()
+    return model.eval()
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+# Startup finished but a check fails, e.g. every inference worker died
+UNAVAILABLE = "unavailable"
+
+STARTUP_SECONDS = metrics.gauge("startup_step_seconds", "Duration of each background startup step.", ("step",))
+
+
+class Readiness:
+    """
+    Background startup of the server, for liveness and readiness probes.
+
+    Startup runs on its own thread as named steps (imports, model load, warmup, ...) so the
+    server binds its port and answers probes while models load. Each step's duration is
+    kept. Once startup finishes, readiness also requires every registered check to pass,
+    e.g. that the pipeline is still loaded or that a worker process is up.
+    """
+
+    def __init__(self):
+        self.status = STARTING
+        self.current_step = None
+        self.step_seconds = {}
+        self.error = None
+        self.started_at = time.monotonic()
+        self.ready_after = None
+        self._checks = {}
+        self._thread = None
+
+    def add_check(self, name, check):
+        """Registers a `() -> bool` that must hold for the server to be ready."""
+        self._checks[name] = check
+
+    @contextmanager
+    def step(self, name):
+        """Times one startup step."""
+        self.current_step = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.step_seconds[name] = round(seconds, 3)
+            STARTUP_SECONDS.set(seconds, step=name)
+            self.current_step = None
+        logger.info(f"Startup step '{name}' took {seconds:.2f}s")
+
+    def start(self, startup):
+        """Runs `startup()` on a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(startup,), name="startup", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self, startup):
+        try:
+            startup()
+        except Exception as e:
+            logger.exception("Startup failed")
+            self.error = str(e) or type(e).__name__
+            self.status = FAILED
+            return
+        self.ready_after = round(time.monotonic() - self.started_at, 3)
+        self.status = READY
+        logger.info(f"Ready after {self.ready_after:.2f}s")
+
+    def failing_checks(self):
+        failing = []
+        for name, check in self._checks.items():
+            try:
+                if not check():
+                    failing.append(name)
+            except Exception:
+                failing.append(name)
+        return failing
+
+    @property
+    def is_ready(self):
+        return self.status == READY and not self.failing_checks()
+
+    def uptime(self):
+        return round(time.monotonic() - self.started_at, 3)
+
+    def describe(self):
+        failing = self.failing_checks() if self.status == READY else []
+        return {
+            "status": UNAVAILABLE if failing else self.status,
+            "current_step": self.current_step,
+            "step_seconds": dict(self.step_seconds),
+            "ready_after_seconds": self.ready_after,
+            "uptime_seconds": self.uptime(),
+            "failing_checks": failing,
+            "error": self.error,
+        }
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(model_name, template_version, text, params):
+    """
+    Content-addressed key for a generation request.
+
+    Args:
+        model_name (str): Model that produced the response.
+        template_version (str | None): Hash of the prompt template, or None for raw prompts.
+        text (str): Input text.
+        params (dict): Generation parameters that affect the output.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    payload = json.dumps([model_name, template_version, text, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(params):
+    """Only greedy/beam decoding is cacheable; sampled outputs change from call to call."""
+    return not params.get("do_sample", False)
+
+
+class ResponseCache:
+    """
+    Two-tier cache of generated responses.
+
+    An in-memory LRU of max_entries sits in front of an optional SQLite file. The disk
+    tier is trimmed to max_disk_mb by dropping least recently accessed rows. Disk hits
+    are promoted to memory.
+    """
+
+    def __init__(self, max_entries=1024, disk_path=None, max_disk_mb=256):
+        """
+        Args:
+            max_entries (int): Size of the in-memory LRU tier. 0 disables it.
+            disk_path (str): SQLite file for the persistent tier. None disables it.
+            max_disk_mb (float): Size limit for the persistent tier.
+        """
+        self.max_entries = max_entries
+        self.max_disk_bytes = int(max_disk_mb * 2**20)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        """Returns the cached response for key, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._counters["disk_hits"] += 1
+                    self._remember(key, row[0])
+                    return row[0]
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        """Stores a response in both tiers."""
+        with self._lock:
+            self._counters["stores"] += 1
+            self._remember(key, value)
+            if self._db is not None:
+                size = len(value.encode("utf-8"))
+                previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._disk_bytes += size - (previous[0] if previous else 0)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, size, time.time()),
+                )
+                self._trim_disk()
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+                self._disk_bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                stats["disk_bytes"] = self._disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _trim_disk(self):
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._disk_bytes -= size
+            self._counters["evictions"] += 1
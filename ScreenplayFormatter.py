@@ -0,0 +1,240 @@
+import re
+import textwrap
+from dataclasses import dataclass
+
+from Metrics import metrics
+from ScriptChunker import SPEAKER_NAME, split_turns
+
+SCENE_HEADING = "scene_heading"
+ACTION = "action"
+CHARACTER = "character"
+PARENTHETICAL = "parenthetical"
+DIALOGUE = "dialogue"
+TRANSITION = "transition"
+# Text the rules can't classify confidently; it is handed to the model
+AMBIGUOUS = "ambiguous"
+
+HEADING_LINE = re.compile(r"^(?:INT\./EXT|INT/EXT|I/E|INT|EXT|EST)[.\s]", re.IGNORECASE)
+TRANSITION_LINE = re.compile(
+    r"^(?:FADE (?:IN|OUT|TO BLACK)|(?:SMASH |MATCH |JUMP )?CUT TO|DISSOLVE TO|WIPE TO)[:.]?$", re.IGNORECASE
+)
+# An all-caps name alone on a line, optionally with an extension, e.g. "MARY (V.O.)"
+CHARACTER_CUE = re.compile(r"^[A-Z][A-Z0-9 .'\-]{0,30}(?: \((?:V\.O\.|O\.S\.|O\.C\.|CONT'D)\))?$")
+TURN_NAME = re.compile(rf"^({SPEAKER_NAME}):\s*(.*)$", re.DOTALL)
+HONORIFIC = re.compile(r"^(?:Mr|Mrs|Ms|Dr|Prof)\. ")
+# Capitalized words that start "Word: ..." prose (labels, articles, times) far more often than they name a speaker
+NON_NAME_WORDS = frozenset(
+    """
+    a an the this that these those my our your his her their its and but or so then now here there
+    note notes update warning caution reminder subject re ps answer question example step summary
+    time date day night morning evening location setting scene chapter act part title later meanwhile
+    """.split()
+)
+LEADING_PARENTHETICAL = re.compile(r"^(\([^)]*\))\s*(.*)$", re.DOTALL)
+QUOTED_SPEECH = re.compile(r"[\"“”]")
+SENTENCE_PUNCTUATION = re.compile(r"[.!?]")
+
+# Indentation (in characters) and wrap width of each element in the plain-text screenplay layout
+LAYOUT = {
+    SCENE_HEADING: (0, 60),
+    ACTION: (0, 60),
+    CHARACTER: (22, 38),
+    PARENTHETICAL: (16, 25),
+    DIALOGUE: (10, 35),
+    TRANSITION: (45, 15),
+}
+# Elements printed directly under the previous one rather than after a blank line
+ATTACHED = {PARENTHETICAL, DIALOGUE}
+
+FORMATTED_SPANS = metrics.counter(
+    "screenplay_formatter_spans_total", "Script spans formatted by the rules or handed to the model.", ("path",)
+)
+
+
+@dataclass
+class ScreenplayElement:
+    """One element of a screenplay, e.g. a scene heading or a line of dialogue."""
+    kind: str
+    text: str
+
+
+def _classify_prose(text, run_on_words):
+    """Action for ordinary sentences; ambiguous for embedded quoted speech or unpunctuated run-on dictation."""
+    if QUOTED_SPEECH.search(text):
+        return AMBIGUOUS
+    if len(text.split()) >= run_on_words and (not SENTENCE_PUNCTUATION.search(text) or text[0].islower()):
+        return AMBIGUOUS
+    return ACTION
+
+
+def _confident_name(name):
+    """Whether a 'Name:' candidate is a speaker rather than prose like 'The Time: midnight.'"""
+    if HONORIFIC.match(name):
+        return True
+    return not any(word.lower() in NON_NAME_WORDS for word in name.split())
+
+
+def _turn_elements(turn):
+    """Elements of a 'Name: (tone) line' speaker turn."""
+    name, speech = TURN_NAME.match(turn).groups()
+    elements = [ScreenplayElement(CHARACTER, name.upper())]
+    parenthetical = LEADING_PARENTHETICAL.match(speech)
+    if parenthetical:
+        elements.append(ScreenplayElement(PARENTHETICAL, parenthetical.group(1)))
+        speech = parenthetical.group(2)
+    if speech:
+        elements.append(ScreenplayElement(DIALOGUE, speech.strip()))
+    return elements
+
+
+def parse(script, run_on_words=12):
+    """
+    Parse a script into screenplay elements in a single pass over its lines.
+
+    Handles scene headings, transitions, 'NAME: line' speaker turns (several per line, as
+    dictation produces them), already formatted character cues with dialogue under them,
+    and ordinary action lines. Prose the rules can't be sure about, such as quoted speech
+    inside narration, unpunctuated run-on dictation, or a 'Word:' turn that is more likely a
+    label than a name, becomes an AMBIGUOUS element;
+    consecutive ambiguous lines are merged into one span.
+
+    Args:
+        script (str): Script text.
+        run_on_words (int): Unpunctuated or lower-case prose at least this long is ambiguous.
+
+    Returns:
+        list: ScreenplayElement objects in script order.
+    """
+    elements = []
+    in_dialogue = False
+    lines = script.splitlines()
+
+    def add(kind, text):
+        if kind == AMBIGUOUS and elements and elements[-1].kind == AMBIGUOUS:
+            elements[-1].text += "\n" + text
+        else:
+            elements.append(ScreenplayElement(kind, text))
+
+    for index, raw_line in enumerate(lines):
+        line = raw_line.strip()
+        if not line:
+            in_dialogue = False
+            continue
+        if HEADING_LINE.match(line):
+            add(SCENE_HEADING, line.upper())
+            in_dialogue = False
+        elif TRANSITION_LINE.match(line):
+            text = line.upper().rstrip(".")
+            add(TRANSITION, text if text.endswith(":") or text == "FADE IN" else text + ":")
+            in_dialogue = False
+        elif in_dialogue:
+            add(PARENTHETICAL if line.startswith("(") and line.endswith(")") else DIALOGUE, line)
+        elif CHARACTER_CUE.match(line) and index + 1 < len(lines) and lines[index + 1].strip():
+            add(CHARACTER, line)
+            in_dialogue = True
+        else:
+            for turn in split_turns(line):
+                name = TURN_NAME.match(turn)
+                if name and _confident_name(name.group(1)):
+                    for element in _turn_elements(turn):
+                        add(element.kind, element.text)
+                elif name:
+                    add(AMBIGUOUS, turn)
+                else:
+                    add(_classify_prose(turn, run_on_words), turn)
+    return elements
+
+
+def _render_element(element):
+    indent, width = LAYOUT[element.kind]
+    return textwrap.fill(
+        element.text, width=indent + width, initial_indent=" " * indent, subsequent_indent=" " * indent,
+        break_long_words=False,
+    )
+
+
+def render(elements, resolved=None):
+    """
+    Lay out screenplay elements as plain text.
+
+    Args:
+        elements (list): Output of parse().
+        resolved (dict): Element index to the model's formatting of an AMBIGUOUS element.
+            Ambiguous elements without a resolution are laid out as action.
+
+    Returns:
+        str: The formatted screenplay.
+    """
+    resolved = resolved or {}
+    parts = []
+    for index, element in enumerate(elements):
+        if element.kind == AMBIGUOUS:
+            text = resolved.get(index)
+            text = text.strip() if text else _render_element(ScreenplayElement(ACTION, element.text))
+        else:
+            text = _render_element(element)
+        if parts:
+            parts.append("\n" if element.kind in ATTACHED else "\n\n")
+        parts.append(text)
+    return "".join(parts) + "\n"
+
+
+def ambiguous_spans(elements):
+    """Indexes and texts of the elements that need the model."""
+    return [(index, element.text) for index, element in enumerate(elements) if element.kind == AMBIGUOUS]
+
+
+def format_script(script, fallback=None):
+    """
+    Format a script with the rules, sending only ambiguous spans to fallback.
+
+    Args:
+        script (str): Script text.
+        fallback (callable): `(span) -> str or None`, e.g. HuggingFaceAI.format_script with
+            return_full_text=False. Without it ambiguous spans are kept as action.
+
+    Returns:
+        str: The formatted screenplay.
+    """
+    elements = parse(script)
+    spans = ambiguous_spans(elements)
+    record_spans(elements)
+    resolved = {index: fallback(text) for index, text in spans} if fallback else {}
+    return render(elements, resolved)
+
+
+def split_scenes(script):
+    """
+    Split a script into units that can be formatted independently.
+
+    Units start at scene headings; a script without any headings (e.g. raw dictation) is split
+    into blank-line separated paragraphs instead. Joining the units with "\\n" gives back the
+    script, and whitespace-only units are dropped.
+
+    Args:
+        script (str): Script text.
+
+    Returns:
+        list: Unit texts in script order.
+    """
+    lines = script.split("\n")
+    by_heading = any(HEADING_LINE.match(line.strip()) for line in lines)
+    scenes, current = [], []
+    previous_blank = False
+    for line in lines:
+        stripped = line.strip()
+        starts = HEADING_LINE.match(stripped) if by_heading else stripped and previous_blank
+        if starts and any(part.strip() for part in current):
+            scenes.append("\n".join(current))
+            current = []
+        current.append(line)
+        previous_blank = not stripped
+    scenes.append("\n".join(current))
+    return [scene for scene in scenes if scene.strip()]
+
+
+def record_spans(elements):
+    """Counts how many elements the rules handled and how many go to the model."""
+    ambiguous = sum(element.kind == AMBIGUOUS for element in elements)
+    FORMATTED_SPANS.inc(len(elements) - ambiguous, path="rules")
+    FORMATTED_SPANS.inc(ambiguous, path="model")
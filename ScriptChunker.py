@@ -0,0 +1,166 @@
+import re
+from dataclasses import dataclass
+
+# A speaker name is one or two capitalized words, optionally after an honorific, e.g. "John", "MARY ANN", "Dr. Smith"
+SPEAKER_NAME = r"(?:(?:Mr|Mrs|Ms|Dr|Prof)\. )?[A-Z][A-Za-z'\-]*(?: [A-Z][A-Za-z'\-]*)?"
+# A speaker turn is a name and a colon at the start of a line or of a sentence. Matching the whole name
+# (rather than splitting on a lookahead) keeps "Mary Ann:" and "Dr. Smith:" from being cut after the first word.
+SPEAKER_TURN = re.compile(rf"(?:^|(?<=[.!?])\s+|(?<=[.!?][\"'])\s+)(?P<name>{SPEAKER_NAME}):(?=\s)")
+# Sentence boundaries, allowing a closing quote after the punctuation
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|(?<=[.!?][\"'])\s+")
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def split_turns(line):
+    """Split a line at speaker turns; text before the first turn is kept as its own piece."""
+    starts = [match.start("name") for match in SPEAKER_TURN.finditer(line)]
+    bounds = ([0] if not starts or starts[0] else []) + starts + [len(line)]
+    return [line[begin:end].strip() for begin, end in zip(bounds, bounds[1:]) if line[begin:end].strip()]
+
+
+@dataclass
+class ScriptChunk:
+    """A token-budgeted window of the script; the first overlap_units units repeat the previous chunk."""
+    text: str
+    tokens: int
+    overlap_units: int = 0
+
+
+def split_units(script, count_tokens, max_tokens):
+    """
+    Split a script into units on line, speaker and sentence boundaries.
+
+    Args:
+        script (str): Script text.
+        count_tokens (callable): Returns the token count of a string.
+        max_tokens (int): Units longer than this are split on word boundaries.
+
+    Returns:
+        list: (text, tokens, ends_line) tuples in script order.
+    """
+    units = []
+    for line in script.splitlines():
+        pieces = []
+        for turn in split_turns(line.strip()):
+            pieces.extend(sentence for sentence in SENTENCE_END.split(turn.strip()) if sentence)
+        for index, piece in enumerate(pieces):
+            ends_line = index == len(pieces) - 1
+            for text in _split_long_unit(piece, count_tokens, max_tokens):
+                units.append((text, count_tokens(text), False))
+            units[-1] = units[-1][:2] + (ends_line,)
+        if not pieces and units:
+            # Keep blank lines (e.g. between scenes) as paragraph breaks
+            units[-1] = (units[-1][0] + "\n", units[-1][1], True)
+    return units
+
+
+def _split_long_unit(text, count_tokens, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    pieces, current = [], []
+    for word in text.split():
+        if current and count_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _join_units(units):
+    parts = []
+    for index, (text, _, ends_line) in enumerate(units):
+        parts.append(text)
+        if index < len(units) - 1:
+            parts.append("\n" if ends_line else " ")
+    return "".join(parts)
+
+
+def split_script(script, count_tokens, max_tokens=400, overlap_tokens=40):
+    """
+    Split a script into token-budgeted chunks that overlap by a few units.
+
+    Args:
+        script (str): Script text.
+        count_tokens (callable): Returns the token count of a string.
+        max_tokens (int): Token budget per chunk.
+        overlap_tokens (int): Budget for the trailing units repeated at the start of the next chunk.
+
+    Returns:
+        list[ScriptChunk]: Chunks in script order.
+    """
+    chunks = []
+    current, current_tokens, overlap_units = [], 0, 0
+    for unit in split_units(script, count_tokens, max_tokens):
+        tokens = unit[1]
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(ScriptChunk(_join_units(current), current_tokens, overlap_units))
+            carry, carry_tokens = [], 0
+            for previous in reversed(current):
+                if carry_tokens + previous[1] > overlap_tokens:
+                    break
+                carry.insert(0, previous)
+                carry_tokens += previous[1]
+            if carry_tokens + tokens > max_tokens:
+                carry, carry_tokens = [], 0
+            current, current_tokens, overlap_units = carry, carry_tokens, len(carry)
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append(ScriptChunk(_join_units(current), current_tokens, overlap_units))
+    return chunks
+
+
+def _normalize(line):
+    return NON_WORD.sub(" ", line.lower()).strip()
+
+
+def stitch_chunks(formatted_chunks, window_lines=12, min_overlap_words=3):
+    """
+    Join formatted chunks in order, dropping lines repeated because of the input overlap.
+
+    The longest run of leading lines of each chunk that also appears as a contiguous run
+    in the last window_lines lines of the text so far is treated as the duplicated overlap.
+    Runs with fewer than min_overlap_words words (e.g. a lone character cue) are kept.
+
+    Args:
+        formatted_chunks (list[str]): Formatted output of each chunk, in order.
+        window_lines (int): How far back into the previous output to look for duplicates.
+        min_overlap_words (int): Minimum size of a run that counts as a duplicate.
+
+    Returns:
+        str: The stitched script.
+    """
+    lines = []
+    for formatted in formatted_chunks:
+        new_lines = (formatted or "").strip("\n").splitlines()
+        if lines:
+            new_lines = new_lines[_duplicated_prefix(lines[-window_lines:], new_lines, min_overlap_words):]
+            if new_lines and lines[-1].strip() and new_lines[0].strip():
+                lines.append("")
+        lines.extend(new_lines)
+    return "\n".join(lines).strip()
+
+
+def _duplicated_prefix(tail, new_lines, min_overlap_words):
+    """Returns how many leading lines of new_lines duplicate a contiguous run of tail."""
+    tail_content = [_normalize(line) for line in tail if line.strip()]
+    positions = [index for index, line in enumerate(new_lines) if line.strip()]
+    new_content = [_normalize(new_lines[index]) for index in positions]
+
+    best = 0
+    for start in range(len(tail_content)):
+        length = 0
+        while (length < len(new_content) and start + length < len(tail_content)
+               and tail_content[start + length] == new_content[length]):
+            length += 1
+        if length > best and sum(len(line.split()) for line in new_content[:length]) >= min_overlap_words:
+            best = length
+    if best == 0:
+        return 0
+    # Also drop blank lines between the duplicated run and the new content
+    cut = positions[best - 1] + 1
+    while cut < len(new_lines) and not new_lines[cut].strip():
+        cut += 1
+    return cut
@@ -0,0 +1,121 @@
+import json
+import logging
+import mmap
+import os
+import struct
+
+import torch
+from huggingface_hub import snapshot_download
+from transformers import AutoConfig
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# Keeps the mappings alive for as long as the process runs
+_mappings = []
+
+
+def mmap_safetensors(path):
+    """
+    Map a .safetensors file and return its tensors without copying them.
+
+    The file is mapped copy-on-write, so every process that maps the same file shares the
+    same physical pages through the page cache until a tensor is written to, which
+    inference never does.
+
+    Args:
+        path (str): Path to a .safetensors file.
+
+    Returns:
+        dict: Tensor name to tensor backed by the mapping.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    _mappings.append(mapping)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + begin)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+
+def find_safetensors_files(model_dir):
+    """Returns the .safetensors files of a model directory, following a shard index if present."""
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as index_file:
+            shards = sorted(set(json.load(index_file)["weight_map"].values()))
+        return [os.path.join(model_dir, shard) for shard in shards]
+    single = os.path.join(model_dir, "model.safetensors")
+    if os.path.exists(single):
+        return [single]
+    raise FileNotFoundError(f"No safetensors weights found in '{model_dir}'")
+
+
+def load_model_with_mmap_weights(model_class, source, revision="main"):
+    """
+    Build a model whose parameters point into memory-mapped safetensors files.
+
+    Args:
+        model_class: transformers Auto model class (e.g. AutoModelForCausalLM).
+        source (str): Local model directory or Hugging Face model name.
+        revision (str): Revision to download when source is a model name.
+
+    Returns:
+        model: Model in eval mode, on CPU.
+    """
+    model_dir = source if os.path.isdir(source) else snapshot_download(
+        source, revision=revision, allow_patterns=["*.json", "*.safetensors"]
+    )
+    config = AutoConfig.from_pretrained(model_dir)
+
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        model = model_class.from_config(config)
+    else:
+        # The random init would be thrown away immediately, so skip it
+        with no_init_weights():
+            model = model_class.from_config(config)
+
+    state_dict = {}
+    for path in find_safetensors_files(model_dir):
+        state_dict.update(mmap_safetensors(path))
+
+    # Checkpoints of base models (e.g. gpt2) omit the head model's prefix ("transformer.")
+    expected = set(model.state_dict())
+    prefix = model.base_model_prefix + "."
+    state_dict = {
+        name if name in expected or prefix + name not in expected else prefix + name: tensor
+        for name, tensor in state_dict.items()
+    }
+
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    if result.missing_keys:
+        tied = {name for name in result.missing_keys if name.endswith("lm_head.weight")}
+        missing = set(result.missing_keys) - tied
+        if missing:
+            logger.warning(f"Weights missing from checkpoint and left uninitialized: {sorted(missing)}")
+    return model.eval()
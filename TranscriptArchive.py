@@ -0,0 +1,367 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from Metrics import metrics, observe_stage
+import ScreenplayFormatter
+
+logger = logging.getLogger(__name__)
+
+# Document kinds
+TRANSCRIPT = "transcript"
+SCRIPT = "script"
+
+WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# Character names are indexed as "@NAME" terms, so a character never matches the plain word
+CHARACTER_PREFIX = "@"
+NAME_EXTENSION = re.compile(r"\s*\([^)]*\)$")
+
+# One file per column, all indexed by segment number. text_end is the end offset of each
+# segment's UTF-8 text in text.bin (the start is the previous segment's end).
+COLUMNS = {"start": "<f4", "end": "<f4", "document": "<u4", "text_end": "<u8"}
+
+ARCHIVED_SEGMENTS = metrics.counter("archive_segments_total", "Segments added to the transcript archive.", ("kind",))
+
+
+@dataclass
+class ArchiveMatch:
+    """A matching segment (or run of adjacent segments) and where it is in the audio."""
+    document: int
+    source: str
+    kind: str
+    # Seconds into the recording; None for scripts, which have no audio
+    start: float
+    end: float
+    text: str
+    characters: tuple = ()
+
+
+def character_names(text):
+    """Upper-case names of the characters speaking in text ('NAME: line' turns or character cues)."""
+    return [
+        NAME_EXTENSION.sub("", element.text).strip()
+        for element in ScreenplayFormatter.parse(text)
+        if element.kind == ScreenplayFormatter.CHARACTER
+    ]
+
+
+def tokenize(text):
+    return WORD.findall(text.lower())
+
+
+def _segment_fields(segment):
+    """(start, end, text) of a Whisper segment or a {"start", "end", "text"} dict."""
+    if isinstance(segment, dict):
+        return segment["start"], segment["end"], segment["text"]
+    return segment.start, segment.end, segment.text
+
+
+class TranscriptArchive:
+    """
+    Append-only store of transcripts and formatted scripts, searchable by word, character and time.
+
+    Segments are stored column by column in flat files under one directory: start and end times
+    as float32 arrays, the owning document as a uint32 array and the text as one UTF-8 buffer
+    with an array of end offsets. The columns are memory-mapped for queries, so opening an
+    archive of months of dictation reads almost nothing.
+
+    An inverted index maps each word, and each character name, to the sorted segment numbers
+    containing it. It is persisted on flush() (and close()); segments added since are indexed in
+    memory, and on open any segments the saved index doesn't cover are indexed again, so a crash
+    never loses searchability. A transcript segment without a 'NAME:' turn is attributed to the
+    last character who spoke in the same transcript.
+
+    Scripts are stored one scene per segment, without times.
+    """
+
+    def __init__(self, path, flush_segments=50000):
+        """
+        Args:
+            path (str): Archive directory (created if missing).
+            flush_segments (int): Save the index once this many segments are only indexed in memory.
+        """
+        self.path = path
+        self.flush_segments = flush_segments
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self.documents = []
+        self._maps = {}
+        self._terms = {}
+        self._postings = np.empty(0, dtype="<u4")
+        self._indexed = 0
+        # Postings of segments added after the saved index: term -> list of segment numbers
+        self._tail = {}
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def segment_count(self):
+        if not self.documents:
+            return 0
+        last = self.documents[-1]
+        return last["first_segment"] + last["segments"]
+
+    def __len__(self):
+        return self.segment_count
+
+    def _load(self):
+        documents_path = self._file("documents.jsonl")
+        if os.path.exists(documents_path):
+            with open(documents_path, "rb+") as documents_file:
+                committed = 0
+                for line in documents_file:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("no trailing newline")
+                        self.documents.append(json.loads(line))
+                    except ValueError:
+                        # A crash mid-write leaves a truncated last line; its segments are cut below
+                        logger.warning(f"Skipping unreadable document line in {documents_path}")
+                        break
+                    committed += len(line)
+                # Cut the partial line too, or the next document would be appended onto it
+                documents_file.truncate(committed)
+        self._truncate_to_documents()
+
+        index_path = self._file("index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as index_file:
+                index = json.load(index_file)
+            if index["segments"] <= self.segment_count:
+                self._terms = index["terms"]
+                self._indexed = index["segments"]
+                postings_path = self._file(index["postings"])
+                if os.path.getsize(postings_path):
+                    self._postings = np.memmap(postings_path, dtype="<u4", mode="r")
+        if self._indexed < self.segment_count:
+            logger.info(f"Indexing {self.segment_count - self._indexed} segments missing from the saved index")
+            self._index_range(self._indexed, self.segment_count)
+
+    def _truncate_to_documents(self):
+        """Drops column data written after the last complete document, e.g. by a crash mid-add."""
+        count = self.segment_count
+        for name, dtype in COLUMNS.items():
+            column_path = self._file(f"{name}.bin")
+            with open(column_path, "ab") as column_file:
+                column_file.truncate(count * np.dtype(dtype).itemsize)
+        text_bytes = int(self._column("text_end")[-1]) if count else 0
+        with open(self._file("text.bin"), "ab") as text_file:
+            text_file.truncate(text_bytes)
+        self._maps = {}
+
+    def _column(self, name):
+        """Memory-mapped column of the committed segments."""
+        if name not in self._maps:
+            count = self.segment_count
+            if name == "text":
+                size = int(self._column("text_end")[-1]) if count else 0
+                shape, dtype = (size,), "u1"
+            else:
+                shape, dtype = (count,), COLUMNS[name]
+            self._maps[name] = (
+                np.memmap(self._file(f"{name}.bin"), dtype=dtype, mode="r", shape=shape)
+                if shape[0] else np.empty(0, dtype=dtype)
+            )
+        return self._maps[name]
+
+    def _text(self, segment):
+        text_end = self._column("text_end")
+        begin = int(text_end[segment - 1]) if segment else 0
+        return bytes(self._column("text")[begin:int(text_end[segment])]).decode("utf-8")
+
+    def add_transcript(self, segments, source=None, metadata=None):
+        """
+        Stores a transcript with its segment times.
+
+        Args:
+            segments (iterable): Whisper segments, or dicts with "start", "end" and "text".
+            source (str): Where it came from, e.g. the recording's path.
+            metadata (dict): Anything else to keep with the document.
+
+        Returns:
+            int: Document id.
+        """
+        rows = [_segment_fields(segment) for segment in segments]
+        return self._add(TRANSCRIPT, rows, source, metadata)
+
+    def add_script(self, script, source=None, metadata=None):
+        """Stores a formatted script, one scene per segment. Returns the document id."""
+        rows = [(np.nan, np.nan, scene) for scene in ScreenplayFormatter.split_scenes(script)]
+        return self._add(SCRIPT, rows, source, metadata)
+
+    def _add(self, kind, rows, source, metadata):
+        with self._lock:
+            document_id = len(self.documents)
+            first = self.segment_count
+            encoded = [text.strip().encode("utf-8") for _, _, text in rows]
+            text_base = int(self._column("text_end")[-1]) if first else 0
+            columns = {
+                "start": np.array([start for start, _, _ in rows], dtype=COLUMNS["start"]),
+                "end": np.array([end for _, end, _ in rows], dtype=COLUMNS["end"]),
+                "document": np.full(len(rows), document_id, dtype=COLUMNS["document"]),
+                "text_end": text_base + np.cumsum([len(text) for text in encoded], dtype=COLUMNS["text_end"]),
+            }
+            # Data first, then the document line that commits it
+            with open(self._file("text.bin"), "ab") as text_file:
+                text_file.write(b"".join(encoded))
+            for name, values in columns.items():
+                with open(self._file(f"{name}.bin"), "ab") as column_file:
+                    column_file.write(values.tobytes())
+            document = {
+                "id": document_id, "kind": kind, "source": source, "first_segment": first, "segments": len(rows),
+                "added_at": round(time.time(), 3), "metadata": metadata or {},
+            }
+            with open(self._file("documents.jsonl"), "a", encoding="utf-8") as documents_file:
+                documents_file.write(json.dumps(document, ensure_ascii=False) + "\n")
+            self.documents.append(document)
+            self._maps = {}
+            self._index_range(first, first + len(rows))
+            ARCHIVED_SEGMENTS.inc(len(rows), kind=kind)
+            if self.segment_count - self._indexed >= self.flush_segments:
+                self.flush()
+            return document_id
+
+    def _index_range(self, begin, end):
+        """Adds segments [begin, end) to the in-memory tail of the index."""
+        documents = self._column("document")
+        speaker, previous_document = None, None
+        for segment in range(begin, end):
+            document = int(documents[segment])
+            if document != previous_document:
+                speaker, previous_document = None, document
+            text = self._text(segment)
+            terms = set(tokenize(text))
+            names = character_names(text)
+            if self.documents[document]["kind"] == TRANSCRIPT:
+                # Whisper splits long turns; the continuation belongs to whoever was speaking
+                if not names and speaker:
+                    names = [speaker]
+                speaker = names[-1] if names else speaker
+            terms.update(CHARACTER_PREFIX + name for name in names)
+            for term in terms:
+                self._tail.setdefault(term, []).append(segment)
+
+    def _postings_for(self, term):
+        """Sorted segment numbers containing term."""
+        saved = self._terms.get(term)
+        saved = self._postings[saved[0]:saved[0] + saved[1]] if saved else np.empty(0, dtype="<u4")
+        tail = self._tail.get(term)
+        return np.concatenate([saved, np.array(tail, dtype="<u4")]) if tail else np.asarray(saved)
+
+    def flush(self):
+        """Saves the index, merging the in-memory postings into it."""
+        with self._lock:
+            if not self._tail and self._indexed == self.segment_count:
+                return
+            terms, chunks, offset = {}, [], 0
+            for term in sorted(set(self._terms) | set(self._tail)):
+                postings = self._postings_for(term)
+                terms[term] = [offset, len(postings)]
+                chunks.append(postings)
+                offset += len(postings)
+            # A new postings file per generation, so the saved index.json always points at a complete one
+            postings_name = f"postings.{self.segment_count}.bin"
+            with open(self._file(postings_name), "wb") as postings_file:
+                for chunk in chunks:
+                    postings_file.write(np.asarray(chunk, dtype="<u4").tobytes())
+            index_path = self._file("index.json")
+            with open(f"{index_path}.tmp", "w", encoding="utf-8") as index_file:
+                json.dump({"segments": self.segment_count, "postings": postings_name, "terms": terms}, index_file)
+            os.replace(f"{index_path}.tmp", index_path)
+            for name in os.listdir(self.path):
+                if name.startswith("postings.") and name != postings_name:
+                    os.remove(self._file(name))
+            self._terms, self._tail, self._indexed = terms, {}, self.segment_count
+            self._postings = (
+                np.memmap(self._file(postings_name), dtype="<u4", mode="r") if offset else np.empty(0, dtype="<u4")
+            )
+
+    def close(self):
+        self.flush()
+
+    def search(self, query="", character=None, start=None, end=None, kind=None, source=None, limit=100,
+               merge_gap=None):
+        """
+        Segments matching every word of query, optionally spoken by character and within a time range.
+
+        Args:
+            query (str): Words that must all appear in the segment (case-insensitive). A query
+                with no words in it, e.g. "!!!", matches nothing.
+            character (str): Character name, e.g. "SARAH".
+            start (float): Only segments ending after this many seconds into their recording.
+            end (float): Only segments starting before this many seconds. Scripts have no times,
+                so either bound leaves them out.
+            kind (str): TRANSCRIPT or SCRIPT.
+            source (str): Only documents with this source.
+            limit (int): Most matches returned, in archive order.
+            merge_gap (float): Merge matches of the same transcript less than this many seconds
+                apart into one time range.
+
+        Returns:
+            list: ArchiveMatch objects.
+        """
+        started = time.perf_counter()
+        terms = tokenize(query)
+        if query.strip() and not terms:
+            # Punctuation alone would otherwise drop the word filter and match every segment
+            return []
+        if character:
+            terms.append(CHARACTER_PREFIX + NAME_EXTENSION.sub("", character).strip().upper())
+        with self._lock:
+            candidates = None
+            # Rarest terms first keeps the intersections small
+            for postings in sorted((self._postings_for(term) for term in terms), key=len):
+                candidates = postings if candidates is None else np.intersect1d(candidates, postings, assume_unique=True)
+                if not len(candidates):
+                    break
+            if candidates is None:
+                candidates = np.arange(self.segment_count, dtype="<u4")
+            if start is not None:
+                candidates = candidates[self._column("end")[candidates] >= start]
+            if end is not None:
+                candidates = candidates[self._column("start")[candidates] <= end]
+            if kind is not None or source is not None:
+                allowed = [
+                    document["id"] for document in self.documents
+                    if (kind is None or document["kind"] == kind) and (source is None or document["source"] == source)
+                ]
+                candidates = candidates[np.isin(self._column("document")[candidates], allowed)]
+            matches = [self._match(int(segment)) for segment in candidates[:limit]]
+        if merge_gap is not None:
+            matches = merge_matches(matches, merge_gap)
+        observe_stage("archive_search", time.perf_counter() - started)
+        return matches
+
+    def _match(self, segment):
+        document = self.documents[int(self._column("document")[segment])]
+        start, end = float(self._column("start")[segment]), float(self._column("end")[segment])
+        text = self._text(segment)
+        return ArchiveMatch(
+            document["id"], document["source"], document["kind"],
+            None if np.isnan(start) else start, None if np.isnan(end) else end,
+            text, tuple(character_names(text)),
+        )
+
+
+def merge_matches(matches, gap):
+    """Joins matches of the same transcript that are less than gap seconds apart into one time range."""
+    merged = []
+    for match in matches:
+        previous = merged[-1] if merged else None
+        if (previous is not None and match.start is not None and previous.end is not None
+                and previous.document == match.document and match.start - previous.end <= gap):
+            merged[-1] = ArchiveMatch(
+                previous.document, previous.source, previous.kind, previous.start, max(previous.end, match.end),
+                previous.text + " " + match.text, tuple(dict.fromkeys(previous.characters + match.characters)),
+            )
+        else:
+            merged.append(match)
+    return merged
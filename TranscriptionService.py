@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+
+from Metrics import AUDIO_SECONDS, observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+def detect_whisper_device():
+    """Returns 'cuda' if CTranslate2 can see a GPU, otherwise 'cpu'."""
+    try:
+        import ctranslate2
+        return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    except Exception:
+        return "cpu"
+
+
+class TranscriptionService:
+    """
+    Long-lived wrapper around a faster-whisper WhisperModel.
+
+    The model is loaded once, on first use, and reused for every later transcription.
+    Device and compute type default to float16 on GPU and int8 on CPU.
+    """
+
+    def __init__(self, model_size="large-v3", device="auto", compute_type="auto", beam_size=5, num_workers=1):
+        """
+        Args:
+            model_size (str): Whisper model size or path.
+            device (str): 'auto', 'cpu' or 'cuda'.
+            compute_type (str): 'auto' or any CTranslate2 compute type (e.g. 'int8', 'float16').
+            beam_size (int): Default beam size for transcription.
+            num_workers (int): Number of transcriptions that may run concurrently on the model.
+        """
+        self.model_size = model_size
+        self.device = detect_whisper_device() if device == "auto" else device
+        if compute_type == "auto":
+            compute_type = "float16" if self.device == "cuda" else "int8"
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+        self.num_workers = num_workers
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """Loads the Whisper model if it isn't loaded yet and returns it."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Imported here so the backend can start without faster-whisper installed
+                    from faster_whisper import WhisperModel
+
+                    logger.info(
+                        f"Loading WhisperModel '{self.model_size}' on {self.device} ({self.compute_type})..."
+                    )
+                    self._model = WhisperModel(
+                        self.model_size,
+                        device=self.device,
+                        compute_type=self.compute_type,
+                        num_workers=self.num_workers,
+                    )
+        return self._model
+
+    def transcribe(self, audio, **kwargs):
+        """
+        Transcribe audio with the cached model.
+
+        Args:
+            audio: Path to an audio file, a binary file-like object, or a 16 kHz mono float32 NumPy array.
+            **kwargs: Extra options forwarded to WhisperModel.transcribe.
+
+        Returns:
+            tuple: A lazy generator of segments and the transcription info.
+        """
+        kwargs.setdefault("beam_size", self.beam_size)
+        started = time.perf_counter()
+        segments, info = self.load().transcribe(audio, **kwargs)
+        return self._timed(segments, started, info.duration), info
+
+    def _timed(self, segments, started, duration):
+        """Passes the segments through, recording the transcription span once they are all decoded."""
+        yield from segments
+        observe_stage("transcribe", time.perf_counter() - started)
+        AUDIO_SECONDS.inc(duration)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_transcription_service(model_size=None):
+    """Returns the shared TranscriptionService for a model size, creating it on first use."""
+    model_size = model_size or os.getenv("WHISPER_MODEL", "large-v3")
+    with _services_lock:
+        if model_size not in _services:
+            _services[model_size] = TranscriptionService(
+                model_size,
+                device=os.getenv("WHISPER_DEVICE", "auto"),
+                compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "auto"),
+            )
+        return _services[model_size]
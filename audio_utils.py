@@ -0,0 +1,167 @@
+import wave
+
+import numpy as np
+
+# Whisper expects 16 kHz mono float32 audio
+WHISPER_SAMPLE_RATE = 16000
+
+
+def pcm16_to_float_mono(data, channels):
+    """
+    Convert interleaved 16-bit PCM to mono float32 in [-1, 1].
+
+    Args:
+        data (bytes | np.ndarray): Interleaved int16 samples.
+        channels (int): Number of interleaved channels.
+
+    Returns:
+        np.ndarray: Mono float32 samples.
+    """
+    samples = np.frombuffer(data, dtype=np.int16) if isinstance(data, (bytes, bytearray, memoryview)) else data
+    samples = samples.reshape(-1, channels)
+    if channels == 1:
+        mono = samples[:, 0].astype(np.float32)
+    else:
+        mono = samples.mean(axis=1, dtype=np.float32)
+    mono *= 1.0 / 32768.0
+    return mono
+
+
+def resample(audio, orig_rate, target_rate=WHISPER_SAMPLE_RATE):
+    """
+    Resample mono audio with linear interpolation.
+
+    Args:
+        audio (np.ndarray): Mono float32 samples.
+        orig_rate (int): Sample rate of the input.
+        target_rate (int): Desired sample rate.
+
+    Returns:
+        np.ndarray: Resampled float32 samples.
+    """
+    if orig_rate == target_rate or len(audio) == 0:
+        return audio.astype(np.float32, copy=False)
+    target_length = int(round(len(audio) * target_rate / orig_rate))
+    positions = np.arange(target_length, dtype=np.float64) * (orig_rate / target_rate)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+class StreamResampler:
+    """
+    Resamples a stream of mono chunks as if they were one signal.
+
+    When downsampling, a windowed-sinc low-pass at the target Nyquist frequency runs first so
+    content above it doesn't alias into the speech band. The filter history and the position
+    of the next output sample carry over from one chunk to the next, so chunk boundaries
+    add no clicks and the output length doesn't drift.
+    """
+
+    def __init__(self, orig_rate, target_rate=WHISPER_SAMPLE_RATE, taps=63):
+        """
+        Args:
+            orig_rate (int): Sample rate of the input chunks.
+            target_rate (int): Desired sample rate.
+            taps (int): Length of the low-pass filter; longer is sharper and slower.
+        """
+        self.orig_rate = orig_rate
+        self.target_rate = target_rate
+        self.step = orig_rate / target_rate
+        self.kernel = None
+        if target_rate < orig_rate:
+            cutoff = 0.5 * target_rate / orig_rate
+            offsets = np.arange(taps) - (taps - 1) / 2
+            kernel = 2 * cutoff * np.sinc(2 * cutoff * offsets) * np.hamming(taps)
+            self.kernel = (kernel / kernel.sum()).astype(np.float32)
+            self.history = np.zeros(taps - 1, dtype=np.float32)
+        # Position of the next output sample, in input samples from the start of the next chunk
+        self.position = 0.0
+        self.last_sample = np.float32(0.0)
+
+    def process(self, audio):
+        """Resamples the next chunk of mono float32 samples."""
+        if self.orig_rate == self.target_rate or len(audio) == 0:
+            return audio.astype(np.float32, copy=False)
+        if self.kernel is not None:
+            padded = np.concatenate([self.history, audio])
+            self.history = padded[len(padded) - len(self.history):]
+            audio = np.convolve(padded, self.kernel, mode="valid")
+        # Index 0 of signal is the last sample of the previous chunk, at position -1
+        signal = np.concatenate([[self.last_sample], audio])
+        count = 0
+        if self.position <= len(audio) - 1:
+            count = int(np.floor((len(audio) - 1 - self.position) / self.step)) + 1
+        positions = self.position + np.arange(count) * self.step
+        self.position += count * self.step - len(audio)
+        self.last_sample = audio[-1]
+        return np.interp(positions + 1, np.arange(len(signal)), signal).astype(np.float32)
+
+
+def decode_audio_file(path):
+    """
+    Decode an audio file to 16 kHz mono float32.
+
+    16-bit WAV files are decoded with the standard library; anything else goes through
+    faster-whisper's decoder.
+    """
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as wf:
+            if wf.getsampwidth() == 2:
+                frames = wf.readframes(wf.getnframes())
+                return resample(pcm16_to_float_mono(frames, wf.getnchannels()), wf.getframerate())
+
+    from faster_whisper import decode_audio
+    return decode_audio(path, sampling_rate=WHISPER_SAMPLE_RATE)
+
+
+class AudioRingBuffer:
+    """
+    Preallocated ring buffer of interleaved int16 frames.
+
+    Writes copy straight into the buffer, overwriting the oldest audio once it is full,
+    so memory stays fixed no matter how long capture runs.
+    """
+
+    def __init__(self, capacity_frames, channels):
+        self.channels = channels
+        self.buffer = np.zeros((capacity_frames, channels), dtype=np.int16)
+        self.total_frames = 0
+
+    @property
+    def capacity(self):
+        return self.buffer.shape[0]
+
+    def __len__(self):
+        return min(self.total_frames, self.capacity)
+
+    def write(self, data):
+        """Appends interleaved int16 samples (bytes or array)."""
+        samples = np.frombuffer(data, dtype=np.int16) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        frames = samples.reshape(-1, self.channels)
+        if len(frames) >= self.capacity:
+            # Only the newest capacity frames survive; lay them out so frames() reads them in order.
+            self.total_frames += len(frames)
+            self.buffer[:] = np.roll(frames[-self.capacity:], self.total_frames % self.capacity, axis=0)
+            return
+
+        start = self.total_frames % self.capacity
+        end = start + len(frames)
+        if end <= self.capacity:
+            self.buffer[start:end] = frames
+        else:
+            split = self.capacity - start
+            self.buffer[start:] = frames[:split]
+            self.buffer[:end - self.capacity] = frames[split:]
+        self.total_frames += len(frames)
+
+    def frames(self):
+        """Returns the buffered frames in chronological order (a view when they don't wrap)."""
+        if self.total_frames <= self.capacity:
+            return self.buffer[:self.total_frames]
+        start = self.total_frames % self.capacity
+        if start == 0:
+            return self.buffer
+        return np.concatenate([self.buffer[start:], self.buffer[:start]])
+
+    def to_whisper_array(self, rate):
+        """Downmixes and resamples the buffered audio to 16 kHz mono float32."""
+        return resample(pcm16_to_float_mono(self.frames(), self.channels), rate)
@@ -1,15 +1,46 @@
-from fastapi import FastAPI, HTTPException, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModelForSeq2SeqLM
-import torch
+from typing import Optional
+from sse_starlette.sse import EventSourceResponse
+from starlette.background import BackgroundTask
+import dataclasses
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
 import logging
-from HuggingFaceAI import HuggingFaceAI
+from TranscriptionService import get_transcription_service
+import io
+from BatchScheduler import DROPPED_REQUESTS, INTERACTIVE, PRIORITIES, BatchScheduler, QueueFullError
+from InferenceWorkerPool import InferenceWorkerPool
+from ScriptChunker import stitch_chunks
+from ResponseCache import ResponseCache
+from Metrics import HTTP_REQUESTS, HTTP_SECONDS, SamplingProfiler, metrics
+from ProviderRouter import NoProviderAvailable, Provider, ProviderRouter
+from Readiness import Readiness
+from TranscriptArchive import TranscriptArchive, tokenize
+import ScreenplayFormatter
+import asyncio
+import contextvars
+import threading
+import time
+
+@asynccontextmanager
+async def lifespan(app):
+    """Loads the model in the background so the port binds right away, and drains the scheduler on shutdown."""
+    readiness.start(load_models)
+    yield
+    if scheduler is not None:
+        await scheduler.stop()
+    if transcript_archive is not None:
+        transcript_archive.close()
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for the FastAPI app
 app.add_middleware(
@@ -23,73 +54,591 @@ app.add_middleware(
 # Load environment variables
 load_dotenv()
 
+# Requests sent with an "X-Profile: 1" header are profiled when this is set
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Counts requests and their latency per route, and samples a profile when one is requested."""
+    profiler = None
+    if PROFILE_DIR and request.headers.get("x-profile") == "1":
+        profiler = SamplingProfiler().start()
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template rather than raw path to keep the number of series bounded
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_SECONDS.observe(time.perf_counter() - started, route=route)
+    HTTP_REQUESTS.inc(route=route, status=response.status_code)
+    if profiler is not None:
+        # Streaming responses are only profiled up to their first byte
+        profiler.stop()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_path = os.path.join(PROFILE_DIR, f"{route.strip('/').replace('/', '_')}-{time.time_ns()}.folded")
+        await run_in_threadpool(profiler.write, profile_path)
+        response.headers["X-Profile-File"] = profile_path
+    return response
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize HuggingFaceAI instance
-huggingface_ai = HuggingFaceAI()
-huggingface_ai.setup_pipeline()
+# Cache deterministic responses so repeated prompts and formats skip the model
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+    disk_path=os.getenv("RESPONSE_CACHE_PATH"),
+    max_disk_mb=float(os.getenv("RESPONSE_CACHE_DISK_MB", "256")),
+)
+
+# torch and transformers take seconds to import, so the model stack is imported, loaded and warmed
+# up by load_models() on a background thread. Until it is ready these stay None and the model
+# endpoints answer 503 with Retry-After.
+huggingface_ai = None
+scheduler = None
+inference_workers = int(os.getenv("INFERENCE_WORKERS", "0"))
+readiness = Readiness()
+if inference_workers > 0:
+    readiness.add_check("workers", lambda: scheduler.ready_workers > 0)
+
+def load_models():
+    """Startup steps run by Readiness: heavy imports, model load and warmup, then the scheduler."""
+    global huggingface_ai, scheduler
+    with readiness.step("import"):
+        from HuggingFaceAI import HuggingFaceAI
+        from ModelRegistry import model_registry
+
+    ai = HuggingFaceAI(response_cache=response_cache)
+    batch_queue_size = int(os.getenv("BATCH_QUEUE_SIZE")) if os.getenv("BATCH_QUEUE_SIZE") else None
+    if inference_workers > 0:
+        # Run generation in worker processes that share memory-mapped weights (the server process maps them too)
+        model_registry.mmap_weights = model_registry.device == "cpu"
+        pool = InferenceWorkerPool(
+            ai.model_name,
+            num_workers=inference_workers,
+            max_queue_size=int(os.getenv("INFERENCE_QUEUE_SIZE", "64")),
+            request_timeout=float(os.getenv("INFERENCE_TIMEOUT_S", "120")),
+            max_batch_size=int(os.getenv("BATCH_MAX_SIZE", "8")),
+            max_batch_queue_size=batch_queue_size,
+        )
+        # Workers load their copy of the model while this process loads its own
+        pool.start()
+    else:
+        # Batch concurrent generation requests so one slow generation doesn't block the event loop
+        pool = BatchScheduler(
+            ai,
+            max_batch_size=int(os.getenv("BATCH_MAX_SIZE", "8")),
+            max_wait_ms=float(os.getenv("BATCH_MAX_WAIT_MS", "20")),
+            max_queue_size=int(os.getenv("INFERENCE_QUEUE_SIZE", "64")),
+            max_batch_queue_size=batch_queue_size,
+        )
+
+    with readiness.step("load"):
+        if not ai.setup_pipeline(warmup=False):
+            raise RuntimeError(f"Failed to load '{ai.model_name}': {ai.setup_error}")
+    with readiness.step("warmup"):
+        ai.warmup()
+    huggingface_ai, scheduler = ai, pool
+
+def require_model():
+    """Rejects model requests with 503 and Retry-After until startup has finished."""
+    if not readiness.is_ready:
+        raise HTTPException(status_code=503, detail="Model is not ready", headers={"Retry-After": "5"})
+
+# Priority and deadline of the request being handled, read from its headers by apply_request_options().
+# A context variable so they reach scheduler.submit through the router and gathered tasks.
+request_options = contextvars.ContextVar("request_options", default={})
+REQUEST_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "120"))
+
+def apply_request_options(http_request):
+    """
+    Reads X-Priority (interactive or batch) and X-Request-Timeout (seconds) into request_options.
+
+    Editor requests are interactive by default; bulk jobs send "X-Priority: batch" so they queue
+    behind them and are the first to be turned away when the server is busy.
+    """
+    priority = http_request.headers.get("x-priority", INTERACTIVE).strip().lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"X-Priority must be one of {', '.join(PRIORITIES)}")
+    try:
+        timeout = float(http_request.headers.get("x-request-timeout", REQUEST_TIMEOUT_S))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+    request_options.set({"priority": priority, "deadline": time.monotonic() + max(0.0, timeout)})
+
+async def until_disconnected(http_request, awaitable, poll_interval=0.25):
+    """
+    Awaits a handler's work, cancelling it if the client disconnects first.
+
+    Cancellation reaches the scheduler, which drops the request from its queue or stops its
+    row at the next decode step, so abandoned requests don't hold a batch slot.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info("Client disconnected, cancelling its request")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+def overloaded(error):
+    """429 when the local queue turned the request away, 503 when no provider can take it at all."""
+    status_code = 503 if isinstance(error, NoProviderAvailable) else 429
+    return HTTPException(status_code=status_code, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+async def format_locally(script, return_full_text=False):
+    """Formats a script with the local model, splitting it into chunks when it overflows the context window."""
+    chunks, max_new_tokens = await run_in_threadpool(huggingface_ai.plan_script_chunks, script)
+    if len(chunks) > 1:
+        logger.info(f"Formatting script in {len(chunks)} chunks")
+        outputs = await asyncio.gather(
+            *(scheduler.submit(chunk, max_new_tokens, return_full_text=False, task="format", **request_options.get())
+              for chunk in chunks)
+        )
+        return None if None in outputs else stitch_chunks(outputs)
+    # No explicit budget: it is sized to the script and capped by the remaining context
+    return await scheduler.submit(script, None, return_full_text, task="format", **request_options.get())
+
+# Scene headings, transitions and "NAME: line" turns are formatted by rules; only the spans the
+# rules can't classify (e.g. run-on prose) go to the model
+RULE_BASED_FORMATTING = os.getenv("RULE_BASED_FORMATTING", "1") == "1"
+
+async def format_span(span):
+    """
+    Formats one ambiguous span with the model, through the response cache and the router when one is
+    configured. Returns (provider, text).
+    """
+    cache_key = huggingface_ai.format_cache_key(span, return_full_text=False)
+    cached = huggingface_ai.cached_response(cache_key)
+    if cached is not None:
+        return "local", cached
+    if router is not None:
+        provider, formatted = await router.run("format", span)
+    else:
+        provider, formatted = "local", await format_locally(span, return_full_text=False)
+    if provider == "local":
+        huggingface_ai.store_response(cache_key, formatted)
+    return provider, formatted
+
+async def format_with_rules(script):
+    """
+    Formats a script with ScreenplayFormatter, resolving its ambiguous spans with the model concurrently.
+
+    Returns:
+        tuple: ("local" unless a span was formatted by another provider, formatted script).
+    """
+    elements = ScreenplayFormatter.parse(script)
+    ScreenplayFormatter.record_spans(elements)
+    spans = ScreenplayFormatter.ambiguous_spans(elements)
+    if spans:
+        logger.info(f"Formatting {len(spans)} of {len(elements)} script elements with the model")
+    results = await asyncio.gather(*(format_span(text) for _, text in spans))
+    providers = {provider for provider, _ in results if provider != "local"}
+    resolved = {index: output for (index, _), (_, output) in zip(spans, results)}
+    return min(providers, default="local"), ScreenplayFormatter.render(elements, resolved)
+
+# With a remote formatter configured, format requests are routed between the local model and the
+# hosted one: the cheaper local model goes first and slow requests are hedged to the remote provider.
+router = None
+remote_formatter_model = os.getenv("REMOTE_FORMATTER_MODEL")
+if remote_formatter_model:
+    from LLM import AsyncLLMService
+
+    remote_llm = AsyncLLMService(
+        model=remote_formatter_model,
+        max_concurrency=int(os.getenv("REMOTE_MAX_CONCURRENCY", "8")),
+        timeout=float(os.getenv("INFERENCE_TIMEOUT_S", "120")),
+    )
+
+    async def format_remotely(script):
+        """Formats a script with the hosted model using the same prompt template."""
+        return await remote_llm.generate_content(
+            huggingface_ai.load_prompt(script), max_output_tokens=2048, temperature=0.0
+        )
+
+    router = ProviderRouter(
+        [
+            Provider(
+                "local",
+                {"format": format_locally},
+                max_concurrency=int(os.getenv("LOCAL_MAX_CONCURRENCY", "16")),
+                cost_weight=float(os.getenv("LOCAL_COST_WEIGHT", "1")),
+                health_check=lambda: readiness.is_ready,
+            ),
+            Provider(
+                "remote",
+                {"format": format_remotely},
+                max_concurrency=int(os.getenv("REMOTE_MAX_CONCURRENCY", "8")),
+                cost_weight=float(os.getenv("REMOTE_COST_WEIGHT", "5")),
+            ),
+        ],
+        hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+        default_hedge_delay=float(os.getenv("HEDGE_DEFAULT_DELAY_S", "10")),
+    )
 
 # Define request model for text generation
 class GenerateRequest(BaseModel):
     prompt: str
 
 @app.post("/generate")
-async def generate(request: GenerateRequest):
+async def generate(request: GenerateRequest, http_request: Request):
     """Endpoint to generate text using the Hugging Face model."""
     try:
         prompt = request.prompt
         if not prompt:
             raise HTTPException(status_code=400, detail="Prompt is required")
+        require_model()
+        apply_request_options(http_request)
+
+        logger.info(f"Received prompt ({len(prompt)} chars)")
+        logger.debug("Prompt: %s", prompt)
 
-        logger.info(f"Received prompt: {prompt}")
+        cache_key = huggingface_ai.cache_key(prompt, max_new_tokens=None, return_full_text=False)
+        cached = huggingface_ai.cached_response(cache_key)
+        if cached is not None:
+            return {"response": cached}
 
-        # Use HuggingFaceAI to generate text
-        response = huggingface_ai.generate_text(prompt)
+        # Queue the prompt with the batching scheduler
+        response = await until_disconnected(http_request, scheduler.submit(prompt, **request_options.get()))
         if response is None:
             raise HTTPException(status_code=500, detail="Failed to generate text")
+        huggingface_ai.store_response(cache_key, response)
 
-        logger.info(f"Generated response: {response}")
+        logger.debug("Generated response: %s", response)
         return {"response": response}
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Generation timed out")
     except Exception as e:
         logger.error(f"Error during generation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/format_script")
-async def format_script_endpoint(request: GenerateRequest):
+async def format_script_endpoint(request: GenerateRequest, http_request: Request):
     """Endpoint to format a script using the Hugging Face model."""
     try:
         script = request.prompt
         if not script:
             raise HTTPException(status_code=400, detail="Script is required")
+        require_model()
+        apply_request_options(http_request)
 
-        logger.info(f"Received script for formatting: {script}")
+        logger.info(f"Received script for formatting ({len(script)} chars)")
+        logger.debug("Script: %s", script)
 
-        # Use HuggingFaceAI to format the script
-        formatted_script = huggingface_ai.format_script(script)
+        if RULE_BASED_FORMATTING:
+            cache_key = huggingface_ai.format_cache_key(script, rule_based=True)
+        else:
+            cache_key = huggingface_ai.format_cache_key(script)
+        cached = huggingface_ai.cached_response(cache_key)
+        if cached is not None:
+            return {"formatted_script": cached}
+
+        if RULE_BASED_FORMATTING:
+            provider, formatted_script = await until_disconnected(http_request, format_with_rules(script))
+        elif router is not None:
+            provider, formatted_script = await until_disconnected(http_request, router.run("format", script))
+        else:
+            provider, formatted_script = "local", await until_disconnected(http_request, format_locally(script))
         if formatted_script is None:
             raise HTTPException(status_code=500, detail="Failed to format script")
+        # The cache is keyed on the local model, so only its outputs are stored
+        if provider == "local":
+            huggingface_ai.store_response(cache_key, formatted_script)
 
-        logger.info(f"Formatted script: {formatted_script}")
+        logger.debug("Formatted script: %s", formatted_script)
         return {"formatted_script": formatted_script}
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Formatting timed out")
     except Exception as e:
         logger.error(f"Error during script formatting: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint to verify Hugging Face model and tokenizer."""
+INCREMENTAL_SCENES = metrics.counter(
+    "incremental_format_scenes_total", "Scenes of incremental format requests, reused from cache or formatted.",
+    ("result",),
+)
+
+async def format_scene(scene):
+    """Formats one scene, reusing the cached output when the scene is unchanged. Returns (text, reused)."""
+    scene = scene.strip()
+    cache_key = huggingface_ai.cache_key(
+        scene, template_version=huggingface_ai.template_version(), task="format_scene",
+        rule_based=RULE_BASED_FORMATTING,
+    )
+    cached = huggingface_ai.cached_response(cache_key)
+    if cached is not None:
+        return cached, True
+    if RULE_BASED_FORMATTING:
+        provider, formatted = await format_with_rules(scene)
+    else:
+        provider, formatted = "local", await format_locally(scene)
+    # The cache is keyed on the local model, so only its outputs are stored
+    if provider == "local":
+        huggingface_ai.store_response(cache_key, formatted)
+    return formatted, False
+
+@app.post("/format_script_incremental")
+async def format_script_incremental(request: GenerateRequest, http_request: Request):
+    """
+    Endpoint to format an edited document scene by scene.
+
+    The document is split at scene headings (or into paragraphs when it has none) and each
+    scene is cached by content, so after a small edit only the changed scenes reach the
+    model. Scenes are returned with their hashes, in document order.
+    """
+    try:
+        script = request.prompt
+        if not script:
+            raise HTTPException(status_code=400, detail="Script is required")
+        require_model()
+        apply_request_options(http_request)
+
+        scenes = ScreenplayFormatter.split_scenes(script)
+        results = await until_disconnected(http_request, asyncio.gather(*(format_scene(scene) for scene in scenes)))
+        if any(formatted is None for formatted, _ in results):
+            raise HTTPException(status_code=500, detail="Failed to format script")
+        reused = sum(was_cached for _, was_cached in results)
+        INCREMENTAL_SCENES.inc(reused, result="reused")
+        INCREMENTAL_SCENES.inc(len(scenes) - reused, result="formatted")
+        logger.info(f"Formatted {len(scenes) - reused} of {len(scenes)} scenes ({reused} unchanged)")
+        return {
+            "formatted_script": "\n\n".join(formatted.strip() for formatted, _ in results) + "\n",
+            "scenes": [
+                {"hash": hashlib.sha256(scene.strip().encode("utf-8")).hexdigest()[:16], "reused": was_cached}
+                for scene, (_, was_cached) in zip(scenes, results)
+            ],
+            "reformatted": len(scenes) - reused,
+        }
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Formatting timed out")
+    except Exception as e:
+        logger.error(f"Error during incremental formatting: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/screenplay_elements")
+async def screenplay_elements(request: GenerateRequest):
+    """Parses a script into screenplay elements with the rule-based formatter, without calling the model."""
+    elements = ScreenplayFormatter.parse(request.prompt)
+    return {"elements": [{"kind": element.kind, "text": element.text} for element in elements]}
+
+async def sse_events(chunks):
+    """Wraps generated text chunks as Server-Sent Events, ending with a 'done' event."""
+    try:
+        async for chunk in chunks:
+            yield {"event": "token", "data": json.dumps({"text": chunk})}
+        yield {"event": "done", "data": "{}"}
+    except asyncio.TimeoutError:
+        yield {"event": "error", "data": json.dumps({"detail": "Generation timed out"})}
+    except Exception as e:
+        logger.error(f"Error during streaming: {e}")
+        yield {"event": "error", "data": json.dumps({"detail": str(e)})}
+    finally:
+        # Closes the scheduler's stream, cancelling the request if the client went away
+        await chunks.aclose()
+
+# A stream holds the scheduler's inference thread (or a worker) for its whole length, so on top of
+# queue admission the number of streams is bounded; batch-priority streams may only use half of the slots
+STREAM_MAX_CONCURRENCY = int(os.getenv("STREAM_MAX_CONCURRENCY", "4"))
+STREAM_RETRY_AFTER_S = int(os.getenv("STREAM_RETRY_AFTER_S", "5"))
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONCURRENCY)
+batch_stream_slots = threading.BoundedSemaphore(max(1, STREAM_MAX_CONCURRENCY // 2))
+
+def open_stream(prompt, task):
+    """
+    Queues a streaming request with the scheduler, returning (text chunks, task releasing its slot).
+
+    Raises:
+        HTTPException: 429 with Retry-After when no stream slot is free or the queue is full.
+    """
+    release = acquire_stream_slot()
+    try:
+        chunks = scheduler.stream(prompt, task, **request_options.get())
+    except QueueFullError as e:
+        release()
+        raise overloaded(e)
+    # Runs once the response has finished or the client has gone
+    return chunks, BackgroundTask(release)
+
+def acquire_stream_slot():
+    """
+    Takes a streaming slot for the current request without waiting.
+
+    Returns:
+        callable: Releases the slot.
+
+    Raises:
+        HTTPException: 429 with Retry-After when no slot is free for the request's priority.
+    """
+    priority = request_options.get()["priority"]
+    slots = ([] if priority == INTERACTIVE else [batch_stream_slots]) + [stream_slots]
+    taken = []
+    for slot in slots:
+        if not slot.acquire(blocking=False):
+            for held in taken:
+                held.release()
+            DROPPED_REQUESTS.inc(priority=priority, reason="queue_full")
+            raise overloaded(QueueFullError(f"Too many streams for {priority} requests", STREAM_RETRY_AFTER_S))
+        taken.append(slot)
+
+    def release():
+        for held in taken:
+            held.release()
+
+    return release
+
+@app.post("/generate_stream")
+async def generate_stream(request: GenerateRequest, http_request: Request):
+    """Endpoint to stream generated text token by token as Server-Sent Events."""
+    if not request.prompt:
+        raise HTTPException(status_code=400, detail="Prompt is required")
+    require_model()
+    apply_request_options(http_request)
+
+    logger.info(f"Received prompt for streaming ({len(request.prompt)} chars)")
+    chunks, release = open_stream(request.prompt, "generate")
+    return EventSourceResponse(sse_events(chunks), background=release)
+
+@app.post("/format_script_stream")
+async def format_script_stream(request: GenerateRequest, http_request: Request):
+    """Endpoint to stream a formatted script as Server-Sent Events."""
+    if not request.prompt:
+        raise HTTPException(status_code=400, detail="Script is required")
+    require_model()
+    apply_request_options(http_request)
+
+    logger.info(f"Received script for streaming format ({len(request.prompt)} chars)")
+    chunks, release = open_stream(request.prompt, "format")
+    return EventSourceResponse(sse_events(chunks), background=release)
+
+# Uploaded transcripts are archived with their timestamps when this is set, see /archive/search
+transcript_archive = TranscriptArchive(os.getenv("TRANSCRIPT_ARCHIVE_PATH")) if os.getenv("TRANSCRIPT_ARCHIVE_PATH") else None
+
+def transcribe_upload(audio_bytes, source=None):
+    """Transcribes uploaded audio bytes and materializes the segments."""
+    segments, info = get_transcription_service().transcribe(io.BytesIO(audio_bytes))
+    segments = [{"start": segment.start, "end": segment.end, "text": segment.text} for segment in segments]
+    result = {
+        "language": info.language,
+        "language_probability": info.language_probability,
+        "text": " ".join(segment["text"].strip() for segment in segments),
+        "segments": segments,
+    }
+    if transcript_archive is not None:
+        result["archive_id"] = transcript_archive.add_transcript(
+            segments, source=source, metadata={"language": info.language}
+        )
+    return result
+
+@app.post("/transcribe")
+async def transcribe_endpoint(file: UploadFile = File(...)):
+    """Endpoint to transcribe an uploaded audio file with the cached Whisper model."""
     try:
-        # test_prompt = "Hello, world!"
-        # response = huggingface_ai.generate_text(test_prompt)
-        # if response is None:
-        #     raise HTTPException(status_code=500, detail="Health check failed")
+        audio_bytes = await file.read()
+        if not audio_bytes:
+            raise HTTPException(status_code=400, detail="Audio file is empty")
 
-        return {"status": "healthy", "test_response": "Health check Succeeded"}
+        logger.info(f"Received audio for transcription: {file.filename} ({len(audio_bytes)} bytes)")
+        return await run_in_threadpool(transcribe_upload, audio_bytes, file.filename)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return {"status": "unhealthy", "error": str(e)}
+        logger.error(f"Error during transcription: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def require_archive():
+    if transcript_archive is None:
+        raise HTTPException(status_code=404, detail="Transcript archive is disabled (set TRANSCRIPT_ARCHIVE_PATH)")
+
+class ArchiveScriptRequest(BaseModel):
+    script: str
+    source: Optional[str] = None
+
+@app.post("/archive/scripts")
+async def archive_script(request: ArchiveScriptRequest):
+    """Endpoint to add a formatted script to the transcript archive."""
+    require_archive()
+    if not request.script:
+        raise HTTPException(status_code=400, detail="Script is required")
+    return {"archive_id": await run_in_threadpool(transcript_archive.add_script, request.script, request.source)}
+
+@app.get("/archive/search")
+async def archive_search(q: str = "", character: Optional[str] = None, start: Optional[float] = None,
+                         end: Optional[float] = None, kind: Optional[str] = None, source: Optional[str] = None,
+                         limit: int = 100, merge_gap: Optional[float] = None):
+    """Endpoint to search archived transcripts and scripts, returning the matching audio time ranges."""
+    require_archive()
+    if not q and not character:
+        raise HTTPException(status_code=400, detail="A query (q) or character is required")
+    if q.strip() and not tokenize(q):
+        raise HTTPException(status_code=400, detail="The query (q) has no searchable words")
+    # Scoring a large archive takes a while, and search waits on the archive lock while an add or flush holds it
+    matches = await run_in_threadpool(
+        transcript_archive.search, q, character, start, end, kind, source, limit, merge_gap
+    )
+    return {"matches": [dataclasses.asdict(match) for match in matches]}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters and sizes of the response cache."""
+    return response_cache.stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Stage timings, token counts and request counters in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/providers")
+async def list_providers():
+    """Health, load and recent latency of the format providers when routing is enabled."""
+    return {"routing": router is not None, "providers": router.describe() if router is not None else []}
+
+@app.get("/models")
+async def list_models():
+    """Lists the models currently held by the model registry."""
+    if huggingface_ai is None:
+        return {"models": []}
+    return {"models": huggingface_ai.registry.loaded_models()}
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the server process is up and serving, whether or not the model has loaded."""
+    return {"status": "alive", "uptime_seconds": readiness.uptime()}
+
+@app.get("/health/ready")
+async def readiness_probe():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 with the startup state until then."""
+    state = readiness.describe()
+    if huggingface_ai is not None:
+        state["models"] = huggingface_ai.registry.loaded_models()
+    if inference_workers > 0 and scheduler is not None:
+        state["ready_workers"] = scheduler.ready_workers
+    if readiness.is_ready:
+        return state
+    return JSONResponse(state, status_code=503, headers={"Retry-After": "5"})
+
+@app.get("/health")
+async def health_check():
+    """Readiness with the status reported as healthy/unhealthy, for older clients."""
+    state = readiness.describe()
+    if readiness.is_ready:
+        return {**state, "status": "healthy"}
+    return JSONResponse({**state, "status": "unhealthy"}, status_code=503, headers={"Retry-After": "5"})
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,94 @@
+"""
+Batch mode for record_and_transcribe.py: turns a directory (or list) of recordings into
+transcripts and formatted scripts.
+
+Decoding runs in a process pool, Whisper in a dedicated worker and formatting in batches, with
+bounded queues between them so all three overlap. Progress goes to a JSON-lines manifest; run
+the same command again after a crash and it continues where it stopped.
+
+Examples:
+    python batch_transcribe.py recordings/ --output-dir scripts/
+    python batch_transcribe.py nightly_files.txt --output-dir scripts/ --formatter model --format-batch-size 16
+    python batch_transcribe.py recordings/ --output-dir transcripts/ --formatter none
+"""
+import argparse
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from BatchPipeline import BatchPipeline, Manifest, find_audio_files
+from Metrics import metrics
+
+
+def make_transcriber(model_size):
+    """`(audio) -> text` using the shared TranscriptionService."""
+    from TranscriptionService import get_transcription_service
+
+    service = get_transcription_service(model_size)
+
+    def transcribe(audio):
+        segments, _ = service.transcribe(audio)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+    return transcribe
+
+
+def make_formatter(kind, batch_size):
+    """`(transcripts) -> scripts` for the chosen formatter, or None to stop after transcription."""
+    if kind == "none":
+        return None
+    from HuggingFaceAI import HuggingFaceAI
+
+    ai = HuggingFaceAI()
+    ai.setup_pipeline()
+    if kind == "rules":
+        return lambda transcripts: ai.format_screenplays(transcripts, batch_size)
+    return lambda transcripts: ai.format_scripts(transcripts, batch_size)
+
+
+def main():
+    # Before the parser, whose defaults read the environment (e.g. RULE_BASED_FORMATTING)
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Transcribe and format a batch of recordings.")
+    parser.add_argument("source", help="Directory of audio files, or a text file listing one path per line")
+    parser.add_argument("--output-dir", default="./batch_output")
+    parser.add_argument("--manifest", help="Progress manifest (default: OUTPUT_DIR/manifest.jsonl)")
+    parser.add_argument("--whisper-model", default=None, help="Defaults to WHISPER_MODEL")
+    parser.add_argument("--formatter", choices=("rules", "model", "none"),
+                        default="rules" if os.getenv("RULE_BASED_FORMATTING", "1") == "1" else "model",
+                        help="rules: ScreenplayFormatter with the model for ambiguous spans; "
+                             "model: the whole transcript through the model; none: transcripts only")
+    parser.add_argument("--decode-workers", type=int, default=None, help="Default: CPU count - 1")
+    parser.add_argument("--queue-size", type=int, default=4, help="Capacity of each queue between stages")
+    parser.add_argument("--format-batch-size", type=int, default=8)
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Stop retrying a file on later runs after it failed this many times")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    paths = find_audio_files(args.source)
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = Manifest(args.manifest or os.path.join(args.output_dir, "manifest.jsonl"))
+    manifest.compact()
+
+    pipeline = BatchPipeline(
+        manifest,
+        args.output_dir,
+        make_transcriber(args.whisper_model),
+        make_formatter(args.formatter, args.format_batch_size),
+        root=args.source if os.path.isdir(args.source) else None,
+        decode_workers=args.decode_workers,
+        queue_size=args.queue_size,
+        format_batch_size=args.format_batch_size,
+        max_attempts=args.max_attempts,
+    )
+    print(json.dumps(pipeline.run(paths), indent=2))
+    if os.getenv("PRINT_METRICS") == "1":
+        print(metrics.render())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Latency and throughput benchmark for the inference backend.
+
+Drives /generate and /format_script (and their streaming variants for time-to-first-token)
+with configurable concurrency and prompt lengths, then reports latency percentiles,
+tokens/sec, TTFT and peak RSS as JSON. Results can be compared against a stored baseline.
+
+Examples:
+    # In-process, against backend.py's app (served on a local port) with a tiny model
+    python benchmark.py --model sshleifer/tiny-gpt2 --requests 64 --concurrency 8
+
+    # Against a running server
+    python benchmark.py --url http://localhost:8080 --endpoints format_script
+
+    # Save a baseline, then compare a later run against it
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json --tolerance 0.1
+
+    # Speculative decoding against plain decoding (assisted generation runs one sequence at a time)
+    python benchmark.py --concurrency 1 --save-baseline plain.json
+    python benchmark.py --concurrency 1 --speculative draft --draft-model distilgpt2 --baseline plain.json
+
+    # Compiled graphs or ONNX Runtime against eager PyTorch
+    python benchmark.py --save-baseline eager.json
+    python benchmark.py --backend onnx --baseline eager.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+import httpx
+
+import test_inputs
+
+RESPONSE_FIELDS = {"generate": "response", "format_script": "formatted_script"}
+# Metrics where a higher value is a regression; the rest (throughput) regress when they drop
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "ttft_p50_ms", "ttft_p95_ms", "peak_rss_mb")
+
+
+# ########## Workload ##########
+def load_corpus():
+    """Seed corpus: the run-on script sample plus the examples in test_inputs.py."""
+    corpus = [test_inputs.run_on_script_text]
+    with open("run_on_script_text.txt", "r") as text_file:
+        corpus.append(text_file.read())
+    corpus.append("John: Hey, how are you? Mary: I'm good, thanks! John: Let's go to the park.")
+    return corpus
+
+
+def make_prompts(corpus, count, word_lengths, seed, unique=True):
+    """
+    Build prompts whose word counts are drawn uniformly from word_lengths.
+
+    Corpus words are repeated as needed to reach the target length. With unique=True every
+    prompt gets a distinct suffix so the response cache doesn't turn the run into cache hits.
+    """
+    rng = random.Random(seed)
+    words = " ".join(corpus).split()
+    prompts = []
+    for index in range(count):
+        length = rng.choice(word_lengths)
+        start = rng.randrange(len(words))
+        chosen = [words[(start + offset) % len(words)] for offset in range(length)]
+        prompt = " ".join(chosen)
+        if unique:
+            prompt += f" (take {index})"
+        prompts.append(prompt)
+    return prompts
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# ########## Drivers ##########
+async def run_requests(client, endpoint, prompts, concurrency, count_tokens):
+    """Posts every prompt with at most `concurrency` in flight; returns per-request records."""
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+
+    async def one(prompt):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/{endpoint}", json={"prompt": prompt})
+                elapsed = time.perf_counter() - started
+                ok = response.status_code == 200
+                text = response.json().get(RESPONSE_FIELDS[endpoint], "") if ok else ""
+                records.append({"ok": ok, "status": response.status_code, "seconds": elapsed,
+                                "tokens": count_tokens(text or "")})
+            except httpx.HTTPError as e:
+                records.append({"ok": False, "status": type(e).__name__,
+                                "seconds": time.perf_counter() - started, "tokens": 0})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(prompt) for prompt in prompts))
+    return records, time.perf_counter() - started
+
+
+async def wait_until_ready(client, timeout):
+    """Polls /health/ready until the model has loaded; returns the server's startup report."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            response = await client.get("/health/ready")
+            if response.status_code == 200:
+                return response.json()
+            if response.json().get("status") == "failed":
+                raise RuntimeError(f"Server failed to start: {response.json().get('error')}")
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Server not ready after {timeout:.0f}s")
+        await asyncio.sleep(0.5)
+
+
+async def measure_ttft(client, endpoint, prompts):
+    """Time from sending a request to the first token event of the streaming variant."""
+    ttfts = []
+    for prompt in prompts:
+        started = time.perf_counter()
+        try:
+            async with client.stream("POST", f"/{endpoint}_stream", json={"prompt": prompt}) as response:
+                if response.status_code != 200:
+                    continue
+                async for line in response.aiter_lines():
+                    if line.startswith("event: token"):
+                        ttfts.append(time.perf_counter() - started)
+                        break
+        except httpx.HTTPError:
+            continue
+    return ttfts
+
+
+def summarize(records, wall_seconds, ttfts):
+    latencies = [record["seconds"] for record in records if record["ok"]]
+    tokens = sum(record["tokens"] for record in records if record["ok"])
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "requests": len(records),
+        "errors": sum(not record["ok"] for record in records),
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "requests_per_sec": round(len(latencies) / wall_seconds, 3) if wall_seconds else None,
+        "tokens_per_sec": round(tokens / wall_seconds, 2) if wall_seconds else None,
+        "ttft_p50_ms": ms(percentile(ttfts, 0.50)),
+        "ttft_p95_ms": ms(percentile(ttfts, 0.95)),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (the server too, when running in-process)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+# ########## Baseline comparison ##########
+def compare_to_baseline(results, baseline, tolerance):
+    """Returns a list of regressions larger than tolerance (a fraction, e.g. 0.1 for 10%)."""
+    regressions = []
+    for endpoint, metrics in results["endpoints"].items():
+        for name, value in metrics.items():
+            previous = baseline.get("endpoints", {}).get(endpoint, {}).get(name)
+            if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+                continue
+            if name in ("requests", "errors"):
+                continue
+            change = (value - previous) / previous
+            worse = change > tolerance if name in LOWER_IS_BETTER else change < -tolerance
+            if worse:
+                regressions.append({"endpoint": endpoint, "metric": name, "baseline": previous,
+                                    "current": value, "change": round(change, 4)})
+    current_rss, previous_rss = results.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if current_rss and previous_rss and (current_rss - previous_rss) / previous_rss > tolerance:
+        regressions.append({"endpoint": None, "metric": "peak_rss_mb", "baseline": previous_rss,
+                            "current": current_rss, "change": round((current_rss - previous_rss) / previous_rss, 4)})
+    return regressions
+
+
+@contextlib.asynccontextmanager
+async def serve_locally(app):
+    """
+    Runs app under uvicorn on an ephemeral localhost port and yields its base URL.
+
+    httpx's in-memory ASGI transport only hands over a response body once it is complete, so
+    streamed tokens would all arrive at the end and TTFT would just repeat the full latency.
+    """
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            # Startup failed; surface uvicorn's error
+            await task
+            raise RuntimeError("Benchmark server exited during startup")
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+# ########## Main ##########
+async def benchmark(args):
+    corpus = load_corpus()
+    word_lengths = [int(length) for length in args.prompt_words.split(",")]
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        server = None
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(args.model)
+        except Exception:
+            tokenizer = None
+    else:
+        # Pick the model before backend.py is imported; it reads its configuration at import time
+        os.environ["FORMATTER_MODEL"] = args.model
+        os.environ["SPECULATIVE_MODE"] = args.speculative
+        os.environ["SPECULATIVE_DRAFT_MODEL"] = args.draft_model
+        os.environ["INFERENCE_BACKEND"] = args.backend
+        import backend
+        # A real server in this process (uvicorn runs the app's lifespan), so streamed events arrive as sent
+        server = serve_locally(backend.app)
+        client = httpx.AsyncClient(base_url=await server.__aenter__(), timeout=args.timeout)
+
+    startup = await wait_until_ready(client, args.timeout)
+    if not args.url:
+        tokenizer = backend.huggingface_ai.tokenizer
+
+    def count_tokens(text):
+        if tokenizer is not None:
+            return len(tokenizer.encode(text))
+        return len(text.split())
+
+    results = {
+        "config": {
+            "model": args.model,
+            "target": args.url or "in-process",
+            "speculative": args.speculative if not args.url else None,
+            "backend": args.backend if not args.url else None,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "prompt_words": word_lengths,
+            "seed": args.seed,
+        },
+        "startup_step_seconds": startup.get("step_seconds"),
+        "endpoints": {},
+    }
+    try:
+        for endpoint in args.endpoints.split(","):
+            prompts = make_prompts(corpus, args.requests, word_lengths, args.seed, unique=not args.allow_cache_hits)
+            await run_requests(client, endpoint, prompts[:args.warmup], args.concurrency, count_tokens)
+            records, wall_seconds = await run_requests(client, endpoint, prompts, args.concurrency, count_tokens)
+            ttft_prompts = make_prompts(corpus, args.ttft_requests, word_lengths, args.seed + 1,
+                                        unique=not args.allow_cache_hits)
+            ttfts = await measure_ttft(client, endpoint, ttft_prompts) if args.ttft_requests else []
+            results["endpoints"][endpoint] = summarize(records, wall_seconds, ttfts)
+    finally:
+        await client.aclose()
+        if server is not None:
+            await server.__aexit__(None, None, None)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /generate and /format_script endpoints.")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--model", default=os.getenv("FORMATTER_MODEL", "gpt2"),
+                        help="Model for the in-process app (e.g. sshleifer/tiny-gpt2 for a quick run)")
+    parser.add_argument("--endpoints", default="generate,format_script")
+    parser.add_argument("--speculative", choices=("off", "draft", "prompt_lookup"),
+                        default=os.getenv("SPECULATIVE_MODE", "off"), help="Decoding mode of the in-process app")
+    parser.add_argument("--draft-model", default=os.getenv("SPECULATIVE_DRAFT_MODEL", "distilgpt2"))
+    parser.add_argument("--backend", choices=("eager", "compile", "onnx"),
+                        default=os.getenv("INFERENCE_BACKEND", "eager"), help="Inference backend of the in-process app")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--prompt-words", default="16,64,256",
+                        help="Comma-separated prompt lengths in words, sampled uniformly")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests sent first")
+    parser.add_argument("--ttft-requests", type=int, default=4, help="Sequential streaming requests for TTFT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--allow-cache-hits", action="store_true", help="Don't make prompts unique")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--save-baseline", help="Store the results as a baseline")
+    parser.add_argument("--baseline", help="Compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed regression as a fraction")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        results["regressions"] = regressions
+        exit_code = 1 if regressions else 0
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Quality and speed check of a reduced-precision or compiled model against its fp32 eager weights.
+
+Generates greedily from the same prompts with both models and reports:
+  - exact_match: share of prompts whose continuation is identical,
+  - top1_agreement: share of positions where both models pick the same next token when fed the
+    fp32 continuation (so one early divergence doesn't hide everything after it),
+  - mean_kl: mean KL divergence of the candidate's next-token distribution from fp32's,
+  - weight memory and decode tokens/sec of each model.
+
+Examples:
+    MODEL_DEVICE=cpu python precision_check.py --model gpt2 --precision int8 --min-top1-agreement 0.9
+    # ONNX Runtime (or torch.compile) against eager PyTorch, same weights
+    python precision_check.py --model gpt2 --precision fp32 --backend onnx
+"""
+import argparse
+import json
+import sys
+import time
+
+import torch
+
+import test_inputs
+from ModelRegistry import ModelRegistry
+
+
+def default_prompts():
+    with open("run_on_script_text.txt", "r") as text_file:
+        sample = text_file.read()
+    return [
+        test_inputs.run_on_script_text[:600],
+        sample[:600],
+        "John: Hey, how are you? Mary: I'm good, thanks! John: Let's go to the park.",
+        "INT. COFFEE SHOP - DAY\n\nMARY sits alone, reading.",
+    ]
+
+
+def timed_generate(loaded, inputs, max_new_tokens):
+    started = time.perf_counter()
+    with torch.no_grad():
+        outputs = loaded.model.generate(
+            **inputs, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=loaded.tokenizer.pad_token_id
+        )
+    return outputs, time.perf_counter() - started
+
+
+def next_token_logprobs(loaded, sequence, prompt_length):
+    """Log-probabilities each model assigns at every generated position of sequence."""
+    with torch.no_grad():
+        logits = loaded.model(sequence).logits[0, prompt_length - 1:-1].float()
+    return torch.log_softmax(logits, dim=-1)
+
+
+def compare(model_name, precision, prompts, max_new_tokens, backend="eager"):
+    reference = ModelRegistry(device="cpu").get(model_name, precision="fp32", warmup=True)
+    candidate = ModelRegistry(device="cpu", backend=backend).get(model_name, precision=precision, warmup=True)
+    label = precision if backend == "eager" else f"{precision}-{backend}"
+    if label == "fp32":
+        label = "fp32-candidate"
+
+    exact, agreements, kls = 0, [], []
+    seconds = {"fp32": 0.0, label: 0.0}
+    tokens = {"fp32": 0, label: 0}
+    for prompt in prompts:
+        inputs = reference.tokenizer(prompt, return_tensors="pt")
+        prompt_length = inputs["input_ids"].shape[1]
+        reference_ids, reference_seconds = timed_generate(reference, inputs, max_new_tokens)
+        candidate_ids, candidate_seconds = timed_generate(candidate, inputs, max_new_tokens)
+        seconds["fp32"] += reference_seconds
+        seconds[label] += candidate_seconds
+        tokens["fp32"] += reference_ids.shape[1] - prompt_length
+        tokens[label] += candidate_ids.shape[1] - prompt_length
+        exact += int(torch.equal(reference_ids, candidate_ids))
+
+        if reference_ids.shape[1] > prompt_length:
+            reference_logprobs = next_token_logprobs(reference, reference_ids, prompt_length)
+            candidate_logprobs = next_token_logprobs(candidate, reference_ids, prompt_length)
+            agreements.extend(
+                (reference_logprobs.argmax(-1) == candidate_logprobs.argmax(-1)).tolist()
+            )
+            kl = (reference_logprobs.exp() * (reference_logprobs - candidate_logprobs)).sum(-1)
+            kls.extend(kl.tolist())
+
+    return {
+        "model": model_name,
+        "precision": candidate.precision,
+        # Falls back to eager when compilation or export fails
+        "backend": candidate.backend,
+        "prompts": len(prompts),
+        "exact_match": round(exact / len(prompts), 3),
+        "top1_agreement": round(sum(agreements) / len(agreements), 4) if agreements else None,
+        "mean_kl": round(sum(kls) / len(kls), 5) if kls else None,
+        "memory_mb": {
+            "fp32": round(reference.nbytes / 2**20, 1),
+            label: round(candidate.nbytes / 2**20, 1),
+        },
+        "decode_tokens_per_sec": {
+            name: round(tokens[name] / seconds[name], 2) if seconds[name] else None for name in seconds
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a bf16, int8 or compiled model against its fp32 weights.")
+    parser.add_argument("--model", default="gpt2")
+    parser.add_argument("--precision", choices=("fp32", "bf16", "int8"), default="int8")
+    parser.add_argument("--backend", choices=("eager", "compile", "onnx"), default="eager",
+                        help="How the candidate model runs; the fp32 reference is always eager")
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    parser.add_argument("--min-top1-agreement", type=float, default=0.9,
+                        help="Exit non-zero when top-1 agreement with fp32 falls below this")
+    args = parser.parse_args()
+
+    report = compare(args.model, args.precision, default_prompts(), args.max_new_tokens, args.backend)
+    print(json.dumps(report, indent=2))
+    agreement = report["top1_agreement"]
+    sys.exit(0 if agreement is None or agreement >= args.min_top1_agreement else 1)
+
+
+if __name__ == "__main__":
+    main()
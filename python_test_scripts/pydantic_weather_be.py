@@ -6,24 +6,116 @@ from __future__ import annotations as _annotations
 
 import asyncio
 import os
-from dataclasses import dataclass
-from typing import Any
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable
 
 import logfire
 from devtools import debug
-from httpx import AsyncClient
+from httpx import AsyncClient, Limits, Timeout
 
 from pydantic_ai import Agent, ModelRetry, RunContext
 
 # 'if-token-present' means nothing will be sent (and the example will work) if you don't have logfire configured
 logfire.configure(send_to_logfire='if-token-present')
 
+# Overridable so the tools can run against a local stub (see weather_load_test.py)
+GEO_API_URL = os.getenv('GEO_API_URL', 'https://geocode.maps.co/search')
+WEATHER_API_URL = os.getenv('WEATHER_API_URL', 'https://api.tomorrow.io/v4/weather/realtime')
+
+# https://docs.tomorrow.io/reference/data-layers-weather-codes
+WEATHER_CODES = {
+    1000: 'Clear, Sunny',
+    1100: 'Mostly Clear',
+    1101: 'Partly Cloudy',
+    1102: 'Mostly Cloudy',
+    1001: 'Cloudy',
+    2000: 'Fog',
+    2100: 'Light Fog',
+    4000: 'Drizzle',
+    4001: 'Rain',
+    4200: 'Light Rain',
+    4201: 'Heavy Rain',
+    5000: 'Snow',
+    5001: 'Flurries',
+    5100: 'Light Snow',
+    5101: 'Heavy Snow',
+    6000: 'Freezing Drizzle',
+    6001: 'Freezing Rain',
+    6200: 'Light Freezing Rain',
+    6201: 'Heavy Freezing Rain',
+    7000: 'Ice Pellets',
+    7101: 'Heavy Ice Pellets',
+    7102: 'Light Ice Pellets',
+    8000: 'Thunderstorm',
+}
+
+
+class TTLCache:
+    """LRU cache whose entries expire after `ttl` seconds.
+
+    Concurrent misses for the same key share one fetch, so ten simultaneous questions about
+    London make one API call. Failed fetches are not cached.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if self.maxsize <= 0:
+            # caching disabled
+            self.misses += 1
+            return await fetch()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.hits += 1
+        # shielded: one caller giving up must not cancel the fetch the others wait on
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        value = await fetch()
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+
+def make_client(max_connections: int = 20) -> AsyncClient:
+    """One client for every tool call, so concurrent lookups share pooled keep-alive connections."""
+    return AsyncClient(
+        limits=Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=Timeout(10.0),
+    )
+
 
 @dataclass
 class Deps:
     client: AsyncClient
     weather_api_key: str | None
     geo_api_key: str | None
+    # places don't move, so geocoding results can be kept much longer than the weather
+    geo_cache: TTLCache = field(default_factory=lambda: TTLCache(maxsize=4096, ttl=24 * 3600))
+    weather_cache: TTLCache = field(default_factory=lambda: TTLCache(maxsize=1024, ttl=600))
+    geo_url: str = GEO_API_URL
+    weather_url: str = WEATHER_API_URL
 
 
 weather_agent = Agent(
@@ -33,14 +125,86 @@ weather_agent = Agent(
     system_prompt=(
         'Be concise, reply with one sentence.'
         'Use the `get_lat_lng` tool to get the latitude and longitude of the locations, '
-        'then use the `get_weather` tool to get the weather.'
+        'then use the `get_weather` tool to get the weather. '
+        'When asked about several locations, use `get_weather_for_locations` once with all of them.'
     ),
     deps_type=Deps,
     retries=2,
     instrument=True,
+    # the model is only needed for a run, so the tools can be imported (e.g. by the load test) without an API key
+    defer_model_check=True,
 )
 
 
+def normalize_location(location_description: str) -> str:
+    return ' '.join(location_description.lower().split())
+
+
+async def geocode(deps: Deps, location_description: str) -> dict[str, float]:
+    """Latitude and longitude of a location, cached on its normalized description."""
+    if deps.geo_api_key is None:
+        # if no API key is provided, return a dummy response (London)
+        return {'lat': 51.1, 'lng': -0.1}
+
+    async def fetch() -> dict[str, float]:
+        params = {
+            'q': location_description,
+            'api_key': deps.geo_api_key,
+        }
+        with logfire.span('calling geocode API', params=params) as span:
+            r = await deps.client.get(deps.geo_url, params=params)
+            r.raise_for_status()
+            data = r.json()
+            span.set_attribute('response', data)
+
+        if data:
+            return {'lat': float(data[0]['lat']), 'lng': float(data[0]['lon'])}
+        else:
+            raise ModelRetry('Could not find the location')
+
+    return await deps.geo_cache.get_or_fetch(normalize_location(location_description), fetch)
+
+
+async def fetch_weather(deps: Deps, lat: float, lng: float) -> dict[str, Any]:
+    """Current weather at a point, cached per ~1 km grid cell (lat/lng rounded to 2 decimals)."""
+    if deps.weather_api_key is None:
+        # if no API key is provided, return a dummy response
+        return {'temperature': '21 °C', 'description': 'Sunny'}
+
+    lat, lng = round(lat, 2), round(lng, 2)
+
+    async def fetch() -> dict[str, Any]:
+        params = {
+            'apikey': deps.weather_api_key,
+            'location': f'{lat},{lng}',
+            'units': 'metric',
+        }
+        with logfire.span('calling weather API', params=params) as span:
+            r = await deps.client.get(deps.weather_url, params=params)
+            r.raise_for_status()
+            data = r.json()
+            span.set_attribute('response', data)
+
+        values = data['data']['values']
+        return {
+            'temperature': f'{values["temperatureApparent"]:0.0f}°C',
+            'description': WEATHER_CODES.get(values['weatherCode'], 'Unknown'),
+        }
+
+    return await deps.weather_cache.get_or_fetch((lat, lng), fetch)
+
+
+async def weather_at(deps: Deps, location_description: str) -> dict[str, Any]:
+    coordinates = await geocode(deps, location_description)
+    return await fetch_weather(deps, coordinates['lat'], coordinates['lng'])
+
+
+async def weather_for_locations(deps: Deps, location_descriptions: list[str]) -> dict[str, dict[str, Any]]:
+    """Weather at every location, looked up concurrently: N locations cost one location's latency."""
+    results = await asyncio.gather(*(weather_at(deps, location) for location in location_descriptions))
+    return dict(zip(location_descriptions, results))
+
+
 @weather_agent.tool
 async def get_lat_lng(
     ctx: RunContext[Deps], location_description: str
@@ -51,24 +215,7 @@ async def get_lat_lng(
         ctx: The context.
         location_description: A description of a location.
     """
-    if ctx.deps.geo_api_key is None:
-        # if no API key is provided, return a dummy response (London)
-        return {'lat': 51.1, 'lng': -0.1}
-
-    params = {
-        'q': location_description,
-        'api_key': ctx.deps.geo_api_key,
-    }
-    with logfire.span('calling geocode API', params=params) as span:
-        r = await ctx.deps.client.get('https://geocode.maps.co/search', params=params)
-        r.raise_for_status()
-        data = r.json()
-        span.set_attribute('response', data)
-
-    if data:
-        return {'lat': data[0]['lat'], 'lng': data[0]['lon']}
-    else:
-        raise ModelRetry('Could not find the location')
+    return await geocode(ctx.deps, location_description)
 
 
 @weather_agent.tool
@@ -80,58 +227,24 @@ async def get_weather(ctx: RunContext[Deps], lat: float, lng: float) -> dict[str
         lat: Latitude of the location.
         lng: Longitude of the location.
     """
-    if ctx.deps.weather_api_key is None:
-        # if no API key is provided, return a dummy response
-        return {'temperature': '21 °C', 'description': 'Sunny'}
+    return await fetch_weather(ctx.deps, lat, lng)
 
-    params = {
-        'apikey': ctx.deps.weather_api_key,
-        'location': f'{lat},{lng}',
-        'units': 'metric',
-    }
-    with logfire.span('calling weather API', params=params) as span:
-        r = await ctx.deps.client.get(
-            'https://api.tomorrow.io/v4/weather/realtime', params=params
-        )
-        r.raise_for_status()
-        data = r.json()
-        span.set_attribute('response', data)
-
-    values = data['data']['values']
-    # https://docs.tomorrow.io/reference/data-layers-weather-codes
-    code_lookup = {
-        1000: 'Clear, Sunny',
-        1100: 'Mostly Clear',
-        1101: 'Partly Cloudy',
-        1102: 'Mostly Cloudy',
-        1001: 'Cloudy',
-        2000: 'Fog',
-        2100: 'Light Fog',
-        4000: 'Drizzle',
-        4001: 'Rain',
-        4200: 'Light Rain',
-        4201: 'Heavy Rain',
-        5000: 'Snow',
-        5001: 'Flurries',
-        5100: 'Light Snow',
-        5101: 'Heavy Snow',
-        6000: 'Freezing Drizzle',
-        6001: 'Freezing Rain',
-        6200: 'Light Freezing Rain',
-        6201: 'Heavy Freezing Rain',
-        7000: 'Ice Pellets',
-        7101: 'Heavy Ice Pellets',
-        7102: 'Light Ice Pellets',
-        8000: 'Thunderstorm',
-    }
-    return {
-        'temperature': f'{values["temperatureApparent"]:0.0f}°C',
-        'description': code_lookup.get(values['weatherCode'], 'Unknown'),
-    }
+
+@weather_agent.tool
+async def get_weather_for_locations(
+    ctx: RunContext[Deps], location_descriptions: list[str]
+) -> dict[str, dict[str, Any]]:
+    """Get the weather at several locations at once.
+
+    Args:
+        ctx: The context.
+        location_descriptions: Descriptions of the locations.
+    """
+    return await weather_for_locations(ctx.deps, location_descriptions)
 
 
 async def main():
-    async with AsyncClient() as client:
+    async with make_client() as client:
         # create a free API key at https://www.tomorrow.io/weather-api/
         weather_api_key = os.getenv('WEATHER_API_KEY')
         # create a free API key at https://geocode.maps.co/
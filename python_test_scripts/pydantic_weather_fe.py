@@ -6,11 +6,12 @@ from __future__ import annotations as _annotations
 
 import json
 import os
+import time
+from dataclasses import dataclass, field
+from typing import Any
 
-from httpx import AsyncClient
-
-from pydantic_ai.messages import ToolCallPart, ToolReturnPart
-from pydantic_ai_examples.weather_agent import Deps, weather_agent
+from pydantic_ai.messages import ModelMessage, ToolCallPart, ToolReturnPart
+from pydantic_weather_be import Deps, make_client, weather_agent
 
 try:
     import gradio as gr
@@ -19,72 +20,110 @@ except ImportError as e:
         'Please install gradio with `pip install gradio`. You must use python>=3.10.'
     ) from e
 
-TOOL_TO_DISPLAY_NAME = {'get_lat_lng': 'Geocoding API', 'get_weather': 'Weather API'}
+TOOL_TO_DISPLAY_NAME = {
+    'get_lat_lng': 'Geocoding API',
+    'get_weather': 'Weather API',
+    'get_weather_for_locations': 'Geocoding and Weather APIs',
+}
+# most chatbot updates sent per second while a reply streams; chunks in between are coalesced
+STREAM_FPS = float(os.getenv('STREAM_FPS', '20'))
 
-client = AsyncClient()
+client = make_client()
 weather_api_key = os.getenv('WEATHER_API_KEY')
 # create a free API key at https://geocode.maps.co/
 geo_api_key = os.getenv('GEO_API_KEY')
 deps = Deps(client=client, weather_api_key=weather_api_key, geo_api_key=geo_api_key)
 
 
-async def stream_from_agent(prompt: str, chatbot: list[dict], past_messages: list):
-    chatbot.append({'role': 'user', 'content': prompt})
-    yield gr.Textbox(interactive=False, value=''), chatbot, gr.skip()
+@dataclass
+class ConversationState:
+    """Chatbot messages and agent history of one session.
+
+    Messages are only appended (undo and retry truncate), and tool-call messages are indexed by
+    tool_call_id, so attaching a tool's output doesn't scan the whole conversation.
+    """
+
+    messages: list[dict[str, Any]] = field(default_factory=list)
+    past_messages: list[ModelMessage] = field(default_factory=list)
+    tool_messages: dict[str, dict[str, Any]] = field(default_factory=dict)
+    # chatbot index of each prompt -> length of the agent history before it, for undo and retry
+    turn_starts: dict[int, int] = field(default_factory=dict)
+
+    def add_prompt(self, prompt: str):
+        self.turn_starts[len(self.messages)] = len(self.past_messages)
+        self.append('user', prompt)
+
+    def append(self, role: str, content: str, metadata: dict[str, Any] | None = None) -> dict[str, Any]:
+        message = {'role': role, 'content': content}
+        if metadata:
+            message['metadata'] = metadata
+            if 'id' in metadata:
+                self.tool_messages[metadata['id']] = message
+        self.messages.append(message)
+        return message
+
+    def add_tool_call(self, call: ToolCallPart):
+        metadata = {'title': f'🛠️ Using {TOOL_TO_DISPLAY_NAME.get(call.tool_name, call.tool_name)}'}
+        if call.tool_call_id is not None:
+            metadata['id'] = call.tool_call_id
+        self.append('assistant', 'Parameters: ' + call.args_as_json_str(), metadata)
+
+    def add_tool_return(self, part: ToolReturnPart):
+        message = self.tool_messages.get(part.tool_call_id)
+        if message is not None:
+            message['content'] += f'\nOutput: {json.dumps(part.content)}'
+
+    def truncate(self, index: int):
+        """Drops chatbot messages from index on, and the agent history of the turns they belong to."""
+        self.past_messages = self.past_messages[: self.turn_starts.get(index, len(self.past_messages))]
+        self.turn_starts = {start: length for start, length in self.turn_starts.items() if start < index}
+        self.messages = self.messages[:index]
+        self.tool_messages = {
+            message['metadata']['id']: message
+            for message in self.messages
+            if 'id' in message.get('metadata', {})
+        }
+
+
+async def stream_from_agent(prompt: str, state: ConversationState):
+    state.add_prompt(prompt)
+    yield gr.Textbox(interactive=False, value=''), state.messages, gr.skip()
     async with weather_agent.run_stream(
-        prompt, deps=deps, message_history=past_messages
+        prompt, deps=deps, message_history=state.past_messages
     ) as result:
         for message in result.new_messages():
             for call in message.parts:
                 if isinstance(call, ToolCallPart):
-                    call_args = (
-                        call.args.args_json
-                        if hasattr(call.args, 'args_json')
-                        else json.dumps(call.args.args_dict)
-                    )
-                    metadata = {
-                        'title': f'🛠️ Using {TOOL_TO_DISPLAY_NAME[call.tool_name]}',
-                    }
-                    if call.tool_call_id is not None:
-                        metadata['id'] = {call.tool_call_id}
-
-                    gr_message = {
-                        'role': 'assistant',
-                        'content': 'Parameters: ' + call_args,
-                        'metadata': metadata,
-                    }
-                    chatbot.append(gr_message)
+                    state.add_tool_call(call)
                 if isinstance(call, ToolReturnPart):
-                    for gr_message in chatbot:
-                        if (
-                            gr_message.get('metadata', {}).get('id', '')
-                            == call.tool_call_id
-                        ):
-                            gr_message['content'] += (
-                                f'\nOutput: {json.dumps(call.content)}'
-                            )
-                yield gr.skip(), chatbot, gr.skip()
-        chatbot.append({'role': 'assistant', 'content': ''})
-        async for message in result.stream_text():
-            chatbot[-1]['content'] = message
-            yield gr.skip(), chatbot, gr.skip()
-        past_messages = result.all_messages()
-
-        yield gr.Textbox(interactive=True), gr.skip(), past_messages
-
-
-async def handle_retry(chatbot, past_messages: list, retry_data: gr.RetryData):
-    new_history = chatbot[: retry_data.index]
-    previous_prompt = chatbot[retry_data.index]['content']
-    past_messages = past_messages[: retry_data.index]
-    async for update in stream_from_agent(previous_prompt, new_history, past_messages):
+                    state.add_tool_return(call)
+            yield gr.skip(), state.messages, gr.skip()
+        reply = state.append('assistant', '')
+        frame_interval = 1 / STREAM_FPS if STREAM_FPS > 0 else 0
+        last_frame = 0.0
+        async for text in result.stream_text():
+            reply['content'] = text
+            now = time.monotonic()
+            if now - last_frame >= frame_interval:
+                last_frame = now
+                yield gr.skip(), state.messages, gr.skip()
+        state.past_messages = result.all_messages()
+
+        # the last chunks may have been coalesced away
+        yield gr.Textbox(interactive=True), state.messages, state
+
+
+async def handle_retry(state: ConversationState, retry_data: gr.RetryData):
+    previous_prompt = state.messages[retry_data.index]['content']
+    state.truncate(retry_data.index)
+    async for update in stream_from_agent(previous_prompt, state):
         yield update
 
 
-def undo(chatbot, past_messages: list, undo_data: gr.UndoData):
-    new_history = chatbot[: undo_data.index]
-    past_messages = past_messages[: undo_data.index]
-    return chatbot[undo_data.index]['content'], new_history, past_messages
+def undo(state: ConversationState, undo_data: gr.UndoData):
+    previous_prompt = state.messages[undo_data.index]['content']
+    state.truncate(undo_data.index)
+    return previous_prompt, state.messages, state
 
 
 def select_data(message: gr.SelectData) -> str:
@@ -105,7 +144,7 @@ with gr.Blocks() as demo:
 </div>
 """
     )
-    past_messages = gr.State([])
+    conversation = gr.State(ConversationState())
     chatbot = gr.Chatbot(
         label='Packing Assistant',
         type='messages',
@@ -123,14 +162,12 @@ with gr.Blocks() as demo:
         )
     generation = prompt.submit(
         stream_from_agent,
-        inputs=[prompt, chatbot, past_messages],
-        outputs=[prompt, chatbot, past_messages],
+        inputs=[prompt, conversation],
+        outputs=[prompt, chatbot, conversation],
     )
     chatbot.example_select(select_data, None, [prompt])
-    chatbot.retry(
-        handle_retry, [chatbot, past_messages], [prompt, chatbot, past_messages]
-    )
-    chatbot.undo(undo, [chatbot, past_messages], [prompt, chatbot, past_messages])
+    chatbot.retry(handle_retry, [conversation], [prompt, chatbot, conversation])
+    chatbot.undo(undo, [conversation], [prompt, chatbot, conversation])
 
 
 if __name__ == '__main__':
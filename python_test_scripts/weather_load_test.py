@@ -0,0 +1,131 @@
+# To run:
+# python weather_load_test.py --queries 200 --locations 3 --latency 0.1
+#
+# Starts a stub geocoding/weather server on localhost and runs the weather tools against it,
+# one location after another without caching (how the agent used to call them), then all
+# locations of a query concurrently, then concurrently through the caches.
+
+
+from __future__ import annotations as _annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import logfire
+
+from pydantic_weather_be import Deps, TTLCache, fetch_weather, geocode, make_client, weather_for_locations
+
+PLACES = [
+    'London', 'Wiltshire', 'Miami', 'New York City', 'Paris', 'Tokyo', 'Berlin', 'Madrid',
+    'Lagos', 'Sydney', 'Toronto', 'Mumbai', 'Cairo', 'Lima', 'Oslo', 'Seoul',
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers like geocode.maps.co and tomorrow.io after a fixed delay, counting requests per path."""
+
+    # keep-alive, so the client's connection pool is exercised
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.1
+    requests = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with self.lock:
+            self.requests[url.path] += 1
+        time.sleep(self.latency)
+        if url.path == '/search':
+            digest = hashlib.sha256(query['q'][0].lower().encode()).digest()
+            body = [{'lat': str(digest[0] / 255 * 180 - 90), 'lon': str(digest[1] / 255 * 360 - 180)}]
+        else:
+            body = {'data': {'values': {'temperatureApparent': 18.4, 'weatherCode': 1101}}}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def serial_lookup(deps: Deps, locations: list[str]):
+    for location in locations:
+        coordinates = await geocode(deps, location)
+        await fetch_weather(deps, coordinates['lat'], coordinates['lng'])
+
+
+async def run(name, lookup, deps, queries, concurrency):
+    StubHandler.requests.clear()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(locations):
+        async with semaphore:
+            started = time.perf_counter()
+            await lookup(deps, locations)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(locations) for locations in queries))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(
+        f'{name:>10}: {len(queries) / elapsed:7.1f} queries/s, '
+        f'p50 {statistics.median(latencies) * 1000:6.0f} ms, '
+        f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.0f} ms, '
+        f'upstream requests {sum(StubHandler.requests.values())}, '
+        f'cache hits geo {deps.geo_cache.hits} / weather {deps.weather_cache.hits}'
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Load test the weather tools against a local stub API.')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--locations', type=int, default=3, help='Locations per query')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.1, help='Stub response delay in seconds')
+    args = parser.parse_args()
+    # one span per API call would flood the console
+    logfire.configure(send_to_logfire='if-token-present', console=False)
+
+    StubHandler.latency = args.latency
+    # the default listen backlog of 5 would drop the burst of new pooled connections
+    ThreadingHTTPServer.request_queue_size = 256
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    rng = random.Random(0)
+    queries = [rng.sample(PLACES, args.locations) for _ in range(args.queries)]
+    try:
+        async with make_client(max_connections=args.concurrency * args.locations) as client:
+            def deps(cached):
+                kwargs = {} if cached else {'geo_cache': TTLCache(maxsize=0), 'weather_cache': TTLCache(maxsize=0)}
+                return Deps(
+                    client=client, weather_api_key='stub', geo_api_key='stub',
+                    geo_url=f'{base_url}/search', weather_url=f'{base_url}/v4/weather/realtime', **kwargs,
+                )
+
+            await run('serial', serial_lookup, deps(cached=False), queries, args.concurrency)
+            await run('concurrent', weather_for_locations, deps(cached=False), queries, args.concurrency)
+            await run('cached', weather_for_locations, deps(cached=True), queries, args.concurrency)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,9 +1,16 @@
 import os
+import threading
 from huggingface_hub import login, hf_hub_download
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModelForSeq2SeqLM
-from faster_whisper import WhisperModel
+from TranscriptionService import get_transcription_service
 from AudioRecorder import AudioRecorder
+from DictationPipeline import MicrophoneSource, StreamingDictation
 from dotenv import load_dotenv
+from ModelRegistry import model_registry
+from HuggingFaceAI import GenerationTimer
+from GenerationControl import GenerationController
+from Metrics import metrics, span
+from TranscriptArchive import TranscriptArchive
+from transformers import StoppingCriteriaList
 import torch
 
 # ########## Environment Setup ##########
@@ -16,82 +23,94 @@ def setup_environment():
     print("CUDA device name:", torch.cuda.get_device_name(0) if torch.cuda.is_available() else "No CUDA device")
 
 # ########## Model Utilities ##########
-def get_and_save_model_if_not_exists(model_name, save_directory="./models/", revision="main", model_type="causal"):
+def get_and_save_model_if_not_exists(model_name, save_directory="./models/", revision="main", model_type="causal",
+                                     precision=None):
     """
     Load or download a model and save it locally if not already present.
 
+    Models are served from the shared model registry, so repeated calls reuse the
+    already loaded instance and the device is chosen automatically (CUDA if available).
+    Precision defaults to MODEL_PRECISION (fp32, bf16 or int8), and INFERENCE_BACKEND picks eager
+    PyTorch, torch.compile or an ONNX Runtime export; the returned model's generate() works the same.
+
     Args:
         model_name (str): Name of the model to load.
         save_directory (str): Directory to save the model.
         revision (str): Model revision to use.
         model_type (str): Type of model ('causal' or 'seq2seq').
+        precision (str): 'fp32', 'bf16' or 'int8'; None uses the registry default.
 
     Returns:
         model: Loaded model.
     """
-    model_path = save_directory + model_name
-    if not os.path.exists(model_path):
-        print(f"Model '{model_name}' not found locally. Attempting to download...")
-    else:
-        print(f"Loading model '{model_name}' from local path.")
-
-    model_class = AutoModelForCausalLM if model_type == "causal" else AutoModelForSeq2SeqLM
-
-    try:
-        model = model_class.from_pretrained(
-            model_name if not os.path.exists(model_path) else model_path,
-            trust_remote_code=True,
-            torch_dtype=torch.float32,  # Use float32 to avoid quantization issues
-            revision=revision,  # Pin the revision
-            low_cpu_mem_usage=True  # Explicitly disable quantization
-        ).cuda()
-        if not os.path.exists(model_path):
-            model.save_pretrained(model_path)
-    except ValueError as e:
-        if "Unknown quantization type" in str(e):
-            raise ValueError(
-                f"Unsupported quantization type encountered for model '{model_name}'. "
-                "Please check the model configuration or use a different model."
-            ) from e
-        else:
-            raise
-    return model
+    return model_registry.get(
+        model_name, model_type=model_type, revision=revision, precision=precision, save_directory=save_directory
+    ).model
 
 # ########## Audio Transcription ##########
 def transcribe_audio(recording_path, model_size="large-v3"):
     """
     Transcribe audio using WhisperModel.
 
+    The model is loaded once by the shared TranscriptionService and reused by later calls.
+
     Args:
-        recording_path (str): Path to the audio file.
+        recording_path (str): Path to the audio file (or a 16 kHz mono float32 array).
         model_size (str): Size of the Whisper model.
 
     Returns:
         tuple: Transcription segments and language information.
     """
-    print("Initializing WhisperModel...")
-    model = WhisperModel(model_size, device="cuda", compute_type="float16")
+    service = get_transcription_service(model_size)
     print("Transcribing audio...")
-    segments, info = model.transcribe(recording_path, beam_size=5)
+    segments, info = service.transcribe(recording_path)
     print("Transcription completed.")
     print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
     return segments, info
 
-def format_transcription(segments):
+def stream_and_transcribe(record_seconds=30, model_size="large-v3"):
+    """
+    Record from the microphone and transcribe each utterance while recording continues.
+
+    Args:
+        record_seconds (float): How long to keep the microphone open.
+        model_size (str): Size of the Whisper model.
+
+    Returns:
+        str: Transcription text of all utterances.
+    """
+    source = MicrophoneSource()
+    timer = threading.Timer(record_seconds, source.stop)
+    timer.start()
+    texts = []
+    try:
+        dictation = StreamingDictation(get_transcription_service(model_size))
+        for result in dictation.run(source):
+            print("[%.2fs -> %.2fs] %s" % (result.start, result.end, result.text))
+            texts.append(result.text)
+    finally:
+        timer.cancel()
+        source.stop()
+    return " ".join(texts)
+
+def format_transcription(segments, archive=None, source=None):
     """
     Format transcription segments into a single text string.
 
     Args:
         segments (list): List of transcription segments.
+        archive (TranscriptArchive): Optional archive that keeps the segments with their timestamps.
+        source (str): Name of the recording in the archive.
 
     Returns:
         str: Formatted transcription text.
     """
-    whole_text = ""
+    segments = list(segments)
     for segment in segments:
         print("[%.2fs -> %.2fs] %s" % (segment.start, segment.end, segment.text))
-        whole_text += segment.text + " "
-    return whole_text.strip()
+    if archive is not None:
+        archive.add_transcript(segments, source=source)
+    return " ".join(segment.text.strip() for segment in segments).strip()
 
 # ########## LLM Interaction ##########
 def prepare_messages(system_prompt, user_input):
@@ -110,27 +129,54 @@ def prepare_messages(system_prompt, user_input):
         {"role": "user", "content": user_input}
     ]
 
-def generate_response(model, tokenizer, messages):
+CHAT_TEMPLATE = (
+    "{% if not add_generation_prompt is defined %}{% set add_generation_prompt = false %}{% endif %}"
+    "{% for message in messages %}{{'<|im_start|>' + message['role'] + '\n' + message['content'] + '<|im_end|>' + '\n'}}{% endfor %}"
+    "{% if add_generation_prompt %}{{ '<|im_start|>assistant\n' }}{% endif %}"
+)
+
+def generate_response(model, tokenizer, messages, assistant_model=None, prompt_lookup_num_tokens=None):
     """
     Generate a response from the LLM.
 
+    Greedy output is unchanged by the speculative options; they only make decoding faster when
+    the draft's (or the prompt's) tokens are usually accepted.
+
     Args:
         model: Loaded LLM model.
         tokenizer: Tokenizer for the model.
         messages (list): Messages to send to the LLM.
+        assistant_model: Optional small draft model sharing the tokenizer, for assisted generation.
+        prompt_lookup_num_tokens (int): Optional number of tokens to draft by copying n-grams from the prompt.
 
     Returns:
-        str: Generated response.
+        str: Generated response, without the echoed prompt.
     """
-    tokenizer.chat_template = (
-        "{% if not add_generation_prompt is defined %}{% set add_generation_prompt = false %}{% endif %}"
-        "{% for message in messages %}{{'<|im_start|>' + message['role'] + '\n' + message['content'] + '<|im_end|>' + '\n'}}{% endfor %}"
-        "{% if add_generation_prompt %}{{ '<|im_start|>assistant\n' }}{% endif %}"
+    # Assign the template only once; transformers caches the compiled template by its source text
+    if tokenizer.chat_template != CHAT_TEMPLATE:
+        tokenizer.chat_template = CHAT_TEMPLATE
+    with span("tokenize"):
+        inputs = tokenizer.apply_chat_template(messages, tokenize=True, return_tensors="pt").to(model.device)
+    print(f"Prompt is {inputs.shape[-1]} tokens")
+    speculative = {}
+    if assistant_model is not None:
+        speculative["assistant_model"] = assistant_model
+    elif prompt_lookup_num_tokens:
+        speculative["prompt_lookup_num_tokens"] = prompt_lookup_num_tokens
+    # Encoder-decoder models start decoding from a single start token rather than the prompt
+    prompt_length = 1 if model.config.is_encoder_decoder else inputs.shape[-1]
+    timer = GenerationTimer(None if model.config.is_encoder_decoder else prompt_length)
+    # The formatted script is about as long as the transcription, so size the budget from it, not the system prompt
+    controller = GenerationController.from_env()
+    max_new_tokens = controller.budget(len(tokenizer.encode(messages[-1]["content"])))
+    criteria = controller.stopping_criteria(tokenizer, prompt_length)
+    outputs = model.generate(
+        inputs, max_new_tokens=max_new_tokens, stopping_criteria=StoppingCriteriaList([timer] + criteria),
+        **speculative
     )
-    inputs = tokenizer.apply_chat_template(messages, tokenize=True, return_tensors="pt").to(model.device)
-    print("Contents of 'inputs':", inputs)
-    outputs = model.generate(inputs, max_new_tokens=512)
-    return tokenizer.decode(outputs[0], skip_special_tokens=True)
+    timer.record(inputs.shape[0])
+    with span("detokenize"):
+        return controller.finalize(tokenizer, outputs[:, prompt_length:], criteria)[0]
 
 # ########## Main Code ##########
 if __name__ == "__main__":
@@ -162,22 +208,50 @@ if __name__ == "__main__":
     save_directory = "./models/"
 
     #initiale tokenizer and model
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
     model = get_and_save_model_if_not_exists(model_name, save_directory, model_type=model_type)
+    tokenizer = model_registry.get(model_name, model_type=model_type).tokenizer
+
+    # Optional speculative decoding: SPECULATIVE_MODE=draft with a smaller model of the same family
+    # (TRANSCRIBE_DRAFT_MODEL, e.g. google/flan-t5-small for flan-t5-large), or prompt_lookup to copy spans
+    # from the transcription. The backend's SPECULATIVE_DRAFT_MODEL is a causal model for its own formatter.
+    speculative_mode = os.getenv("SPECULATIVE_MODE", "off")
+    assistant_model = None
+    prompt_lookup_num_tokens = None
+    if speculative_mode == "draft":
+        draft_model_name = os.getenv("TRANSCRIBE_DRAFT_MODEL", "google/flan-t5-small")
+        assistant_model = get_and_save_model_if_not_exists(draft_model_name, save_directory, model_type=model_type)
+        # The draft's proposals are verified token by token, so both models must use the same vocabulary
+        draft_tokenizer = model_registry.get(draft_model_name, model_type=model_type).tokenizer
+        if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            print(f"Draft model '{draft_model_name}' has a different vocabulary, speculative decoding is off")
+            assistant_model = None
+    elif speculative_mode == "prompt_lookup":
+        prompt_lookup_num_tokens = int(os.getenv("PROMPT_LOOKUP_TOKENS", "10"))
+
+    # Keep transcripts and scripts searchable by word, character and time (TRANSCRIPT_ARCHIVE_PATH)
+    archive = TranscriptArchive(os.getenv("TRANSCRIPT_ARCHIVE_PATH")) if os.getenv("TRANSCRIPT_ARCHIVE_PATH") else None
+    recording_source = None
 
     # Start Audio recording 
     record = True
     use_test_transcription = True
-    if(record and not use_test_transcription): #is we are not using the test transcription later
+    stream_dictation = False # transcribe utterances while recording instead of after
+    if(record and stream_dictation and not use_test_transcription):
+        print("Starting streaming dictation...")
+        whole_text = stream_and_transcribe(record_seconds=30)
+        print("Transcription Text:", whole_text)
+        messages = prepare_messages(system_prompt, whole_text)
+    elif(record and not use_test_transcription): #is we are not using the test transcription later
         print("Starting audio recording...")
         recorder = AudioRecorder(output_filename="./recordings/test.wav")
-        recorder.record(record_seconds=30)
+        save_recording = False # also write ./recordings/test.wav
+        audio = recorder.record(record_seconds=30, save_to_disk=save_recording)
         print("Audio recording completed.")
 
-        # Transcribe audio
-        recording_path = "./recordings/test.wav"
-        segments, info = transcribe_audio(recording_path)
-        whole_text = format_transcription(segments)
+        # Transcribe the in-memory audio directly, no WAV round-trip
+        segments, info = transcribe_audio(audio)
+        recording_source = recorder.output_filename
+        whole_text = format_transcription(segments, archive, source=recording_source)
         print("Transcription Text:", whole_text)
 
         # Generate response
@@ -193,6 +267,11 @@ if __name__ == "__main__":
     
     # Output response
     print("Generated Output:")
-    response = generate_response(model, tokenizer, messages)
+    response = generate_response(model, tokenizer, messages, assistant_model, prompt_lookup_num_tokens)
     print(response)
+    if archive is not None:
+        archive.add_script(response, source=recording_source)
+        archive.close()
+    if os.getenv("PRINT_METRICS") == "1":
+        print(metrics.render())
     print("FIN!")
\ No newline at end of file
@@ -0,0 +1,58 @@
+import logging
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from HuggingFaceAI import HuggingFaceAI
+
+
+def tiny_model():
+    """A randomly initialized one-layer GPT-2 with a whitespace word-level tokenizer, built without downloads."""
+    words = ["[UNK]", "[PAD]", "john", "walks", "in", "mary", "says", "hi", "the", "script", "format", "."]
+    tokenizer_model = tokenizers.models.WordLevel({word: index for index, word in enumerate(words)}, unk_token="[UNK]")
+    backend = tokenizers.Tokenizer(tokenizer_model)
+    backend.normalizer = tokenizers.normalizers.Lowercase()
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="[UNK]", pad_token="[PAD]")
+    tokenizer.padding_side = "left"
+    config = transformers.GPT2Config(vocab_size=len(words), n_positions=1024, n_embd=16, n_layer=1, n_head=2)
+    model = transformers.GPT2LMHeadModel(config).eval()
+    model.generation_config.pad_token_id = tokenizer.pad_token_id
+    return SimpleNamespace(
+        name="tiny", model_type="causal", model=model, tokenizer=tokenizer, device="cpu", precision="fp32",
+        backend="eager", pipeline=object(),
+    )
+
+
+class FixedRegistry:
+    def __init__(self, loaded):
+        self.loaded = loaded
+
+    def get(self, name, **kwargs):
+        return self.loaded
+
+
+def test_format_batch_uses_the_prefix_cache(caplog, monkeypatch):
+    monkeypatch.setenv("SPECULATIVE_MODE", "off")
+    ai = HuggingFaceAI("tiny", registry=FixedRegistry(tiny_model()))
+    ai.tokenizer = ai.registry.loaded.tokenizer
+    ai._pipeline_ready = True
+
+    def full_prompt_path(*args, **kwargs):
+        raise AssertionError("format_batch fell back to the full prompt")
+
+    monkeypatch.setattr(ai, "generate_batch", full_prompt_path)
+    with caplog.at_level(logging.WARNING):
+        outputs = ai.format_batch(["John walks in.", "Mary says hi."], max_new_tokens=3)
+
+    assert "Prefix cache unavailable" not in caplog.text
+    assert len(outputs) == 2 and all(isinstance(output, str) for output in outputs)
+    assert ai._prefix_cache is not None
@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ScreenplayFormatter import ACTION, AMBIGUOUS, CHARACTER, DIALOGUE, parse
+from ScriptChunker import split_turns
+
+
+def kinds_and_text(script):
+    return [(element.kind, element.text) for element in parse(script)]
+
+
+def test_two_word_names_stay_whole():
+    assert kinds_and_text("Mary Ann: hello there.") == [(CHARACTER, "MARY ANN"), (DIALOGUE, "hello there.")]
+    assert kinds_and_text("MARY ANN: hello") == [(CHARACTER, "MARY ANN"), (DIALOGUE, "hello")]
+
+
+def test_honorifics_stay_with_the_name():
+    assert kinds_and_text("Dr. Smith: Hi.") == [(CHARACTER, "DR. SMITH"), (DIALOGUE, "Hi.")]
+    assert kinds_and_text("He waves. Mrs. Jones: Hello!") == [
+        (ACTION, "He waves."),
+        (CHARACTER, "MRS. JONES"),
+        (DIALOGUE, "Hello!"),
+    ]
+
+
+def test_several_turns_on_one_line():
+    assert split_turns("John: Hey, how are you? Mary Ann: Fine.  John: Good.") == [
+        "John: Hey, how are you?",
+        "Mary Ann: Fine.",
+        "John: Good.",
+    ]
+
+
+def test_turns_only_start_a_line_or_a_sentence():
+    assert split_turns("He said to Mary: no.") == ["He said to Mary: no."]
+    assert kinds_and_text("He said to Mary: no.") == [(ACTION, "He said to Mary: no.")]
+
+
+def test_colon_prose_is_ambiguous():
+    assert kinds_and_text("The Time: midnight.") == [(AMBIGUOUS, "The Time: midnight.")]
+    assert kinds_and_text("Note: the door is locked.") == [(AMBIGUOUS, "Note: the door is locked.")]
@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from TranscriptArchive import TranscriptArchive, character_names
+
+
+def test_character_names_keep_two_word_names_and_honorifics():
+    assert character_names("MARY ANN: hello. Dr. Smith: Hi.") == ["MARY ANN", "DR. SMITH"]
+
+
+def test_search_by_two_word_and_honorific_characters(tmp_path):
+    archive = TranscriptArchive(str(tmp_path))
+    archive.add_transcript([
+        {"start": 0.0, "end": 2.0, "text": "MARY ANN: hello there."},
+        {"start": 2.0, "end": 4.0, "text": "Dr. Smith: Hi."},
+    ])
+    archive.add_transcript([{"start": 4.0, "end": 6.0, "text": "The Time: midnight."}])
+    assert [match.start for match in archive.search(character="Mary Ann")] == [0.0]
+    assert [match.start for match in archive.search(character="DR. SMITH")] == [2.0]
+    assert archive.search(character="ANN") == []
+    assert archive.search(character="TIME") == []
+    archive.close()
+
+
+def test_query_without_words_matches_nothing(tmp_path):
+    archive = TranscriptArchive(str(tmp_path))
+    archive.add_transcript([{"start": 0.0, "end": 1.0, "text": "Hello there."}])
+    assert archive.search("!!!") == []
+    assert len(archive.search("hello")) == 1
+    archive.close()
+
+
+def test_torn_document_line_is_cut_before_the_next_add(tmp_path):
+    archive = TranscriptArchive(str(tmp_path))
+    archive.add_transcript([{"start": 0.0, "end": 1.0, "text": "Before the crash."}])
+    archive.close()
+    # A crash while committing a second document leaves half of its line behind
+    with open(tmp_path / "documents.jsonl", "a", encoding="utf-8") as documents_file:
+        documents_file.write('{"id": 1, "kind": "transc')
+
+    archive = TranscriptArchive(str(tmp_path))
+    assert len(archive.documents) == 1
+    archive.add_transcript([{"start": 0.0, "end": 1.0, "text": "After the crash."}])
+    archive.close()
+
+    archive = TranscriptArchive(str(tmp_path))
+    assert [document["id"] for document in archive.documents] == [0, 1]
+    assert [match.text for match in archive.search("crash")] == ["Before the crash.", "After the crash."]
+    archive.close()